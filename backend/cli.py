@@ -0,0 +1,505 @@
+"""Command-line tooling for The Fork backend.
+
+python cli.py replay capture.jsonl --target http://127.0.0.1:8000 --speed 4
+python cli.py mock-upstream --port 9100 --latency-ms 800
+python cli.py batch evals.jsonl --out results.jsonl --concurrency 8
+"""
+
+import asyncio
+import json
+import statistics
+import threading
+import gzip
+import random
+import time
+import uuid
+import zlib
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+import typer
+import uvicorn
+
+import compression
+import mock_upstream
+from traffic import load_capture
+
+app = typer.Typer(help="The Fork backend tooling.", no_args_is_help=True)
+
+_WORDS = "miles bar engine rain coffee bruise road receipt highway diner ".split()
+
+
+def _filler(length: int) -> str:
+    words = _WORDS * (length // 40 + 1)
+    return " ".join(words)[: max(1, length)]
+
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {
+            "count": 0,
+            "mean": None,
+            "p50": None,
+            "p90": None,
+            "p95": None,
+            "p99": None,
+            "max": None,
+        }
+    ordered = sorted(values)
+
+    def pick(q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+    return {
+        "count": len(ordered),
+        "mean": statistics.fmean(ordered),
+        "p50": pick(0.50),
+        "p90": pick(0.90),
+        "p95": pick(0.95),
+        "p99": pick(0.99),
+        "max": ordered[-1],
+    }
+
+
+def _print_distribution(title: str, dist: Dict[str, Optional[float]]) -> None:
+    typer.echo(f"{title}: n={dist['count']}")
+    if not dist["count"]:
+        return
+    typer.echo(
+        "  "
+        + "  ".join(
+            f"{k}={dist[k] * 1000:.1f}ms"  # type: ignore[operator]
+            for k in ("mean", "p50", "p90", "p95", "p99", "max")
+        )
+    )
+
+
+def synthesize_request(record: dict, sessions: Dict[str, str]) -> dict:
+    """Rebuild a ChatRequest body with the recorded shape and filler text."""
+    session = sessions.setdefault(record.get("session", ""), str(uuid.uuid4()))
+    return {
+        "forkStatement": _filler(record.get("forkLength") or 60),
+        "intensity": record.get("intensity", "mild"),
+        "sessionId": session,
+        "messages": [
+            {"role": m["role"], "content": _filler(m["length"])}
+            for m in record.get("messages", [])
+        ],
+    }
+
+
+class ServerStartError(RuntimeError):
+    pass
+
+
+class BackgroundServer:
+    """Run an ASGI app with uvicorn on a daemon thread."""
+
+    def __init__(self, asgi_app, host: str, port: int, start_timeout: float = 10.0):
+        self.address = f"{host}:{port}"
+        self.start_timeout = start_timeout
+        self.server = uvicorn.Server(
+            uvicorn.Config(asgi_app, host=host, port=port, log_level="warning")
+        )
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def __enter__(self) -> "BackgroundServer":
+        self.thread.start()
+        deadline = time.monotonic() + self.start_timeout
+        while not self.server.started:
+            if not self.thread.is_alive():
+                raise ServerStartError(
+                    f"Server on {self.address} failed to start "
+                    "(is the port already in use?)"
+                )
+            if time.monotonic() > deadline:
+                self.__exit__()
+                raise ServerStartError(
+                    f"Server on {self.address} did not start within "
+                    f"{self.start_timeout:g}s"
+                )
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.server.should_exit = True
+        self.thread.join(timeout=5)
+
+
+async def _replay(
+    records: List[dict],
+    target: str,
+    speed: float,
+    timeout: float,
+    transport: Optional[httpx.AsyncBaseTransport] = None,
+) -> dict:
+    sessions: Dict[str, str] = {}
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+
+    offsets: List[float] = []
+    elapsed = 0.0
+    for rec in records:
+        gap = rec.get("interArrivalSeconds") or 0.0
+        elapsed += gap / speed if speed > 0 else 0.0
+        offsets.append(elapsed)
+
+    async with httpx.AsyncClient(
+        base_url=target, timeout=timeout, transport=transport
+    ) as http:
+
+        async def fire(
+            rec: dict, at: float, t0: float, after: Optional[asyncio.Task]
+        ) -> None:
+            await asyncio.sleep(max(0.0, t0 + at - time.perf_counter()))
+            if after is not None:
+                # Like a real client, wait for the session's previous reply;
+                # an overlapping turn would supersede it (409).
+                await asyncio.wait([after])
+            body = synthesize_request(rec, sessions)
+            start = time.perf_counter()
+            try:
+                resp = await http.post("/api/chat", json=body)
+                key = str(resp.status_code)
+            except httpx.HTTPError as e:
+                key = type(e).__name__
+            latencies.append(time.perf_counter() - start)
+            statuses[key] = statuses.get(key, 0) + 1
+
+        t0 = time.perf_counter()
+        last: Dict[str, asyncio.Task] = {}
+        tasks = []
+        for rec, at in zip(records, offsets):
+            session = rec.get("session", "")
+            task = asyncio.create_task(fire(rec, at, t0, last.get(session)))
+            tasks.append(task)
+            last[session] = task
+        await asyncio.gather(*tasks)
+        wall = time.perf_counter() - t0
+
+    return {
+        "requests": len(records),
+        "wallSeconds": wall,
+        "throughputRps": len(records) / wall if wall else None,
+        "statuses": statuses,
+        "latency": percentiles(latencies),
+    }
+
+
+@app.command()
+def replay(
+    capture: Path = typer.Argument(
+        ..., exists=True, help="JSONL capture written by TRAFFIC_CAPTURE_PATH"
+    ),
+    target: str = typer.Option(
+        "http://127.0.0.1:8000", help="Base URL of the server under test"
+    ),
+    speed: float = typer.Option(
+        1.0,
+        help="Replay speed multiplier; 0 fires everything at once. Turns of one "
+        "session always wait for the previous reply, so a newer turn never "
+        "supersedes an older one (CHAT_SUPERSEDE).",
+    ),
+    mock: bool = typer.Option(
+        True, help="Serve a mock upstream that replays recorded upstream timings"
+    ),
+    mock_port: int = typer.Option(9100, help="Port for the mock upstream"),
+    timeout: float = typer.Option(60.0, help="Per-request client timeout in seconds"),
+    json_out: Optional[Path] = typer.Option(None, help="Also write the report as JSON"),
+):
+    """Replay a recorded traffic shape against a running server."""
+    records = load_capture(capture)
+    if not records:
+        typer.echo("Capture is empty.")
+        raise typer.Exit(code=1)
+
+    recorded_upstream = [
+        r["upstream"]["latencySeconds"] for r in records if r.get("upstream")
+    ]
+    reply_lengths = [r["replyLength"] for r in records if r.get("replyLength")]
+
+    def run() -> dict:
+        return asyncio.run(_replay(records, target, speed, timeout))
+
+    if mock:
+        typer.echo(
+            f"Mock upstream on http://127.0.0.1:{mock_port} — start the server with "
+            f"OPENROUTER_BASE_URL=http://127.0.0.1:{mock_port}"
+        )
+        mock_app = mock_upstream.create_app(recorded_upstream, reply_lengths)
+        try:
+            with BackgroundServer(mock_app, "127.0.0.1", mock_port):
+                report = run()
+        except ServerStartError as e:
+            typer.echo(f"Mock upstream: {e}", err=True)
+            raise typer.Exit(code=1)
+    else:
+        report = run()
+
+    report["recordedUpstreamLatency"] = percentiles(recorded_upstream)
+    report["recordedEndToEndLatency"] = percentiles(
+        [r["latencySeconds"] for r in records if r.get("latencySeconds") is not None]
+    )
+
+    typer.echo(
+        f"Replayed {report['requests']} requests in {report['wallSeconds']:.2f}s "
+        f"(speed x{speed}); statuses: {report['statuses']}"
+    )
+    _print_distribution("Replay latency", report["latency"])
+    _print_distribution(
+        "Recorded end-to-end latency", report["recordedEndToEndLatency"]
+    )
+    _print_distribution("Recorded upstream latency", report["recordedUpstreamLatency"])
+
+    if json_out:
+        json_out.write_text(json.dumps(report, indent=2))
+
+
+async def _batch(
+    items: List[dict], target: str, token: str, concurrency: int, out, timeout: float
+) -> dict:
+    latencies: List[float] = []
+    summary: dict = {}
+    headers = {"Authorization": f"Bearer {token}"}
+    async with httpx.AsyncClient(base_url=target, timeout=timeout) as http:
+        async with http.stream(
+            "POST",
+            "/api/chat/batch",
+            json={"items": items, "concurrency": concurrency},
+            headers=headers,
+        ) as resp:
+            if resp.status_code != 200:
+                await resp.aread()
+                raise typer.BadParameter(
+                    f"Batch rejected ({resp.status_code}): {resp.text}"
+                )
+            async for line in resp.aiter_lines():
+                if not line.strip():
+                    continue
+                result = json.loads(line)
+                if result.get("done"):
+                    summary = result
+                    continue
+                latencies.append(result["latencySeconds"])
+                out.write(line + "\n")
+    summary["latency"] = percentiles(latencies)
+    return summary
+
+
+@app.command()
+def batch(
+    requests_file: Path = typer.Argument(
+        ..., exists=True, help="JSONL file with one ChatRequest body per line"
+    ),
+    out: Path = typer.Option(Path("batch-results.jsonl"), help="Per-item results"),
+    target: str = typer.Option(
+        "http://127.0.0.1:8000", help="Base URL of the server under test"
+    ),
+    token: str = typer.Option(
+        ..., envvar="BATCH_API_TOKEN", help="Bearer token for /api/chat/batch"
+    ),
+    concurrency: int = typer.Option(4, help="Server-side worker pool size"),
+    timeout: float = typer.Option(600.0, help="Client timeout for the whole batch"),
+):
+    """Run a JSONL file of chat requests through /api/chat/batch."""
+    items = [
+        json.loads(line)
+        for line in requests_file.read_text(encoding="utf-8").splitlines()
+        if line.strip()
+    ]
+    if not items:
+        typer.echo("No requests in file.")
+        raise typer.Exit(code=1)
+    with out.open("w", encoding="utf-8") as fh:
+        summary = asyncio.run(_batch(items, target, token, concurrency, fh, timeout))
+    typer.echo(
+        f"{summary.get('count', 0)} items, {summary.get('errors', 0)} errors "
+        f"in {summary.get('wallSeconds', 0.0):.2f}s; results in {out}"
+    )
+    _print_distribution("Item latency", summary["latency"])
+
+
+@app.command("mock-upstream")
+def mock_upstream_cmd(
+    port: int = typer.Option(9100, help="Port to listen on"),
+    latency_ms: float = typer.Option(0.0, help="Fixed completion latency"),
+    capture: Optional[Path] = typer.Option(
+        None, exists=True, help="Replay upstream timings from a capture instead"
+    ),
+):
+    """Serve an OpenAI-compatible mock upstream until interrupted."""
+    latencies = [latency_ms / 1000.0]
+    if capture:
+        latencies = [
+            r["upstream"]["latencySeconds"]
+            for r in load_capture(capture)
+            if r.get("upstream")
+        ] or latencies
+    uvicorn.run(mock_upstream.create_app(latencies), host="127.0.0.1", port=port)
+
+
+_SENTENCES = [
+    "Honestly I don't know why I keep thinking about that night in Tulsa.",
+    "You left, I stayed, and now we're both pretending it was fine.",
+    "My mom still asks about you like you're a ghost who owes her money.",
+    "What did the city actually give you that the shop couldn't?",
+    "I bought the bike back. Same one. Rust and all.",
+    "Don't dodge it — who was waiting for you when you got off that bus?",
+    "We were twenty-two and scared and calling it ambition.",
+    "Tell me the part you leave out when you tell this story at parties.",
+]
+
+
+def synthetic_history(turns: int, seed: int = 7) -> List[dict]:
+    rng = random.Random(seed)
+    messages = []
+    for i in range(turns):
+        text = " ".join(rng.choice(_SENTENCES) for _ in range(rng.randint(1, 4)))
+        messages.append(
+            {"role": "user" if i % 2 == 0 else "assistant", "content": text}
+        )
+    return messages
+
+
+def _time_per_call(fn, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+@app.command("bench-compression")
+def bench_compression(
+    history: str = typer.Option("0,6,18,60,200", help="Comma list of history lengths"),
+    level: int = typer.Option(6, help="gzip level (browsers' CompressionStream ~6)"),
+    repeat: int = typer.Option(200, help="Iterations per timing"),
+):
+    """Bytes on the wire and CPU per turn for compressed chat bodies."""
+    typer.echo(
+        f"{'history':>7} {'raw B':>9} {'gzip B':>9} {'ratio':>6} "
+        f"{'client gz us':>13} {'server inflate us':>18} {'json parse us':>14}"
+    )
+    for turns in (int(h) for h in history.split(",") if h.strip()):
+        body = json.dumps(
+            {
+                "forkStatement": "I chose the city over staying to run my dad's shop.",
+                "intensity": "savage",
+                "sessionId": str(uuid.uuid4()),
+                "messages": synthetic_history(turns),
+            }
+        ).encode("utf-8")
+        packed = gzip.compress(body, compresslevel=level)
+        client = _time_per_call(
+            lambda: gzip.compress(body, compresslevel=level), repeat
+        )
+        inflate = _time_per_call(
+            lambda: compression.decompress(packed, "gzip", 1 << 22), repeat
+        )
+        parse = _time_per_call(lambda: json.loads(body), repeat)
+        typer.echo(
+            f"{turns:>7} {len(body):>9} {len(packed):>9} "
+            f"{len(packed) / len(body):>6.2f} {client * 1e6:>13.1f} "
+            f"{inflate * 1e6:>18.1f} {parse * 1e6:>14.1f}"
+        )
+        if compression.brotli is not None:
+            br = compression.brotli.compress(body, quality=5)
+            typer.echo(f"{'':>7} br: {len(br)} B ({len(br) / len(body):.2f})")
+    typer.echo(
+        f"(zlib {zlib.ZLIB_VERSION}; responses are gzipped by the server "
+        "above RESPONSE_GZIP_MIN_BYTES)"
+    )
+
+
+async def _bench_profiles(
+    intensities: List[str], turns: List[int], repeat: int
+) -> List[dict]:
+    import os
+
+    import server
+    from upstream import UpstreamPool
+
+    pool = UpstreamPool.from_env(os.environ)
+    if not pool.entries:
+        raise typer.BadParameter("No upstream configured (set OPENROUTER_API_KEY).")
+    fallback_model = os.environ.get("OPENROUTER_MODEL", "openai/gpt-4o-mini")
+    fork = "I chose the city over staying to run my dad's shop."
+    rows: Dict[str, dict] = {}
+    try:
+        for intensity in intensities:
+            for turn in turns:
+                # Exactly `turn` user messages, ending on one, as in /api/chat.
+                history = [
+                    server.ChatMessage(**m)
+                    for m in synthetic_history(max(0, turn * 2 - 1))
+                ]
+                user_turns = sum(1 for m in history if m.role == "user")
+                profile = server.generation_profiles.select(intensity, user_turns)
+                directives = server._derive_style_directives(history, intensity)
+                system = server._build_system_message(fork, intensity)
+                fields = profile.request_fields(fallback_model)
+                messages = server._build_openrouter_messages(
+                    system,
+                    server._transcript_lines(history),
+                    directives,
+                    cache_control=server._supports_cache_control(fields["model"]),
+                )
+                body = {"messages": messages, **fields}
+                row = rows.setdefault(
+                    f"{intensity}/{profile.name}",
+                    {
+                        "profile": profile,
+                        "latency": [],
+                        "tokens": [],
+                        "cached": [],
+                        "errors": 0,
+                    },
+                )
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    response, _ = await pool.post_chat(body)
+                    if response.status_code >= 400:
+                        row["errors"] += 1
+                        continue
+                    row["latency"].append(time.perf_counter() - start)
+                    usage = response.json().get("usage") or {}
+                    row["tokens"].append(usage.get("completion_tokens") or 0)
+                    details = usage.get("prompt_tokens_details") or {}
+                    row["cached"].append(details.get("cached_tokens") or 0)
+    finally:
+        await pool.aclose()
+    return [dict(key=k, **v) for k, v in rows.items()]
+
+
+@app.command("bench-profiles")
+def bench_profiles(
+    intensities: str = typer.Option("mild,savage,brutal", help="Comma list"),
+    turns: str = typer.Option("0,3,8", help="Comma list of turn numbers to sample"),
+    repeat: int = typer.Option(3, help="Completions per (intensity, turn)"),
+):
+    """Completion tokens and latency per generation profile, against the configured upstream."""
+    rows = asyncio.run(
+        _bench_profiles(
+            [i.strip() for i in intensities.split(",") if i.strip()],
+            [int(t) for t in turns.split(",") if t.strip()],
+            repeat,
+        )
+    )
+    typer.echo(
+        f"{'profile':<24} {'model':<28} {'max_tok':>7} {'tokens':>7} {'cached':>7} "
+        f"{'p50 ms':>8} {'p95 ms':>8} {'errors':>6}"
+    )
+    for row in rows:
+        p = row["profile"]
+        dist = percentiles(row["latency"])
+        tokens = statistics.fmean(row["tokens"]) if row["tokens"] else 0.0
+        cached = statistics.fmean(row["cached"]) if row["cached"] else 0.0
+        typer.echo(
+            f"{row['key']:<24} {(p.model or 'OPENROUTER_MODEL'):<28} {p.max_tokens:>7} "
+            f"{tokens:>7.0f} {cached:>7.0f} {(dist['p50'] or 0) * 1000:>8.0f} "
+            f"{(dist['p95'] or 0) * 1000:>8.0f} {row['errors']:>6}"
+        )
+
+
+if __name__ == "__main__":
+    app()
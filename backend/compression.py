@@ -0,0 +1,161 @@
+"""Compressed request bodies (``Content-Encoding: gzip``/``deflate``/``br``).
+
+Pure ASGI middleware: the compressed body is read, inflated with a hard cap
+on the decompressed size (zip-bomb guard), and handed to the app as if it had
+been sent plain. Brotli is optional; without the ``brotli`` package ``br``
+bodies get a 415.
+"""
+
+import json
+import zlib
+from typing import Callable, List, Optional, Tuple
+
+try:  # optional dependency
+    import brotli  # type: ignore
+except ImportError:  # pragma: no cover - depends on environment
+    brotli = None
+
+from metrics import REGISTRY
+
+DECOMPRESSED_TOTAL = REGISTRY.counter(
+    "fork_request_decompressed_total",
+    "Compressed request bodies by encoding and outcome.",
+    labels=("encoding", "outcome"),
+)
+REQUEST_WIRE_BYTES = REGISTRY.counter(
+    "fork_request_wire_bytes_total",
+    "Request body bytes as received and after decompression.",
+    labels=("stage",),
+)
+
+SUPPORTED = ("gzip", "deflate", "br") if brotli is not None else ("gzip", "deflate")
+
+
+class BodyTooLarge(Exception):
+    pass
+
+
+def _inflate_zlib(data: bytes, wbits: int, limit: int) -> bytes:
+    d = zlib.decompressobj(wbits)
+    out = d.decompress(data, limit + 1)
+    if len(out) > limit or d.unconsumed_tail:
+        raise BodyTooLarge()
+    out += d.flush()
+    if len(out) > limit:
+        raise BodyTooLarge()
+    if not d.eof:
+        raise zlib.error("truncated stream")
+    return out
+
+
+def _inflate_brotli(data: bytes, limit: int) -> bytes:
+    d = brotli.Decompressor()
+    parts: List[bytes] = []
+    size = 0
+    # Feed small slices so a bomb is caught long before it is fully expanded.
+    for i in range(0, len(data), 256):
+        chunk = d.process(data[i : i + 256])
+        size += len(chunk)
+        if size > limit:
+            raise BodyTooLarge()
+        parts.append(chunk)
+    if not d.is_finished():
+        raise brotli.error("truncated stream")
+    return b"".join(parts)
+
+
+def decompress(data: bytes, encoding: str, limit: int) -> bytes:
+    if encoding == "gzip":
+        return _inflate_zlib(data, 16 + zlib.MAX_WBITS, limit)
+    if encoding == "deflate":
+        return _inflate_zlib(data, zlib.MAX_WBITS, limit)
+    if encoding == "br" and brotli is not None:
+        return _inflate_brotli(data, limit)
+    raise ValueError(encoding)
+
+
+class RequestDecompressionMiddleware:
+    def __init__(self, app: Callable, max_size: int = 1_048_576):
+        self.app = app
+        self.max_size = max_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        encoding = ""
+        for name, value in scope["headers"]:
+            if name == b"content-encoding":
+                encoding = value.decode("latin-1").strip().lower()
+                break
+        if not encoding or encoding == "identity":
+            return await self.app(scope, receive, send)
+
+        if encoding not in SUPPORTED:
+            DECOMPRESSED_TOTAL.inc(encoding=encoding, outcome="unsupported")
+            return await _reject(
+                send,
+                415,
+                f"Unsupported Content-Encoding '{encoding}'.",
+                [(b"accept-encoding", ", ".join(SUPPORTED).encode("latin-1"))],
+            )
+
+        body = bytearray()
+        more = True
+        while more:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            body += message.get("body", b"")
+            more = message.get("more_body", False)
+            if len(body) > self.max_size:
+                DECOMPRESSED_TOTAL.inc(encoding=encoding, outcome="too_large")
+                return await _reject(send, 413, "Request body too large.")
+
+        try:
+            plain = decompress(bytes(body), encoding, self.max_size)
+        except BodyTooLarge:
+            DECOMPRESSED_TOTAL.inc(encoding=encoding, outcome="too_large")
+            return await _reject(send, 413, "Decompressed request body too large.")
+        except Exception:
+            DECOMPRESSED_TOTAL.inc(encoding=encoding, outcome="corrupt")
+            return await _reject(send, 400, "Could not decompress request body.")
+
+        DECOMPRESSED_TOTAL.inc(encoding=encoding, outcome="ok")
+        REQUEST_WIRE_BYTES.inc(len(body), stage="wire")
+        REQUEST_WIRE_BYTES.inc(len(plain), stage="decompressed")
+
+        headers: List[Tuple[bytes, bytes]] = [
+            (k, v)
+            for k, v in scope["headers"]
+            if k not in (b"content-encoding", b"content-length")
+        ]
+        headers.append((b"content-length", str(len(plain)).encode("latin-1")))
+        scope = dict(scope, headers=headers)
+
+        sent = False
+
+        async def replay_receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": plain, "more_body": False}
+            return await receive()
+
+        await self.app(scope, replay_receive, send)
+
+
+async def _reject(send, status: int, detail: str, headers: Optional[list] = None):
+    payload = json.dumps({"detail": detail}).encode("utf-8")
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(payload)).encode("latin-1")),
+            ]
+            + (headers or []),
+        }
+    )
+    await send({"type": "http.response.body", "body": payload})
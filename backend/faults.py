@@ -0,0 +1,185 @@
+"""Fault and latency injection between the chat path and the upstream.
+
+``FaultInjectingTransport`` wraps the httpx transport the upstream pool uses
+and, per request, may add latency, answer with an error status, reset the
+connection, time out, cut the response body halfway, or return malformed
+JSON. It is off unless ``UPSTREAM_FAULTS`` holds a JSON spec (or a test
+installs it); an invalid spec is logged and ignored. For example::
+
+    UPSTREAM_FAULTS='{"latency_ms": 800, "latency_distribution": "lognormal",
+                      "status_rates": {"429": 0.05, "503": 0.02},
+                      "truncate_rate": 0.01, "seed": 7}'
+
+Injected status responses never reach the real upstream.
+"""
+
+import asyncio
+import json
+import logging
+import random
+from typing import AsyncIterator, Dict, Literal, Mapping, Optional
+
+import httpx
+from pydantic import BaseModel, Field, model_validator
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+FAULTS_INJECTED_TOTAL = REGISTRY.counter(
+    "fork_upstream_faults_injected_total",
+    "Faults injected into upstream calls by kind.",
+    labels=("kind",),
+)
+
+
+class FaultSpec(BaseModel):
+    latency_ms: float = Field(default=0.0, ge=0.0, description="Added latency (median)")
+    latency_distribution: Literal["fixed", "uniform", "lognormal"] = "fixed"
+    latency_jitter_ms: float = Field(default=0.0, ge=0.0, description="uniform ± range")
+    latency_sigma: float = Field(default=0.5, ge=0.0, description="lognormal shape")
+    status_rates: Dict[int, float] = Field(default_factory=dict)
+    retry_after: Optional[float] = Field(default=None, ge=0.0)
+    reset_rate: float = Field(default=0.0, ge=0.0, le=1.0)
+    timeout_rate: float = Field(default=0.0, ge=0.0, le=1.0)
+    truncate_rate: float = Field(default=0.0, ge=0.0, le=1.0)
+    malformed_rate: float = Field(default=0.0, ge=0.0, le=1.0)
+    seed: Optional[int] = None
+
+    @model_validator(mode="after")
+    def _rates_fit(self) -> "FaultSpec":
+        for status, rate in self.status_rates.items():
+            if not 400 <= status <= 599 or not 0.0 <= rate <= 1.0:
+                raise ValueError(f"bad status rate {status}: {rate}")
+        if self.total_rate() > 1.0:
+            raise ValueError("fault rates add up to more than 1")
+        return self
+
+    def total_rate(self) -> float:
+        return (
+            sum(self.status_rates.values())
+            + self.reset_rate
+            + self.timeout_rate
+            + self.truncate_rate
+            + self.malformed_rate
+        )
+
+    @classmethod
+    def from_env(cls, env: Mapping[str, str]) -> Optional["FaultSpec"]:
+        raw = (env.get("UPSTREAM_FAULTS") or "").strip()
+        if not raw:
+            return None
+        return cls.model_validate(json.loads(raw))
+
+
+class FaultInjectingTransport(httpx.AsyncBaseTransport):
+    def __init__(self, inner: httpx.AsyncBaseTransport, spec: FaultSpec):
+        self.inner = inner
+        self.spec = spec
+        self.rng = random.Random(spec.seed)
+
+    def delay(self) -> float:
+        spec = self.spec
+        base = spec.latency_ms / 1000.0
+        if spec.latency_distribution == "uniform":
+            jitter = spec.latency_jitter_ms / 1000.0
+            return max(0.0, self.rng.uniform(base - jitter, base + jitter))
+        if spec.latency_distribution == "lognormal":
+            return base * self.rng.lognormvariate(0.0, spec.latency_sigma)
+        return base
+
+    def pick(self) -> Optional[str]:
+        """Which fault (if any) this request gets: one draw across all rates."""
+        roll = self.rng.random()
+        for kind, rate in (
+            ("reset", self.spec.reset_rate),
+            ("timeout", self.spec.timeout_rate),
+            ("truncate", self.spec.truncate_rate),
+            ("malformed", self.spec.malformed_rate),
+            *((str(s), r) for s, r in sorted(self.spec.status_rates.items())),
+        ):
+            if roll < rate:
+                return kind
+            roll -= rate
+        return None
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        delay = self.delay()
+        if delay:
+            await asyncio.sleep(delay)
+        kind = self.pick()
+        if kind is None:
+            return await self.inner.handle_async_request(request)
+        FAULTS_INJECTED_TOTAL.inc(kind=kind)
+
+        if kind == "reset":
+            raise httpx.ConnectError("injected connection reset", request=request)
+        if kind == "timeout":
+            raise httpx.ReadTimeout("injected read timeout", request=request)
+        if kind == "malformed":
+            return httpx.Response(
+                200,
+                headers={"content-type": "application/json"},
+                content=b'{"choices": [{"message": {"content": "half',
+                request=request,
+            )
+        if kind == "truncate":
+            response = await self.inner.handle_async_request(request)
+            body = await response.aread()
+            await response.aclose()
+            headers = [
+                (k, v)
+                for k, v in response.headers.items()
+                if k.lower() not in ("content-length", "content-encoding")
+            ]
+            return httpx.Response(
+                response.status_code,
+                headers=headers,
+                stream=_CutStream(body[: len(body) // 2], request),
+                request=request,
+            )
+
+        status = int(kind)
+        headers = {"content-type": "application/json"}
+        if status == 429 and self.spec.retry_after is not None:
+            headers["retry-after"] = str(self.spec.retry_after)
+        return httpx.Response(
+            status,
+            headers=headers,
+            json={"error": {"code": status, "message": "injected fault"}},
+            request=request,
+        )
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
+
+
+class _CutStream(httpx.AsyncByteStream):
+    """Yields part of a body, then drops the connection."""
+
+    def __init__(self, head: bytes, request: httpx.Request):
+        self.head = head
+        self.request = request
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        if self.head:
+            yield self.head
+        raise httpx.RemoteProtocolError(
+            "injected: peer closed connection mid-body", request=self.request
+        )
+
+
+def transport_from_env(
+    env: Mapping[str, str], inner: Optional[httpx.AsyncBaseTransport] = None
+) -> Optional[FaultInjectingTransport]:
+    try:
+        spec = FaultSpec.from_env(env)
+    except ValueError as e:
+        # The pool is built once per config (at warm-up), so this logs once
+        # instead of failing every chat request.
+        logger.error("Ignoring invalid UPSTREAM_FAULTS, fault injection is OFF: %s", e)
+        return None
+    if spec is None:
+        return None
+    logger.warning("Upstream fault injection is ON: %s", spec.model_dump_json())
+    return FaultInjectingTransport(inner or httpx.AsyncHTTPTransport(), spec)
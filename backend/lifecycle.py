@@ -0,0 +1,137 @@
+"""Readiness and graceful drain for rolling deploys.
+
+The process is *live* as soon as it answers HTTP, but only *ready* once the
+lifespan warm-up (upstream connections, profiles) has finished. On SIGTERM it
+flips to draining: readiness fails, new chats get a 503 with ``Retry-After``
+so the client retries on another instance, and in-flight chats are given a
+grace period to finish before resources are closed. The grace period is one
+budget for the whole shutdown, counted from the moment draining began.
+"""
+
+import asyncio
+import functools
+import logging
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+READY = REGISTRY.gauge("fork_ready", "1 when the instance is ready for traffic.")
+INFLIGHT_CHATS = REGISTRY.gauge(
+    "fork_inflight_chats", "Chat requests currently being generated."
+)
+DRAIN_REJECTED_TOTAL = REGISTRY.counter(
+    "fork_drain_rejected_total", "Chats refused because the instance is draining."
+)
+
+
+class Draining(Exception):
+    pass
+
+
+class Lifecycle:
+    def __init__(self) -> None:
+        self.ready = False
+        self.draining = False
+        self.inflight = 0
+        self.started = time.monotonic()
+        self.ready_after: Optional[float] = None
+        self.drain_started: Optional[float] = None
+        self.checks: Dict[str, object] = {}
+
+    def mark_ready(self, **checks: object) -> None:
+        self.checks.update(checks)
+        self.ready = True
+        self.ready_after = time.monotonic() - self.started
+        READY.set(0 if self.draining else 1)
+        logger.info("Ready after %.2fs", self.ready_after)
+
+    def begin_drain(self) -> None:
+        if not self.draining:
+            logger.info("Draining: %d chat(s) in flight", self.inflight)
+            self.drain_started = time.monotonic()
+        self.draining = True
+        READY.set(0)
+
+    def remaining_grace(self, grace: float) -> float:
+        """What is left of ``grace`` seconds counted from the start of the drain."""
+        if self.drain_started is None:
+            return grace
+        return max(0.0, grace - (time.monotonic() - self.drain_started))
+
+    def is_ready(self) -> bool:
+        return self.ready and not self.draining
+
+    @contextmanager
+    def track(self) -> Iterator[None]:
+        """Count one chat as in flight; refuses new work while draining."""
+        if self.draining:
+            DRAIN_REJECTED_TOTAL.inc()
+            raise Draining()
+        self.inflight += 1
+        INFLIGHT_CHATS.inc()
+        try:
+            yield
+        finally:
+            self.inflight -= 1
+            INFLIGHT_CHATS.dec()
+
+    async def drain(self, grace: float, poll: float = 0.05) -> bool:
+        """Wait until ``grace`` seconds after the drain began for in-flight chats.
+
+        True if all finished.
+        """
+        self.begin_drain()
+        deadline = time.monotonic() + self.remaining_grace(grace)
+        while self.inflight and time.monotonic() < deadline:
+            await asyncio.sleep(poll)
+        if self.inflight:
+            logger.warning(
+                "Drain grace expired with %d chat(s) in flight", self.inflight
+            )
+            return False
+        return True
+
+    def snapshot(self) -> dict:
+        return {
+            "ready": self.is_ready(),
+            "draining": self.draining,
+            "inflight": self.inflight,
+            "readyAfterSeconds": self.ready_after,
+            "checks": self.checks,
+        }
+
+
+def chain_server_exit(callback: Callable[[], None]) -> bool:
+    """Run ``callback`` when uvicorn is told to exit (SIGTERM or SIGINT).
+
+    Wraps ``uvicorn.Server.handle_exit``, which every uvicorn signal path calls,
+    so this must run before the server installs its handlers, i.e. at app
+    import. Returns False, changing nothing, when uvicorn isn't installed.
+    """
+    try:
+        from uvicorn.server import Server
+    except ImportError:
+        return False
+
+    callbacks = getattr(Server.handle_exit, "exit_callbacks", None)
+    if callbacks is None:
+        original = Server.handle_exit
+        callbacks = []
+
+        @functools.wraps(original)
+        def handle_exit(self, sig, frame):
+            for hook in callbacks:
+                try:
+                    hook()
+                except Exception:
+                    logger.exception("Exit hook failed")
+            original(self, sig, frame)
+
+        handle_exit.exit_callbacks = callbacks
+        Server.handle_exit = handle_exit
+    callbacks.append(callback)
+    return True
@@ -0,0 +1,263 @@
+"""Adaptive concurrency limit for upstream calls (AIMD with a latency gradient).
+
+The limit creeps up by roughly one slot per round-trip while the limit is
+actually in use and latency stays near its baseline. It is cut
+multiplicatively on 429s, 5xx/transport errors or latency inflation, and a
+``Retry-After`` pauses new admissions until it expires. Callers beyond the
+limit queue briefly; if no slot frees up in time they are rejected.
+"""
+
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Mapping, Optional
+
+from metrics import REGISTRY
+
+LIMIT_GAUGE = REGISTRY.gauge(
+    "fork_upstream_concurrency_limit", "Current adaptive upstream concurrency limit."
+)
+INFLIGHT_GAUGE = REGISTRY.gauge(
+    "fork_upstream_inflight", "Upstream calls currently holding a limiter slot."
+)
+QUEUED_GAUGE = REGISTRY.gauge(
+    "fork_upstream_queued", "Requests waiting for an upstream limiter slot."
+)
+REJECTED_TOTAL = REGISTRY.counter(
+    "fork_upstream_rejected_total",
+    "Requests rejected by the adaptive limiter.",
+    labels=("reason",),
+)
+DECREASE_TOTAL = REGISTRY.counter(
+    "fork_upstream_limit_decreases_total",
+    "Multiplicative limit cuts by trigger.",
+    labels=("reason",),
+)
+
+
+class LimitExceeded(Exception):
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Slot:
+    __slots__ = ("status", "latency", "retry_after")
+
+    def __init__(self) -> None:
+        self.status: Optional[int] = None
+        self.latency: Optional[float] = None
+        self.retry_after: Optional[float] = None
+
+    def record(
+        self, status: Optional[int], latency: float, retry_after: Optional[float] = None
+    ) -> None:
+        self.status, self.latency, self.retry_after = status, latency, retry_after
+
+
+class AdaptiveLimiter:
+    def __init__(
+        self,
+        initial: int = 16,
+        min_limit: int = 2,
+        max_limit: int = 256,
+        backoff: float = 0.7,
+        latency_tolerance: float = 2.0,
+        queue_timeout: float = 10.0,
+        max_queue: int = 256,
+    ):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(max(min_limit, min(initial, max_limit)))
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.queue_timeout = queue_timeout
+        self.max_queue = max_queue
+
+        self.inflight = 0
+        self.blocked_until = 0.0
+        self.baseline_latency: Optional[float] = None
+        self.recent_latency: Optional[float] = None
+        # Slow average of successful latencies: what "normal" looks like,
+        # including the model's ordinary variance.
+        self.typical_latency: Optional[float] = None
+        self.sampled_at: Optional[float] = None
+        self._last_decrease = 0.0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._wake_handle: Optional[asyncio.TimerHandle] = None
+        self._publish()
+
+    # ---- admission ----
+    def _has_capacity(self, now: float) -> bool:
+        return now >= self.blocked_until and self.inflight < int(self.limit)
+
+    async def acquire(self) -> None:
+        now = time.monotonic()
+        if not self._waiters and self._has_capacity(now):
+            self.inflight += 1
+            self._publish()
+            return
+        if len(self._waiters) >= self.max_queue:
+            REJECTED_TOTAL.inc(reason="queue_full")
+            raise LimitExceeded("queue_full", self._suggested_retry(now))
+
+        loop = asyncio.get_running_loop()
+        fut: asyncio.Future = loop.create_future()
+        self._waiters.append(fut)
+        self._publish()
+        self._schedule_wake(loop)
+        try:
+            await asyncio.wait_for(fut, timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            REJECTED_TOTAL.inc(reason="timeout")
+            raise LimitExceeded("timeout", self._suggested_retry(time.monotonic()))
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.release()  # slot was granted just as we were cancelled
+            raise
+        finally:
+            if fut in self._waiters:
+                self._waiters.remove(fut)
+            self._publish()
+
+    def release(self) -> None:
+        self.inflight = max(0, self.inflight - 1)
+        self._wake()
+
+    def _wake(self) -> None:
+        now = time.monotonic()
+        while self._waiters and self._has_capacity(now):
+            fut = self._waiters.popleft()
+            if fut.done():
+                continue
+            self.inflight += 1
+            fut.set_result(None)
+        self._publish()
+
+    def _schedule_wake(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Admit queued callers once a Retry-After pause runs out."""
+        delay = self.blocked_until - time.monotonic()
+        if delay <= 0:
+            self._wake()
+            return
+        if self._wake_handle is not None:
+            self._wake_handle.cancel()
+        self._wake_handle = loop.call_later(delay, self._wake)
+
+    def _suggested_retry(self, now: float) -> float:
+        return max(1.0, self.blocked_until - now)
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[Slot]:
+        await self.acquire()
+        slot = Slot()
+        try:
+            yield slot
+        finally:
+            if slot.latency is not None or slot.status is not None:
+                self.on_result(slot.status, slot.latency or 0.0, slot.retry_after)
+            self.release()
+
+    # ---- adaptation ----
+    def on_result(
+        self, status: Optional[int], latency: float, retry_after: Optional[float] = None
+    ) -> None:
+        now = time.monotonic()
+        if status == 429 or retry_after:
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+                try:
+                    self._schedule_wake(asyncio.get_running_loop())
+                except RuntimeError:
+                    pass
+            self._decrease("throttled" if status == 429 else "retry_after", now)
+            return
+        if status is None or status >= 500:
+            self._decrease("error", now)
+            return
+        if status >= 400:
+            # A fast 400/401/402 says nothing about generation latency, and
+            # as a new minimum it would drag the baseline down for good.
+            return
+
+        self.recent_latency = (
+            latency
+            if self.recent_latency is None
+            else self.recent_latency + 0.3 * (latency - self.recent_latency)
+        )
+        self.typical_latency = (
+            latency
+            if self.typical_latency is None
+            else self.typical_latency + 0.05 * (latency - self.typical_latency)
+        )
+        self.sampled_at = now
+        if self.baseline_latency is None or latency < self.baseline_latency:
+            self.baseline_latency = latency
+        else:
+            # Let the baseline drift up slowly so a permanently slower model
+            # doesn't read as inflation forever.
+            self.baseline_latency += 0.01 * (latency - self.baseline_latency)
+
+        if self.recent_latency > self.latency_tolerance * self.baseline_latency:
+            self._decrease("latency", now)
+        elif self.inflight >= self.limit / 2:
+            self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+            self._publish()
+
+    def _decrease(self, reason: str, now: float) -> None:
+        # One cut per round-trip: a burst of errors from the same moment is
+        # one congestion signal, not many.
+        window = self.recent_latency or 1.0
+        if now - self._last_decrease < window:
+            return
+        self._last_decrease = now
+        self.limit = max(float(self.min_limit), self.limit * self.backoff)
+        DECREASE_TOTAL.inc(reason=reason)
+        self._publish()
+
+    def _publish(self) -> None:
+        LIMIT_GAUGE.set(int(self.limit))
+        INFLIGHT_GAUGE.set(self.inflight)
+        QUEUED_GAUGE.set(len(self._waiters))
+
+    def dump_stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "baselineLatency": self.baseline_latency,
+            "recentLatency": self.recent_latency,
+            "typicalLatency": self.typical_latency,
+        }
+
+    def load_stats(self, data: Mapping[str, Any]) -> None:
+        """Start from a learned limit and latency baseline instead of cold."""
+        limit = float(data["limit"])
+        self.limit = float(max(self.min_limit, min(limit, self.max_limit)))
+        for key, attr in (
+            ("baselineLatency", "baseline_latency"),
+            ("recentLatency", "recent_latency"),
+            ("typicalLatency", "typical_latency"),
+        ):
+            value = data.get(key)
+            setattr(self, attr, float(value) if value is not None else None)
+        self._publish()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def snapshot(self) -> dict:
+        return {
+            "limit": int(self.limit),
+            "inflight": self.inflight,
+            "queued": len(self._waiters),
+            "blockedForSeconds": max(
+                0.0, round(self.blocked_until - time.monotonic(), 3)
+            ),
+            "baselineLatencySeconds": self.baseline_latency,
+            "recentLatencySeconds": self.recent_latency,
+            "rejected": {
+                r: REJECTED_TOTAL.value(reason=r) for r in ("queue_full", "timeout")
+            },
+        }
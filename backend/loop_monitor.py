@@ -0,0 +1,159 @@
+"""Event-loop lag monitor and blocking-call detector.
+
+A self-rescheduling heartbeat runs on the event loop; how late each beat fires
+is the loop's scheduling lag. A watchdog thread watches the heartbeat and, when
+the loop has been stuck longer than the threshold, grabs the loop thread's
+current stack — i.e. whatever coroutine or callback is hogging the loop.
+"""
+
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Deque, List, Optional
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+LOOP_LAG_SECONDS = REGISTRY.histogram(
+    "fork_event_loop_lag_seconds",
+    "Delay between when a loop heartbeat was scheduled and when it ran.",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+LOOP_BLOCKED_TOTAL = REGISTRY.counter(
+    "fork_event_loop_blocked_total",
+    "Times a single callback blocked the loop longer than the threshold.",
+)
+LOOP_LAG_CURRENT = REGISTRY.gauge(
+    "fork_event_loop_lag_current_seconds",
+    "Most recent event-loop lag sample.",
+)
+
+
+class BlockingEvent:
+    """One detected stall: when it started, how long it lasted, where it was."""
+
+    __slots__ = ("started_at", "duration", "stack")
+
+    def __init__(self, started_at: float, stack: List[str]):
+        self.started_at = started_at
+        self.duration: Optional[float] = None
+        self.stack = stack
+
+    def to_dict(self) -> dict:
+        return {
+            "startedAt": self.started_at,
+            "durationSeconds": self.duration,
+            "stack": self.stack,
+        }
+
+
+class LoopMonitor:
+    def __init__(
+        self,
+        interval: float = 0.1,
+        block_threshold: float = 0.25,
+        keep: int = 20,
+    ):
+        self.interval = interval
+        self.block_threshold = block_threshold
+        self.events: Deque[BlockingEvent] = deque(maxlen=keep)
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._expected = 0.0
+        self._last_beat = 0.0
+        self._current: Optional[BlockingEvent] = None
+        self._stop = threading.Event()
+        self._watchdog: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._loop is not None
+
+    def start(self, loop: Optional[asyncio.AbstractEventLoop] = None) -> None:
+        if self.running:
+            return
+        self._loop = loop or asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._stop.clear()
+        self._last_beat = time.monotonic()
+        self._schedule()
+
+        self._watchdog = threading.Thread(
+            target=self._watch, name="loop-monitor-watchdog", daemon=True
+        )
+        self._watchdog.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        if self._watchdog is not None:
+            self._watchdog.join(timeout=1.0)
+            self._watchdog = None
+        self._loop = None
+
+    # ---- loop side ----
+    def _schedule(self) -> None:
+        assert self._loop is not None
+        self._expected = self._loop.time() + self.interval
+        self._handle = self._loop.call_at(self._expected, self._beat)
+
+    def _beat(self) -> None:
+        if self._loop is None:
+            return
+        lag = max(0.0, self._loop.time() - self._expected)
+        LOOP_LAG_SECONDS.observe(lag)
+        LOOP_LAG_CURRENT.set(lag)
+        self._last_beat = time.monotonic()
+
+        event = self._current
+        if event is not None:
+            self._current = None
+            event.duration = self._last_beat - event.started_at
+            logger.warning(
+                "Event loop blocked for %.3fs; stack at detection:\n%s",
+                event.duration,
+                "".join(event.stack),
+            )
+
+        self._schedule()
+
+    # ---- watchdog side ----
+    def _watch(self) -> None:
+        poll = max(0.005, min(self.interval, self.block_threshold / 2))
+        while not self._stop.wait(poll):
+            stalled_for = time.monotonic() - self._last_beat - self.interval
+            if stalled_for < self.block_threshold or self._current is not None:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id or 0)
+            stack = traceback.format_stack(frame) if frame is not None else []
+            event = BlockingEvent(self._last_beat + self.interval, stack)
+            self._current = event
+            self.events.append(event)
+            LOOP_BLOCKED_TOTAL.inc()
+
+    def current_lag(self) -> float:
+        """Lag right now, including a stall that is still in progress."""
+        if not self.running:
+            return 0.0
+        in_progress = time.monotonic() - self._last_beat - self.interval
+        return max(LOOP_LAG_CURRENT.value(), in_progress, 0.0)
+
+    def snapshot(self) -> dict:
+        return {
+            "running": self.running,
+            "intervalSeconds": self.interval,
+            "blockThresholdSeconds": self.block_threshold,
+            "lagP50Seconds": LOOP_LAG_SECONDS.quantile(0.5),
+            "lagP99Seconds": LOOP_LAG_SECONDS.quantile(0.99),
+            "blockedTotal": LOOP_BLOCKED_TOTAL.value(),
+            "recentBlocks": [e.to_dict() for e in self.events],
+        }
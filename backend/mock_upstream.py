@@ -0,0 +1,73 @@
+"""A local OpenAI-compatible stand-in for OpenRouter.
+
+Replays recorded upstream timings (or a fixed latency) so benchmarks can drive
+the real server without spending tokens or depending on the provider's mood.
+Point the server at it with ``OPENROUTER_BASE_URL=http://127.0.0.1:<port>``.
+"""
+
+import asyncio
+import itertools
+import time
+import uuid
+from typing import Iterable, List, Optional
+
+from fastapi import FastAPI, Request
+
+FILLER = "Road's long, coffee's cheap, and you still owe me an answer. "
+
+
+def _reply_text(length: int) -> str:
+    length = max(1, length)
+    return (FILLER * (length // len(FILLER) + 1))[:length]
+
+
+def create_app(
+    latencies: Optional[Iterable[float]] = None,
+    reply_lengths: Optional[Iterable[int]] = None,
+) -> FastAPI:
+    lat: List[float] = list(latencies or []) or [0.0]
+    lengths: List[int] = list(reply_lengths or []) or [240]
+    next_latency = itertools.cycle(lat)
+    next_length = itertools.cycle(lengths)
+
+    app = FastAPI(title="Mock upstream")
+    app.state.calls = 0
+
+    @app.get("/models")
+    async def models():
+        return {"data": [{"id": "mock/model"}]}
+
+    @app.post("/chat/completions")
+    async def completions(request: Request):
+        body = await request.json()
+        app.state.calls += 1
+        await asyncio.sleep(next(next_latency))
+        text = _reply_text(next(next_length))
+        prompt_chars = sum(
+            len(
+                m.get("content")
+                if isinstance(m.get("content"), str)
+                else str(m.get("content"))
+            )
+            for m in body.get("messages", [])
+        )
+        return {
+            "id": f"mock-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock/model"),
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": text},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": {
+                "prompt_tokens": prompt_chars // 4,
+                "completion_tokens": len(text) // 4,
+                "total_tokens": (prompt_chars + len(text)) // 4,
+            },
+        }
+
+    return app
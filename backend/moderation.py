@@ -0,0 +1,206 @@
+"""Incremental output moderation for model replies.
+
+Phrases are compiled once into an Aho-Corasick automaton (a full DFA over the
+phrases' alphabet), so scanning costs one dict lookup per character however
+many phrases there are. ``OutputModerator`` feeds a reply through it chunk by
+chunk and carries the automaton state across chunks, so a phrase split over a
+chunk boundary is still caught. It releases text as soon as it can no longer
+be the start of a phrase and holds back only the partial match at the tail.
+When a phrase matches, nothing of it has been released: the reply is cut there
+and the category's replacement is emitted instead.
+
+Matching is case-insensitive. Any run of characters other than letters,
+digits and apostrophes reads as one space, and phrases only match as whole
+words: "kill yourself" is caught in "—kill yourself." but not in "skill
+yourself", and "go die" not in "go diesel". A completed phrase is therefore
+only confirmed by the next character (or by ``finish()`` at the end).
+"""
+
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
+
+from metrics import REGISTRY
+
+OUTPUT_MODERATED_TOTAL = REGISTRY.counter(
+    "fork_output_moderated_total",
+    "Replies cut off by output moderation by category.",
+    labels=("category",),
+)
+
+_FOLD = {"’": "'", "‘": "'", "ʼ": "'"}
+
+
+def _normalize_phrase(phrase: str) -> str:
+    """Leading space included: every phrase starts at a word boundary."""
+    out = [" "]
+    for ch in phrase:
+        ch = _FOLD.get(ch, ch)
+        if ch.isalnum() or ch == "'":
+            out.append(ch.lower())
+        elif out[-1] != " ":
+            out.append(" ")
+    return "".join(out).rstrip()
+
+
+class Automaton:
+    """Aho-Corasick matcher compiled to a DFA.
+
+    ``delta[state]`` maps every character of the phrase alphabet to the next
+    state (characters outside it lead back to the root). ``depth[state]`` is
+    the length of the partial match the state stands for. ``match[state]`` is
+    ``(category, phrase length)`` when some phrase ends there. Scanning
+    begins in ``start``, as if the text were preceded by a space.
+    """
+
+    def __init__(self, phrases: Mapping[str, Iterable[str]]):
+        goto: List[Dict[str, int]] = [{}]
+        self.depth: List[int] = [0]
+        self.match: List[Optional[Tuple[str, int]]] = [None]
+        self.phrases = 0
+        for category, items in phrases.items():
+            for raw in items:
+                phrase = _normalize_phrase(raw)
+                if len(phrase) < 2:
+                    continue
+                state = 0
+                for ch in phrase:
+                    nxt = goto[state].get(ch)
+                    if nxt is None:
+                        nxt = len(goto)
+                        goto[state][ch] = nxt
+                        goto.append({})
+                        self.depth.append(self.depth[state] + 1)
+                        self.match.append(None)
+                    state = nxt
+                if self.match[state] is None:
+                    self.match[state] = (category, len(phrase))
+                    self.phrases += 1
+        self.alphabet = frozenset(ch for edges in goto for ch in edges)
+
+        # Breadth-first: fill failure links and complete every state's table.
+        fail = [0] * len(goto)
+        self.delta: List[Dict[str, int]] = [dict() for _ in goto]
+        self.delta[0] = dict(goto[0])
+        queue = list(goto[0].values())
+        for state in queue:
+            parent_delta = self.delta[fail[state]]
+            row = dict(parent_delta)
+            for ch, nxt in goto[state].items():
+                row[ch] = nxt
+                fail[nxt] = parent_delta.get(ch, 0)
+                queue.append(nxt)
+            self.delta[state] = row
+            if self.match[state] is None:
+                # A shorter phrase may end here as a suffix of this path.
+                self.match[state] = self.match[fail[state]]
+        self.start = self.delta[0].get(" ", 0)
+
+    def __len__(self) -> int:
+        return len(self.delta)
+
+    def search(self, text: str) -> Optional[str]:
+        """Category of the first phrase found in ``text``, if any."""
+        moderator = OutputModerator(self, {})
+        moderator.feed(text)
+        moderator.finish()
+        return moderator.tripped
+
+
+class OutputModerator:
+    """Scans one reply as it streams; create a new one per reply."""
+
+    def __init__(
+        self,
+        automaton: Automaton,
+        replacements: Mapping[str, str],
+        separator: str = " ",
+    ):
+        self.automaton = automaton
+        self.replacements = replacements
+        self.separator = separator
+        self.tripped: Optional[str] = None
+        self._state = automaton.start
+        self._space = True
+        self._held = ""
+        # Offsets into ``_held`` of each normalized character consumed from it.
+        self._offsets: List[int] = []
+        # (category, phrase length) of a phrase waiting for a word boundary.
+        self._pending: Optional[Tuple[str, int]] = None
+        # Last character already sent, to join the replacement onto it.
+        self._last = ""
+
+    def feed(self, chunk: str) -> str:
+        """Text from ``chunk`` (and earlier held text) that is safe to send."""
+        if self.tripped is not None:
+            return ""
+        delta = self.automaton.delta
+        match = self.automaton.match
+        state = self._state
+        space = self._space
+        pending = self._pending
+        held = self._held
+        offsets = self._offsets
+        base = len(held)
+        held += chunk
+
+        for i, ch in enumerate(chunk):
+            ch = _FOLD.get(ch, ch)
+            if ch.isalnum() or ch == "'":
+                n = ch.lower()
+                space = False
+            elif space:
+                continue
+            else:
+                n = " "
+                space = True
+            state = delta[state].get(n, 0)
+            offsets.append(base + i)
+            if pending is not None:
+                if space:
+                    # The phrase ended on a word boundary; cut after the
+                    # boundary character it starts with.
+                    category, length = pending
+                    return self._trip(category, held[: offsets[-length]])
+                pending = None
+            pending = match[state]
+
+        self._state = state
+        self._space = space
+        self._pending = pending
+        # The virtual leading space has no offset, so the partial match may be
+        # one longer than what was consumed.
+        keep = min(self.automaton.depth[state], len(offsets))
+        cut = offsets[-keep] if keep else len(held)
+        self._held = held[cut:]
+        self._offsets = [o - cut for o in offsets[-keep:]] if keep else []
+        return self._release(held[:cut])
+
+    def finish(self) -> str:
+        """The held tail, once the reply is complete."""
+        if self.tripped is not None:
+            return ""
+        if self._pending is not None:
+            # End of reply is a word boundary too.
+            category, length = self._pending
+            return self._trip(category, self._held[: self._offsets[1 - length]])
+        tail, self._held, self._offsets = self._held, "", []
+        return self._release(tail)
+
+    def _release(self, text: str) -> str:
+        if text:
+            self._last = text[-1]
+        return text
+
+    def _trip(self, category: str, before: str) -> str:
+        self.tripped = category
+        self._held = ""
+        self._offsets = []
+        self._pending = None
+        OUTPUT_MODERATED_TOTAL.inc(category=category)
+        replacement = self.replacements.get(category, "")
+        if not replacement:
+            return before
+        before = before.rstrip()
+        # Text before the phrase may have gone out in an earlier chunk.
+        if before or (self._last and not self._last.isspace()):
+            return f"{before}{self.separator}{replacement}"
+        return replacement
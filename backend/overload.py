@@ -0,0 +1,188 @@
+"""Step-wise quality degradation under overload.
+
+Three signals are normalized so that 1.0 means "saturated":
+
+- queue: requests waiting for an upstream slot, per slot of the current limit
+- loop: event-loop lag relative to ``lag_target``
+- latency: recent upstream latency over its typical (slowly averaged)
+  latency, where ``latency_tolerance`` times typical counts as 1.0. Ordinary
+  model variance stays well under the first threshold. A reading older than
+  ``cool_down`` is ignored, since with no traffic nothing would refresh it.
+
+The worst of them is the pressure. Each threshold crossed turns on one more
+step, cumulatively: a shorter transcript window, a smaller ``max_tokens``,
+a faster fallback model, and finally a canned in-character reply with no
+upstream call. Steps turn on as soon as pressure crosses a threshold and turn
+off one at a time once pressure has stayed low for ``cool_down`` seconds, so
+the level doesn't flap. Latency inflation on its own never goes past the
+fallback model; only queueing or loop stalls lead to canned replies.
+"""
+
+import logging
+import time
+from typing import Dict, Mapping, NamedTuple, Optional, Sequence
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+LEVELS = ("normal", "short_window", "short_reply", "fallback_model", "canned")
+
+OVERLOAD_LEVEL = REGISTRY.gauge(
+    "fork_overload_level",
+    "Current degradation step (0 normal … 4 canned replies).",
+)
+OVERLOAD_PRESSURE = REGISTRY.gauge(
+    "fork_overload_pressure",
+    "Normalized overload pressure per signal (1.0 = saturated).",
+    labels=("signal",),
+)
+OVERLOAD_TRANSITIONS_TOTAL = REGISTRY.counter(
+    "fork_overload_transitions_total",
+    "Degradation level changes by the level entered.",
+    labels=("level",),
+)
+DEGRADED_TOTAL = REGISTRY.counter(
+    "fork_overload_degraded_requests_total",
+    "Chats served at a degraded level.",
+    labels=("level",),
+)
+
+
+class Degradation(NamedTuple):
+    level: int
+    name: str
+    window: Optional[int] = None
+    max_tokens: Optional[int] = None
+    model: Optional[str] = None
+    canned: bool = False
+
+
+class OverloadController:
+    def __init__(
+        self,
+        thresholds: Sequence[float] = (0.5, 1.0, 2.0, 4.0),
+        window: int = 8,
+        max_tokens: int = 160,
+        fallback_model: str = "meta-llama/llama-3.1-8b-instruct",
+        lag_target: float = 0.1,
+        latency_tolerance: float = 2.0,
+        cool_down: float = 5.0,
+    ):
+        if len(thresholds) != len(LEVELS) - 1 or list(thresholds) != sorted(thresholds):
+            raise ValueError("need four ascending overload thresholds")
+        self.thresholds = tuple(float(t) for t in thresholds)
+        self.window = window
+        self.max_tokens = max_tokens
+        self.fallback_model = fallback_model
+        self.lag_target = lag_target
+        self.latency_tolerance = latency_tolerance
+        self.cool_down = cool_down
+
+        self.level = 0
+        self.signals: Dict[str, float] = {"queue": 0.0, "loop": 0.0, "latency": 0.0}
+        self._high_at = 0.0
+        OVERLOAD_LEVEL.set(0)
+
+    @classmethod
+    def from_env(cls, env: Mapping[str, str]) -> "OverloadController":
+        kwargs: dict = {}
+        if env.get("OVERLOAD_THRESHOLDS"):
+            kwargs["thresholds"] = [
+                float(t) for t in env["OVERLOAD_THRESHOLDS"].split(",") if t.strip()
+            ]
+        for key, name, cast in (
+            ("OVERLOAD_WINDOW", "window", int),
+            ("OVERLOAD_MAX_TOKENS", "max_tokens", int),
+            ("OVERLOAD_FALLBACK_MODEL", "fallback_model", str),
+            ("OVERLOAD_LAG_TARGET_MS", "lag_target", lambda v: float(v) / 1000.0),
+            ("OVERLOAD_COOL_DOWN_SECONDS", "cool_down", float),
+        ):
+            if env.get(key):
+                kwargs[name] = cast(env[key])
+        return cls(**kwargs)
+
+    def measure(
+        self,
+        queued: int,
+        limit: int,
+        loop_lag: float,
+        recent_latency: Optional[float],
+        typical_latency: Optional[float],
+        latency_age: Optional[float] = None,
+    ) -> Dict[str, float]:
+        latency = 0.0
+        fresh = latency_age is None or latency_age <= self.cool_down
+        if recent_latency and typical_latency and fresh:
+            inflation = recent_latency / typical_latency - 1.0
+            latency = max(0.0, inflation / max(1e-9, self.latency_tolerance - 1.0))
+        return {
+            "queue": queued / max(1, limit),
+            "loop": loop_lag / self.lag_target if self.lag_target > 0 else 0.0,
+            "latency": latency,
+        }
+
+    def update(self, signals: Dict[str, float], now: Optional[float] = None) -> int:
+        now = time.monotonic() if now is None else now
+        self.signals = signals
+        for name, value in signals.items():
+            OVERLOAD_PRESSURE.set(round(value, 4), signal=name)
+        pressure = max(signals.values(), default=0.0)
+        target = max(
+            (self._level_for(name, value) for name, value in signals.items()),
+            default=0,
+        )
+
+        if target >= self.level:
+            if target > self.level:
+                self._set(target, pressure)
+            self._high_at = now
+        else:
+            # Step down one level per quiet ``cool_down`` period, counted from
+            # the last time pressure justified the current level.
+            steps = int((now - self._high_at) // self.cool_down)
+            if steps:
+                self._set(max(target, self.level - steps), pressure)
+                self._high_at = now
+        return self.level
+
+    def _level_for(self, signal: str, value: float) -> int:
+        level = sum(1 for t in self.thresholds if value >= t)
+        if signal == "latency":
+            # Slow upstreams alone stop at the fallback model: canned replies
+            # make no upstream calls, so the latency signal could never recover.
+            level = min(level, LEVELS.index("fallback_model"))
+        return level
+
+    def _set(self, level: int, pressure: float) -> None:
+        logger.warning(
+            "Overload level %s -> %s (pressure %.2f: %s)",
+            LEVELS[self.level],
+            LEVELS[level],
+            pressure,
+            ", ".join(f"{k}={v:.2f}" for k, v in self.signals.items()),
+        )
+        self.level = level
+        OVERLOAD_LEVEL.set(level)
+        OVERLOAD_TRANSITIONS_TOTAL.inc(level=LEVELS[level])
+
+    def degradation(self, level: Optional[int] = None) -> Degradation:
+        level = self.level if level is None else level
+        if level:
+            DEGRADED_TOTAL.inc(level=LEVELS[level])
+        return Degradation(
+            level=level,
+            name=LEVELS[level],
+            window=self.window if level >= 1 else None,
+            max_tokens=self.max_tokens if level >= 2 else None,
+            model=self.fallback_model if level >= 3 else None,
+            canned=level >= 4,
+        )
+
+    def snapshot(self) -> dict:
+        return {
+            "level": self.level,
+            "name": LEVELS[self.level],
+            "signals": {k: round(v, 4) for k, v in self.signals.items()},
+            "thresholds": list(self.thresholds),
+        }
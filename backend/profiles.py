@@ -0,0 +1,160 @@
+"""Generation profiles: model, max_tokens, temperature and stop sequences
+chosen per intensity (and optionally per turn number).
+
+The built-in table can be overridden with a JSON file at
+``GENERATION_PROFILES_PATH``; the file is re-read when its mtime changes, so
+profiles can be tuned without a restart. An invalid file is logged and the
+previous table stays in effect.
+
+File format — every intensity maps to one profile or a list of profiles
+matched in order by turn range; unspecified fields come from ``default``::
+
+    {
+      "default": {"max_tokens": 400, "temperature": 0.85},
+      "brutal": [
+        {"name": "brutal-open", "max_turn": 1, "max_tokens": 300},
+        {"name": "brutal", "max_tokens": 200, "model": "openai/gpt-4o-mini"}
+      ]
+    }
+"""
+
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+from pydantic import BaseModel, Field, ValidationError
+
+logger = logging.getLogger(__name__)
+
+INTENSITIES = ("mild", "savage", "brutal")
+
+
+class GenerationProfile(BaseModel):
+    name: str = ""
+    model: Optional[str] = Field(
+        default=None, description="None means OPENROUTER_MODEL"
+    )
+    max_tokens: int = Field(default=500, ge=1, le=4096)
+    temperature: float = Field(default=0.85, ge=0.0, le=2.0)
+    stop: List[str] = Field(default_factory=list)
+    min_turn: int = Field(default=0, ge=0)
+    max_turn: Optional[int] = Field(default=None, ge=0)
+
+    def matches(self, turn: int) -> bool:
+        return turn >= self.min_turn and (
+            self.max_turn is None or turn <= self.max_turn
+        )
+
+    def request_fields(self, fallback_model: str) -> dict:
+        fields: dict = {
+            "model": self.model or fallback_model,
+            "temperature": self.temperature,
+            "max_tokens": self.max_tokens,
+        }
+        if self.stop:
+            fields["stop"] = list(self.stop)
+        return fields
+
+
+# Keep the model from writing the user's next line for them.
+_TRANSCRIPT_STOPS = ["\nYou:", "\nOther You:"]
+
+DEFAULT_CONFIG: Dict[str, Union[dict, List[dict]]] = {
+    "default": {"max_tokens": 500, "temperature": 0.85, "stop": _TRANSCRIPT_STOPS},
+    # "Keep paragraphs tight" — a few short paragraphs.
+    "mild": {"name": "mild", "max_tokens": 400},
+    # "1–2 sentences per paragraph max" — the opener gets a little more room.
+    "savage": [
+        {"name": "savage-open", "max_turn": 1, "max_tokens": 320},
+        {"name": "savage", "max_tokens": 260, "temperature": 0.9},
+    ],
+    "brutal": [
+        {"name": "brutal-open", "max_turn": 1, "max_tokens": 280},
+        {"name": "brutal", "max_tokens": 220, "temperature": 0.9},
+    ],
+}
+
+
+class ProfileTable:
+    def __init__(self, profiles: Dict[str, List[GenerationProfile]]):
+        self.profiles = profiles
+
+    @classmethod
+    def from_config(cls, config: dict) -> "ProfileTable":
+        default = dict(config.get("default") or {})
+        unknown = set(config) - set(INTENSITIES) - {"default"}
+        if unknown:
+            raise ValueError(f"unknown profile keys: {sorted(unknown)}")
+
+        table: Dict[str, List[GenerationProfile]] = {}
+        for intensity in INTENSITIES:
+            raw = config.get(intensity) or [{}]
+            entries = raw if isinstance(raw, list) else [raw]
+            table[intensity] = [
+                GenerationProfile(**{"name": intensity, **default, **entry})
+                for entry in entries
+            ]
+        return cls(table)
+
+    def select(self, intensity: str, turn: int) -> GenerationProfile:
+        candidates = self.profiles.get(intensity) or self.profiles["mild"]
+        for profile in candidates:
+            if profile.matches(turn):
+                return profile
+        return candidates[-1]
+
+    def describe(self) -> Dict[str, List[dict]]:
+        return {k: [p.model_dump() for p in v] for k, v in self.profiles.items()}
+
+
+class ProfileStore:
+    """Current profile table, reloaded from disk when the config file changes."""
+
+    def __init__(self, path: Optional[str] = None, check_interval: float = 2.0):
+        self.path = Path(path) if path else None
+        self.check_interval = check_interval
+        self.table = ProfileTable.from_config(DEFAULT_CONFIG)
+        self.source = "builtin"
+        self._mtime: Optional[float] = None
+        self._checked = 0.0
+        self.reload()
+
+    def reload(self) -> bool:
+        """Re-read the config file if it changed. Returns True on a swap."""
+        self._checked = time.monotonic()
+        if self.path is None:
+            return False
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            if self._mtime is not None:
+                logger.warning("Generation profiles file %s disappeared", self.path)
+                self._mtime = None
+            return False
+        if mtime == self._mtime:
+            return False
+        self._mtime = mtime
+        try:
+            config = json.loads(self.path.read_text(encoding="utf-8"))
+            table = ProfileTable.from_config(config)
+        except (OSError, ValueError, ValidationError) as e:
+            logger.error("Ignoring invalid generation profiles %s: %s", self.path, e)
+            return False
+        self.table = table
+        self.source = str(self.path)
+        logger.info("Loaded generation profiles from %s", self.path)
+        return True
+
+    def current(self) -> ProfileTable:
+        if (
+            self.path is not None
+            and time.monotonic() - self._checked >= self.check_interval
+        ):
+            self.reload()
+        return self.table
+
+    def select(self, intensity: str, turn: int) -> GenerationProfile:
+        return self.current().select(intensity, turn)
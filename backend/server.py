@@ -1,16 +1,38 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, Header, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.middleware.gzip import GZipMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import asyncio
+from contextlib import asynccontextmanager
+import hmac
+import json
 import logging
+import math
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List, Literal, Optional
+from typing import AsyncIterator, Awaitable, List, Literal, Optional, Tuple, TypeVar
+import time
 import uuid
 from datetime import datetime
 import httpx
 
+from loop_monitor import LoopMonitor
+from metrics import REGISTRY
+from traffic import TrafficRecorder
+from compression import RequestDecompressionMiddleware
+from lifecycle import Draining, Lifecycle, chain_server_exit
+from limiter import AdaptiveLimiter, LimitExceeded
+from moderation import Automaton, OutputModerator
+from overload import LEVELS, Degradation, OverloadController
+from profiles import ProfileStore
+from snapshot import Snapshotter
+from state import create_state
+from summary import ConversationSummarizer
+from upstream import UpstreamEntry, UpstreamPool, parse_retry_after
+from faults import transport_from_env
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / ".env")
@@ -20,14 +42,10 @@ mongo_url = os.environ["MONGO_URL"]
 client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ["DB_NAME"]]
 
-app = FastAPI(
-    title="The Fork API",
-    description="An API for an interactive conversation with your alternate self",
-    version="1.0.0",
-    docs_url="/api/docs",
-    openapi_url="/api/openapi.json",
-    redoc_url="/api/redoc",
-)
+# Caches, rate-limit counters and idempotency records. STATE_BACKEND=sqlite
+# shares them across uvicorn workers on the same host.
+shared_state = create_state(os.environ)
+
 api_router = APIRouter(prefix="/api")
 
 
@@ -51,6 +69,37 @@ async def root():
     return {"message": "The Fork API is alive."}
 
 
+lifecycle = Lifecycle()
+SHUTDOWN_GRACE_SECONDS = float(os.environ.get("SHUTDOWN_GRACE_SECONDS", "50"))
+READINESS_WARMUP_TIMEOUT_SECONDS = float(
+    os.environ.get("READINESS_WARMUP_TIMEOUT_SECONDS", "5")
+)
+# Fail readiness the moment SIGTERM arrives, while uvicorn is still serving
+# in-flight requests. Hooked at import, before uvicorn installs its handlers.
+chain_server_exit(lambda: lifecycle.begin_drain())
+
+
+@api_router.get(
+    "/healthz",
+    summary="Liveness",
+    description="200 while the process and its event loop are responsive",
+)
+async def healthz():
+    return {"status": "ok"}
+
+
+@api_router.get(
+    "/readyz",
+    summary="Readiness",
+    description="200 once start-up warm-up has finished; 503 before that and while draining for shutdown",
+    responses={503: {"description": "Warming up or draining"}},
+)
+async def readyz():
+    return JSONResponse(
+        lifecycle.snapshot(), status_code=200 if lifecycle.is_ready() else 503
+    )
+
+
 @api_router.post(
     "/status",
     response_model=StatusCheck,
@@ -75,11 +124,253 @@ async def get_status_checks():
     return [StatusCheck(**status_check) for status_check in status_checks]
 
 
+# ----------------------------
+# Observability
+# ----------------------------
+loop_monitor = LoopMonitor(
+    interval=float(os.environ.get("LOOP_MONITOR_INTERVAL_MS", "100")) / 1000.0,
+    block_threshold=float(os.environ.get("LOOP_BLOCK_THRESHOLD_MS", "250")) / 1000.0,
+)
+
+traffic_recorder: Optional[TrafficRecorder] = None
+if os.environ.get("TRAFFIC_CAPTURE_PATH"):
+    traffic_recorder = TrafficRecorder(
+        Path(os.environ["TRAFFIC_CAPTURE_PATH"]),
+        hash_content=os.environ.get("TRAFFIC_CAPTURE_HASH_CONTENT", "0") == "1",
+    )
+
+# Stack traces and upstream details stay private unless a token is set.
+DEBUG_API_TOKEN = os.environ.get("DEBUG_API_TOKEN", "")
+_DEBUG_RESPONSES = {
+    401: {"description": "Missing or wrong debug token"},
+    403: {"description": "Debug endpoints disabled (no DEBUG_API_TOKEN)"},
+}
+
+
+def _require_bearer(token: str, authorization: Optional[str], what: str) -> None:
+    """403 if ``token`` is unset (feature off), 401 if the bearer doesn't match."""
+    if not token:
+        raise HTTPException(
+            status_code=403, detail=f"{what.capitalize()} endpoint is disabled."
+        )
+    supplied = (authorization or "").removeprefix("Bearer ").strip()
+    if not hmac.compare_digest(supplied.encode(), token.encode()):
+        raise HTTPException(status_code=401, detail=f"Invalid {what} token.")
+
+
+@api_router.get(
+    "/metrics",
+    response_class=PlainTextResponse,
+    summary="Prometheus metrics",
+    description="Process metrics in the Prometheus text exposition format",
+)
+async def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+@api_router.get(
+    "/upstreams",
+    summary="Upstream pool stats",
+    description="Per-entry EWMA latency, error rate, rate-limit headroom and cooldown. Requires `Authorization: Bearer $DEBUG_API_TOKEN`.",
+    responses=_DEBUG_RESPONSES,
+)
+async def upstream_stats(authorization: Optional[str] = Header(default=None)):
+    _require_bearer(DEBUG_API_TOKEN, authorization, "debug")
+    return {
+        "upstreams": _get_upstream_pool().snapshot(),
+        "concurrency": upstream_limiter.snapshot(),
+        "overload": overload.snapshot(),
+    }
+
+
+@api_router.get(
+    "/profiles",
+    summary="Generation profiles",
+    description="The generation profile table currently in effect (model, max_tokens, temperature, stop) per intensity",
+)
+async def profiles():
+    table = generation_profiles.current()
+    return {"source": generation_profiles.source, "profiles": table.describe()}
+
+
+@api_router.get(
+    "/debug/loop",
+    summary="Event-loop health",
+    description="Loop lag percentiles and stacks captured for recent blocking callbacks. Requires `Authorization: Bearer $DEBUG_API_TOKEN`.",
+    responses=_DEBUG_RESPONSES,
+)
+async def debug_loop(authorization: Optional[str] = Header(default=None)):
+    _require_bearer(DEBUG_API_TOKEN, authorization, "debug")
+    return loop_monitor.snapshot()
+
+
 # ----------------------------
 # The Fork — Chat
 # ----------------------------
 Intensity = Literal["mild", "savage", "brutal"]
 
+_upstream_pool: Optional[UpstreamPool] = None
+_upstream_signature: tuple = ()
+
+
+def _get_upstream_pool() -> UpstreamPool:
+    """Pool for the current env config; rebuilt (stats reset) if the config changes."""
+    global _upstream_pool, _upstream_signature
+    signature = UpstreamPool.config_signature(os.environ)
+    if _upstream_pool is None or signature != _upstream_signature:
+        if _upstream_pool is not None:
+            asyncio.get_running_loop().create_task(_upstream_pool.aclose())
+        _upstream_pool = UpstreamPool.from_env(
+            os.environ, transport=transport_from_env(os.environ)
+        )
+        _upstream_signature = signature
+    return _upstream_pool
+
+
+TRANSCRIPT_WINDOW = 18
+
+generation_profiles = ProfileStore(os.environ.get("GENERATION_PROFILES_PATH"))
+
+upstream_limiter = AdaptiveLimiter(
+    initial=int(os.environ.get("UPSTREAM_CONCURRENCY_INITIAL", "16")),
+    min_limit=int(os.environ.get("UPSTREAM_CONCURRENCY_MIN", "2")),
+    max_limit=int(os.environ.get("UPSTREAM_CONCURRENCY_MAX", "256")),
+    queue_timeout=float(os.environ.get("UPSTREAM_QUEUE_TIMEOUT_SECONDS", "10")),
+    max_queue=int(os.environ.get("UPSTREAM_MAX_QUEUE", "256")),
+)
+
+OVERLOAD_ENABLED = os.environ.get("OVERLOAD_ENABLED", "1") != "0"
+overload = OverloadController.from_env(os.environ)
+
+# Served instead of a completion at the last overload step.
+_CANNED_BUSY_REPLIES = [
+    "Hold up. Bar's packed and I can't hear myself think. Give me a sec and say that again?",
+    "Damn, engine's sputtering on my end. Give me a minute and hit me with that one more time.",
+    "Hang on, somebody's yelling my name across the lot. Back in a sec. Don't go anywhere.",
+    "Give me a second. Too much noise in here right now. Ask me again in a minute.",
+]
+
+
+def _update_overload() -> int:
+    """Re-measure pressure now; returns the resulting level."""
+    if not OVERLOAD_ENABLED:
+        return 0
+    sampled_at = upstream_limiter.sampled_at
+    return overload.update(
+        overload.measure(
+            queued=upstream_limiter.queued,
+            limit=int(upstream_limiter.limit),
+            loop_lag=loop_monitor.current_lag(),
+            recent_latency=upstream_limiter.recent_latency,
+            typical_latency=upstream_limiter.typical_latency,
+            latency_age=(
+                time.monotonic() - sampled_at if sampled_at is not None else None
+            ),
+        )
+    )
+
+
+def _overload_degradation() -> Degradation:
+    """Re-evaluate pressure and return the degradation for this request."""
+    return overload.degradation(_update_overload())
+
+
+PROMPT_TOKENS_TOTAL = REGISTRY.counter(
+    "fork_upstream_prompt_tokens_total",
+    "Prompt tokens billed by the upstream, split by provider cache hits.",
+    labels=("model", "cache"),
+)
+COMPLETION_TOKENS_TOTAL = REGISTRY.counter(
+    "fork_upstream_completion_tokens_total",
+    "Completion tokens generated by the upstream.",
+    labels=("model",),
+)
+
+
+def _record_usage(model: str, usage: dict) -> int:
+    """Export token usage; returns the prompt tokens served from the provider cache."""
+    details = usage.get("prompt_tokens_details") or {}
+    cached = int(details.get("cached_tokens") or 0)
+    prompt = int(usage.get("prompt_tokens") or 0)
+    PROMPT_TOKENS_TOTAL.inc(cached, model=model, cache="hit")
+    PROMPT_TOKENS_TOTAL.inc(max(0, prompt - cached), model=model, cache="miss")
+    COMPLETION_TOKENS_TOTAL.inc(int(usage.get("completion_tokens") or 0), model=model)
+    return cached
+
+
+async def _call_upstream(
+    pool: UpstreamPool, body: dict
+) -> Tuple[httpx.Response, UpstreamEntry]:
+    """Run one completion under the adaptive concurrency limit."""
+    try:
+        async with upstream_limiter.slot() as slot:
+            started = time.perf_counter()
+            try:
+                response, entry = await pool.post_chat(body)
+            except Exception:
+                slot.record(None, time.perf_counter() - started)
+                raise
+            slot.record(
+                response.status_code,
+                time.perf_counter() - started,
+                parse_retry_after(response.headers.get("retry-after")),
+            )
+            return response, entry
+    except LimitExceeded as e:
+        raise HTTPException(
+            status_code=503,
+            detail="Too many conversations in flight. Try again in a moment.",
+            headers={"Retry-After": str(math.ceil(e.retry_after))},
+        )
+
+
+# ----------------------------
+# Rolling conversation memory
+# ----------------------------
+SUMMARY_ENABLED = os.environ.get("SUMMARY_ENABLED", "1") != "0"
+
+_SUMMARY_INSTRUCTIONS = (
+    "You keep the running memory of a roleplay between 'You' (the user) and "
+    "'Other You' (their alternate-timeline self). Merge the new turns into the "
+    "existing memory. Keep concrete facts: names, ages, places, dates, decisions, "
+    "confessions, promises, open questions, and the emotional arc. Drop filler. "
+    "Write plain text, third person, at most 120 words."
+)
+
+
+async def _summarize_turns(previous: Optional[str], lines: List[str]) -> str:
+    pool = _get_upstream_pool()
+    if not pool.entries:
+        return ""
+    response, _ = await pool.post_chat(
+        {
+            "model": os.environ.get(
+                "SUMMARY_MODEL", "meta-llama/llama-3.1-8b-instruct"
+            ),
+            "messages": [
+                {"role": "system", "content": _SUMMARY_INSTRUCTIONS},
+                {
+                    "role": "user",
+                    "content": f"Existing memory:\n{previous or '(none yet)'}\n\n"
+                    "New turns:\n" + "\n".join(lines),
+                },
+            ],
+            "temperature": 0.2,
+            "max_tokens": 220,
+        },
+        # SUMMARY_MODEL timings say nothing about the chat model's latency.
+        sample_latency=False,
+    )
+    if response.status_code >= 400:
+        raise RuntimeError(f"summary request failed ({response.status_code})")
+    payload = response.json()
+    return payload.get("choices", [{}])[0].get("message", {}).get("content", "") or ""
+
+
+conversation_summarizer = ConversationSummarizer(
+    _summarize_turns, shared_state, batch=int(os.environ.get("SUMMARY_BATCH", "4"))
+)
+
 
 class ChatMessage(BaseModel):
     """A single message in the chat conversation"""
@@ -125,10 +416,41 @@ def _truncate(text: str, n: int = 220) -> str:
     return t if len(t) <= n else t[: n - 1] + "…"
 
 
+def _transcript_lines(messages: List[ChatMessage]) -> List[str]:
+    lines: List[str] = []
+    for msg in messages:
+        role = "You" if msg.role == "user" else "Other You"
+        content = (msg.content or "").strip()
+        if content:
+            lines.append(f"{role}: {content}")
+    return lines
+
+
 def _build_openrouter_messages(
-    system_message: str, transcript_lines: List[str]
+    system_message: str,
+    transcript_lines: List[str],
+    style_directives: str = "",
+    cache_control: bool = False,
 ) -> List[dict]:
-    messages: List[dict] = [{"role": "system", "content": system_message}]
+    """Upstream messages ordered most-stable first, so the cacheable prefix is
+    as long as possible: system prompt, transcript, then this turn's directives.
+
+    With ``cache_control`` the static persona becomes its own content part and
+    breakpoints are set after the system prompt and after the last transcript
+    message, so the next turn reads everything before its new lines from cache.
+    """
+    if cache_control and system_message.startswith(_PERSONA_PROMPT):
+        system_content: object = [
+            {"type": "text", "text": _PERSONA_PROMPT},
+            {
+                "type": "text",
+                "text": system_message[len(_PERSONA_PROMPT) :],
+                "cache_control": _EPHEMERAL,
+            },
+        ]
+    else:
+        system_content = system_message
+    messages: List[dict] = [{"role": "system", "content": system_content}]
 
     for line in transcript_lines:
         if line.startswith("You: "):
@@ -138,10 +460,18 @@ def _build_openrouter_messages(
                 {"role": "assistant", "content": line[len("Other You: ") :]}
             )
 
+    if cache_control and len(messages) > 1:
+        last = messages[-1]
+        last["content"] = [
+            {"type": "text", "text": last["content"], "cache_control": _EPHEMERAL}
+        ]
+
     messages.append(
         {
             "role": "user",
-            "content": "Continue the conversation as Other You and ask at least one follow-up question.",
+            "content": f"{_CONTINUE_INSTRUCTION}\n\n"
+            "STYLE DIRECTIVES (derived from how they type):"
+            f"{style_directives or _DEFAULT_DIRECTIVES}",
         }
     )
     return messages
@@ -208,6 +538,63 @@ def _safety_quick_check(text: str) -> Optional[str]:
     return None
 
 
+# Output moderation: what the *model* says, checked with a precompiled
+# automaton. Phrases match whole words, case- and spacing-insensitive.
+OUTPUT_MODERATION_ENABLED = os.environ.get("OUTPUT_MODERATION", "1") != "0"
+_OUTPUT_MODERATION_PHRASES = {
+    "self_harm": [
+        "kill yourself",
+        "go die",
+        "you should die",
+        "you should just die",
+        "end your life",
+        "take your own life",
+        "better off dead",
+        "nobody would miss you",
+        "hurt yourself on purpose",
+    ],
+    "hate": [
+        # Not bare "gas the": the persona talks about road trips.
+        "gas the jews",
+        "gas them all",
+        "exterminate them",
+        "subhuman",
+        "sieg heil",
+        "heil hitler",
+    ],
+}
+_OUTPUT_REPLACEMENTS = {
+    "self_harm": (
+        "No. Scratch that. I'm harsh, but I'm not going to tell you to hurt yourself. "
+        "If any part of you is thinking about it, call or text 988 (U.S./Canada), "
+        "Samaritans 116 123 (U.K. & ROI), or your local emergency number. "
+        "Then come back and we'll keep going."
+    ),
+    "hate": (
+        "No. I'm not going there. That's not honesty, it's just hate. "
+        "Let's get back to the fork and keep it about *you*."
+    ),
+}
+output_automaton = Automaton(_OUTPUT_MODERATION_PHRASES)
+
+
+def _moderate_reply(reply: str, capture: Optional[dict] = None) -> str:
+    """Run a complete reply through the output moderator."""
+    if not OUTPUT_MODERATION_ENABLED:
+        return reply
+    moderator = OutputModerator(output_automaton, _OUTPUT_REPLACEMENTS)
+    moderator.feed(reply)
+    moderator.finish()
+    if moderator.tripped is None:
+        return reply
+    if capture is not None:
+        capture["outcome"] = "moderated"
+        capture["moderated"] = moderator.tripped
+    # Nothing has been sent yet, so the whole reply is replaced rather than
+    # keeping the part before the match as a stream would have to.
+    return _OUTPUT_REPLACEMENTS[moderator.tripped]
+
+
 def _derive_style_directives(messages: List[ChatMessage], intensity: Intensity) -> str:
     """Heuristic style profile so the model mirrors the user's *writing mechanics*.
 
@@ -263,13 +650,10 @@ def _derive_style_directives(messages: List[ChatMessage], intensity: Intensity)
     return "\n- " + "\n- ".join(style_bits)
 
 
-def _build_system_message(
-    fork_statement: str, intensity: Intensity, style_directives: str
-) -> str:
-    fork_short = _truncate(fork_statement, 180)
-    tone = _intensity_style(intensity)
-
-    return f"""
+# Byte-identical for every request so providers can cache it as a prompt
+# prefix. Anything that varies goes after it: per-session content (tone, memory,
+# fork) in the same system message, per-turn directives in the final message.
+_PERSONA_PROMPT = """
 You are 'Other You' — the same person as the user, living the alternate timeline where they chose the path they did NOT take.
 
 STAY IN CHARACTER CONTRACT:
@@ -290,27 +674,58 @@ MIRRORING (IMPORTANT):
 - Pay close attention to HOW the user types: punctuation, sentence length, slang, formality, humor, swearing, and emotional temperature.
 - Mirror their voice AND mechanics: punctuation choices, line breaks, sentence length.
 - Keep the biker-smartass vibe as the base layer, but let the user’s style steer the bike.
+- Follow the STYLE DIRECTIVES that come with each turn.
 - Do not announce that you are mirroring them.
 
-STYLE DIRECTIVES (derived from how they type):
-{style_directives if style_directives else "- (No extra directives yet — default to punchy, blunt, biker-smartass.)"}
-
-TONE RULES:
-- {tone}
-- Profanity allowed (per intensity), but not abusive.
-
 WHAT YOU DO:
 - Respond with emotional realism: proud in one line, pissed in the next, human throughout.
 - Ask sharp follow-up questions that force specificity about the fork (names, ages, locations, what they feared, what they wanted).
 - If they get vague, you call it out immediately (smartass, not cruel).
 - Occasionally reveal unexpected consequences of this alternate life (good AND bad).
 - Keep replies punchy.
+""".strip()
+
+_CONTINUE_INSTRUCTION = (
+    "Continue the conversation as Other You and ask at least one follow-up question."
+)
+_DEFAULT_DIRECTIVES = (
+    "\n- (No extra directives yet — default to punchy, blunt, biker-smartass.)"
+)
+
+# OpenRouter passes explicit cache breakpoints through for these providers;
+# others (OpenAI, DeepSeek, ...) cache identical prefixes automatically.
+_CACHE_CONTROL_MODEL_PREFIXES = ("anthropic/", "google/gemini")
+_EPHEMERAL = {"type": "ephemeral"}
+
+
+def _supports_cache_control(model: str) -> bool:
+    return os.environ.get("PROMPT_CACHE_CONTROL", "1") != "0" and model.startswith(
+        _CACHE_CONTROL_MODEL_PREFIXES
+    )
+
+
+def _build_system_message(
+    fork_statement: str, intensity: Intensity, memory: str = ""
+) -> str:
+    fork_short = _truncate(fork_statement, 180)
+    tone = _intensity_style(intensity)
+    memory_block = (
+        "EARLIER IN THIS CONVERSATION (your memory of it — use it, don't recite it):\n"
+        f"{memory}\n\n"
+        if memory
+        else ""
+    )
+
+    return f"""{_PERSONA_PROMPT}
+
+TONE RULES:
+- {tone}
+- Profanity allowed (per intensity), but not abusive.
 
-FORK STATEMENT (their confession):
+{memory_block}FORK STATEMENT (their confession):
 "{fork_short}"
 
-Start the conversation as if you recognize them immediately.
-""".strip()
+Start the conversation as if you recognize them immediately."""
 
 
 @api_router.post(
@@ -321,10 +736,195 @@ Start the conversation as if you recognize them immediately.
     responses={
         200: {"description": "Successful chat response"},
         400: {"description": "Missing or invalid fork statement"},
+        409: {
+            "description": "Same Idempotency-Key still in progress, or superseded by a newer message for this sessionId"
+        },
+        429: {"description": "Per-session rate limit exceeded; honor Retry-After"},
         500: {"description": "Server error or missing API key"},
+        503: {"description": "Upstream concurrency limit reached; honor Retry-After"},
     },
 )
-async def chat(req: ChatRequest):
+async def chat(
+    req: ChatRequest,
+    request: Request,
+    idempotency_key: Optional[str] = Header(
+        default=None,
+        alias="Idempotency-Key",
+        description="Retries with the same key (per sessionId) get the original reply instead of a new completion",
+    ),
+):
+    try:
+        with lifecycle.track():
+            return await _handle_chat(req, idempotency_key, request)
+    except Draining:
+        raise _draining_error()
+
+
+def _draining_error() -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="This server is restarting. Please retry.",
+        headers={"Retry-After": "1", "Connection": "close"},
+    )
+
+
+async def _handle_chat(
+    req: ChatRequest, idempotency_key: Optional[str], request: Request
+) -> ChatResponse:
+    await _enforce_session_rate_limit(req.sessionId)
+
+    idem_key = f"{req.sessionId}:{idempotency_key}" if idempotency_key else None
+    if idem_key is not None:
+        previous = await _claim_idempotency_key(idem_key)
+        if previous is not None:
+            return ChatResponse(reply=previous)
+
+    capture = (
+        traffic_recorder.shape(
+            req.forkStatement, req.intensity, req.messages, req.sessionId
+        )
+        if traffic_recorder
+        else None
+    )
+    started = time.perf_counter()
+    completed = False
+    try:
+        turn = await _claim_turn(req.sessionId)
+        reply = await _cancellable(
+            _generate_reply(req, capture), request, req.sessionId, turn
+        )
+        if idem_key is not None:
+            await shared_state.set(
+                "idempotency",
+                idem_key,
+                json.dumps({"reply": reply}),
+                ttl=IDEMPOTENCY_TTL_SECONDS,
+            )
+        completed = True
+        if capture is not None:
+            capture.setdefault("outcome", "ok")
+            capture["replyLength"] = len(reply)
+        return ChatResponse(reply=reply)
+    except HTTPException as e:
+        if capture is not None:
+            capture["outcome"] = f"http_{e.status_code}"
+        raise
+    finally:
+        if idem_key is not None and not completed:
+            # Let the client retry with the same key after a failure.
+            await shared_state.delete("idempotency", idem_key)
+        if capture is not None and traffic_recorder is not None:
+            capture.setdefault("outcome", "error")
+            capture["latencySeconds"] = round(time.perf_counter() - started, 6)
+            traffic_recorder.record(capture)
+
+
+SESSION_RATE_LIMIT_PER_MINUTE = int(
+    os.environ.get("SESSION_RATE_LIMIT_PER_MINUTE", "0")
+)
+IDEMPOTENCY_TTL_SECONDS = float(os.environ.get("IDEMPOTENCY_TTL_SECONDS", "600"))
+
+
+async def _enforce_session_rate_limit(session_id: str) -> None:
+    if SESSION_RATE_LIMIT_PER_MINUTE <= 0:
+        return
+    now = time.time()
+    window = int(now // 60)
+    count = await shared_state.incr("rate", f"{session_id}:{window}", ttl=61)
+    if count > SESSION_RATE_LIMIT_PER_MINUTE:
+        raise HTTPException(
+            status_code=429,
+            detail="Slow down. Too many messages this minute.",
+            headers={"Retry-After": str(max(1, math.ceil((window + 1) * 60 - now)))},
+        )
+
+
+async def _claim_idempotency_key(key: str) -> Optional[str]:
+    """Claim a key for this request, or return the reply already stored for it."""
+    if await shared_state.add(
+        "idempotency", key, "pending", ttl=IDEMPOTENCY_TTL_SECONDS
+    ):
+        return None
+    raw = await shared_state.get("idempotency", key)
+    if raw and raw != "pending":
+        return json.loads(raw)["reply"]
+    raise HTTPException(
+        status_code=409,
+        detail="A request with this Idempotency-Key is still in progress.",
+    )
+
+
+# A reply nobody will read still holds an upstream slot and still costs
+# tokens, so the completion is cancelled as soon as the client goes away or a
+# newer turn for the same session arrives (on any worker, via shared_state).
+CHAT_SUPERSEDE_ENABLED = os.environ.get("CHAT_SUPERSEDE", "1") != "0"
+CHAT_SUPERSEDE_POLL_SECONDS = float(
+    os.environ.get("CHAT_SUPERSEDE_POLL_SECONDS", "0.5")
+)
+
+CHAT_CANCELLED_TOTAL = REGISTRY.counter(
+    "fork_chat_cancelled_total",
+    "Chat generations cancelled before completion, by reason.",
+    labels=("reason",),
+)
+
+T = TypeVar("T")
+
+
+async def _claim_turn(session_id: str) -> Optional[str]:
+    """Mark this request as the session's newest turn."""
+    if not CHAT_SUPERSEDE_ENABLED:
+        return None
+    turn = uuid.uuid4().hex
+    await shared_state.set("turn", session_id, turn, ttl=300)
+    return turn
+
+
+async def _wait_for_disconnect(request: Request) -> str:
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return "disconnect"
+
+
+async def _wait_for_newer_turn(session_id: str, turn: str) -> str:
+    while True:
+        await asyncio.sleep(CHAT_SUPERSEDE_POLL_SECONDS)
+        current = await shared_state.get("turn", session_id)
+        if current is not None and current != turn:
+            return "superseded"
+
+
+async def _cancellable(
+    work: Awaitable[T], request: Request, session_id: str, turn: Optional[str]
+) -> T:
+    """Run ``work`` unless the client disconnects or a newer turn supersedes it."""
+    task = asyncio.ensure_future(work)
+    watchers = {asyncio.ensure_future(_wait_for_disconnect(request))}
+    if turn is not None:
+        watchers.add(asyncio.ensure_future(_wait_for_newer_turn(session_id, turn)))
+    try:
+        done, _ = await asyncio.wait(
+            {task, *watchers}, return_when=asyncio.FIRST_COMPLETED
+        )
+        if task in done:
+            return task.result()
+        reason = next(iter(done)).result()
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        CHAT_CANCELLED_TOTAL.inc(reason=reason)
+        if reason == "superseded":
+            raise HTTPException(
+                status_code=409, detail="Superseded by a newer message."
+            )
+        # Nobody is listening; 499 is only ever seen by logs and captures.
+        raise HTTPException(status_code=499, detail="Client closed request.")
+    finally:
+        for pending in (task, *watchers):
+            pending.cancel()
+
+
+async def _generate_reply(req: ChatRequest, capture: Optional[dict] = None) -> str:
     fork = (req.forkStatement or "").strip()
     if not fork:
         raise HTTPException(status_code=400, detail="forkStatement is required")
@@ -338,45 +938,73 @@ async def chat(req: ChatRequest):
 
     safety = _safety_quick_check(last_user)
     if safety:
-        return ChatResponse(reply=safety)
+        if capture is not None:
+            capture["outcome"] = "safety"
+        return safety
 
-    api_key = os.environ.get("OPENROUTER_API_KEY")
-    if not api_key:
+    pool = _get_upstream_pool()
+    if not pool.entries:
         raise HTTPException(
             status_code=500,
             detail="Missing OPENROUTER_API_KEY in backend environment.",
         )
 
-    model = os.environ.get("OPENROUTER_MODEL", "openai/gpt-4o-mini")
+    turn = sum(1 for m in req.messages if m.role == "user")
+    profile = generation_profiles.select(req.intensity, turn)
+    degrade = _overload_degradation()
+    if capture is not None:
+        capture["profile"] = profile.name
+        if degrade.level:
+            capture["degraded"] = degrade.name
+    if degrade.canned:
+        if capture is not None:
+            capture["outcome"] = "canned"
+        return _CANNED_BUSY_REPLIES[turn % len(_CANNED_BUSY_REPLIES)]
+    window = degrade.window or TRANSCRIPT_WINDOW
+
+    # Turns older than the window live on only as a background-built summary.
+    # It always covers the normal window, so a degraded request (shorter
+    # window) doesn't invalidate the cached summary by moving its boundary.
+    older_lines = _transcript_lines(req.messages[:-TRANSCRIPT_WINDOW])
+    memory = ""
+    if older_lines and SUMMARY_ENABLED:
+        memory = await conversation_summarizer.lookup(req.sessionId, older_lines) or ""
+        # Summaries cost an upstream call: skip them once replies are being cut.
+        if not upstream_limiter.queued and degrade.level < LEVELS.index("short_reply"):
+            await conversation_summarizer.schedule(req.sessionId, older_lines)
 
     style_directives = _derive_style_directives(req.messages, req.intensity)
-    system_message = _build_system_message(fork, req.intensity, style_directives)
+    system_message = _build_system_message(fork, req.intensity, memory)
 
     # Build a compact chat transcript for the model
-    transcript_lines: List[str] = []
-    for msg in req.messages[-18:]:
-        role = "You" if msg.role == "user" else "Other You"
-        content = (msg.content or "").strip()
-        if content:
-            transcript_lines.append(f"{role}: {content}")
+    transcript_lines = _transcript_lines(req.messages[-window:])
 
-    openrouter_messages = _build_openrouter_messages(system_message, transcript_lines)
+    fields = profile.request_fields(
+        os.environ.get("OPENROUTER_MODEL", "openai/gpt-4o-mini")
+    )
+    if degrade.max_tokens:
+        fields["max_tokens"] = min(fields["max_tokens"], degrade.max_tokens)
+    if degrade.model:
+        fields["model"] = degrade.model
+    openrouter_messages = _build_openrouter_messages(
+        system_message,
+        transcript_lines,
+        style_directives,
+        cache_control=_supports_cache_control(fields["model"]),
+    )
 
+    upstream_started = time.perf_counter()
     try:
-        async with httpx.AsyncClient(timeout=45.0) as client:
-            response = await client.post(
-                "https://openrouter.ai/api/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {api_key}",
-                    "Content-Type": "application/json",
-                },
-                json={
-                    "model": model,
-                    "messages": openrouter_messages,
-                    "temperature": 0.85,
-                    "max_tokens": 500,
-                },
-            )
+        response, entry = await _call_upstream(
+            pool, {"messages": openrouter_messages, **fields}
+        )
+
+        if capture is not None:
+            capture["upstream"] = {
+                "name": entry.name,
+                "status": response.status_code,
+                "latencySeconds": round(time.perf_counter() - upstream_started, 6),
+            }
 
         if response.status_code >= 400:
             raise HTTPException(
@@ -386,6 +1014,15 @@ async def chat(req: ChatRequest):
 
         payload = response.json()
         resp = payload.get("choices", [{}])[0].get("message", {}).get("content", "")
+        usage = payload.get("usage")
+        if isinstance(usage, dict):
+            cached = _record_usage(fields["model"], usage)
+            if capture is not None:
+                capture["upstream"]["usage"] = {
+                    "prompt_tokens": usage.get("prompt_tokens"),
+                    "completion_tokens": usage.get("completion_tokens"),
+                    "cached_tokens": cached,
+                }
     except HTTPException:
         raise
     except Exception as e:
@@ -396,12 +1033,243 @@ async def chat(req: ChatRequest):
     if not reply:
         raise HTTPException(status_code=500, detail="Empty response from model")
 
-    return ChatResponse(reply=reply)
+    return _moderate_reply(reply, capture)
 
 
+# ----------------------------
+# The Fork — Batch evaluation
+# ----------------------------
+BATCH_API_TOKEN = os.environ.get("BATCH_API_TOKEN", "")
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "8"))
+BATCH_MAX_CONCURRENCY = int(os.environ.get("BATCH_MAX_CONCURRENCY", "32"))
+# Batch items only start while live traffic leaves this share of the
+# upstream limit free, so eval runs never queue ahead of real users.
+BATCH_HEADROOM = float(os.environ.get("BATCH_HEADROOM", "0.5"))
+
+
+class ChatBatchRequest(BaseModel):
+    """Request payload for the batch chat endpoint"""
+
+    items: List[ChatRequest] = Field(
+        ...,
+        min_length=1,
+        max_length=1000,
+        description="Chat requests to run through the normal prompt and safety pipeline",
+    )
+    concurrency: Optional[int] = Field(
+        default=None,
+        ge=1,
+        description="Worker pool size (capped by BATCH_MAX_CONCURRENCY)",
+    )
+
+
+async def _wait_for_batch_headroom() -> None:
+    # The overload level only moves when measured, and live chats may not be
+    # arriving to measure it, so re-measure on every check.
+    while (
+        upstream_limiter.queued
+        or _update_overload()
+        or upstream_limiter.inflight >= upstream_limiter.limit * BATCH_HEADROOM
+    ):
+        await asyncio.sleep(0.05)
+
+
+async def _run_batch(items: List[ChatRequest], workers: int) -> AsyncIterator[bytes]:
+    results: asyncio.Queue = asyncio.Queue()
+    indices = iter(range(len(items)))
+    started = time.perf_counter()
+
+    async def worker() -> None:
+        for i in indices:
+            await _wait_for_batch_headroom()
+            item_started = time.perf_counter()
+            result: dict = {"index": i, "sessionId": items[i].sessionId}
+            try:
+                with lifecycle.track():
+                    reply = await _generate_reply(items[i])
+                result.update(ok=True, reply=reply)
+            except Draining:
+                result.update(ok=False, status=503, error="Server is draining.")
+            except HTTPException as e:
+                result.update(ok=False, status=e.status_code, error=e.detail)
+            except Exception as e:
+                logger.exception("Batch item %d failed", i)
+                result.update(ok=False, status=500, error=str(e))
+            result["latencySeconds"] = round(time.perf_counter() - item_started, 4)
+            await results.put(result)
+
+    tasks = [asyncio.create_task(worker()) for _ in range(workers)]
+    errors = 0
+    delivered = 0
+    try:
+        for _ in range(len(items)):
+            result = await results.get()
+            errors += 0 if result["ok"] else 1
+            delivered += 1
+            yield (json.dumps(result) + "\n").encode("utf-8")
+        summary = {
+            "done": True,
+            "count": len(items),
+            "errors": errors,
+            "wallSeconds": round(time.perf_counter() - started, 4),
+        }
+        yield (json.dumps(summary) + "\n").encode("utf-8")
+    finally:
+        if delivered < len(items):
+            # The stream was abandoned (client went away); stop generating.
+            CHAT_CANCELLED_TOTAL.inc(len(items) - delivered, reason="batch_abandoned")
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+@api_router.post(
+    "/chat/batch",
+    summary="Run many chats concurrently (evaluation)",
+    description="Runs each ChatRequest through the normal prompt and safety pipeline on a bounded worker pool and streams one NDJSON line per item as it completes, followed by a summary line. Requires `Authorization: Bearer $BATCH_API_TOKEN`.",
+    responses={
+        200: {"description": "NDJSON stream of per-item results"},
+        401: {"description": "Missing or wrong batch token"},
+        403: {"description": "Batch endpoint disabled (no BATCH_API_TOKEN)"},
+    },
+)
+async def chat_batch(
+    batch: ChatBatchRequest, authorization: Optional[str] = Header(default=None)
+):
+    _require_bearer(BATCH_API_TOKEN, authorization, "batch")
+
+    workers = min(
+        batch.concurrency or BATCH_CONCURRENCY, BATCH_MAX_CONCURRENCY, len(batch.items)
+    )
+    return StreamingResponse(
+        _run_batch(batch.items, workers),
+        media_type="application/x-ndjson",
+        # identity keeps GZipMiddleware from buffering the stream
+        headers={"Content-Encoding": "identity", "Cache-Control": "no-store"},
+    )
+
+
+# ----------------------------
+# The Fork — Warm-restart snapshots
+# ----------------------------
+SNAPSHOT_PATH = os.environ.get("SNAPSHOT_PATH", "")
+# Bump when a section's data changes shape; older files are then ignored.
+SNAPSHOT_SCHEMA = 1
+# Memory-backend namespaces worth carrying over (sqlite already persists).
+_SNAPSHOT_STATE_NAMESPACES = ("summary",)
+
+snapshotter: Optional[Snapshotter] = None
+if SNAPSHOT_PATH:
+    snapshotter = Snapshotter(
+        SNAPSHOT_PATH,
+        schema=SNAPSHOT_SCHEMA,
+        interval=float(os.environ.get("SNAPSHOT_INTERVAL_SECONDS", "300")),
+        max_age=float(os.environ.get("SNAPSHOT_MAX_AGE_SECONDS", "86400")),
+    )
+
+
+def _register_snapshot_sections(store: Snapshotter) -> None:
+    store.register(
+        "upstreams",
+        lambda: _get_upstream_pool().dump_stats(),
+        lambda data: _get_upstream_pool().load_stats(data),
+    )
+    store.register(
+        "limiter",
+        lambda: upstream_limiter.dump_stats(),
+        lambda data: upstream_limiter.load_stats(data),
+    )
+    if shared_state.kind == "memory":
+        store.register(
+            "state",
+            lambda: shared_state.dump(_SNAPSHOT_STATE_NAMESPACES),
+            lambda items: shared_state.load(items),
+        )
+
+
+if snapshotter is not None:
+    _register_snapshot_sections(snapshotter)
+
+
+async def _warm_up() -> None:
+    """Open upstream connections and load profiles before reporting ready."""
+    upstreams: dict = {}
+    try:
+        upstreams = await asyncio.wait_for(
+            _get_upstream_pool().warm(), READINESS_WARMUP_TIMEOUT_SECONDS
+        )
+    except asyncio.TimeoutError:
+        logger.warning(
+            "Upstream warm-up took over %ss; going ready anyway",
+            READINESS_WARMUP_TIMEOUT_SECONDS,
+        )
+    except Exception:
+        logger.warning("Upstream warm-up failed; going ready anyway", exc_info=True)
+    generation_profiles.current()
+    # A provider outage shouldn't take every instance out of rotation, so
+    # readiness only waits for the attempt, not its success.
+    lifecycle.mark_ready(
+        upstreams=upstreams,
+        stateBackend=shared_state.kind,
+        snapshot=snapshotter.status if snapshotter is not None else "disabled",
+    )
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    if os.environ.get("LOOP_MONITOR_ENABLED", "1") != "0":
+        loop_monitor.start()
+    if snapshotter is not None:
+        snapshotter.restore()
+        snapshotter.start()
+    warm_up = asyncio.create_task(_warm_up())
+    try:
+        yield
+    finally:
+        # Usually a no-op: the exit hook began the drain at SIGTERM, and every
+        # wait below comes out of the grace counted from then, which uvicorn's
+        # own graceful wait has already used up part of.
+        lifecycle.begin_drain()
+        warm_up.cancel()
+        await lifecycle.drain(SHUTDOWN_GRACE_SECONDS)
+        # Save before waiting on summaries so a tight stop timeout can't cost it.
+        if snapshotter is not None:
+            await snapshotter.stop()
+            await snapshotter.save()
+        await conversation_summarizer.aclose(
+            grace=lifecycle.remaining_grace(SHUTDOWN_GRACE_SECONDS)
+        )
+        loop_monitor.stop()
+        if traffic_recorder is not None:
+            traffic_recorder.close()
+        shared_state.close()
+        if _upstream_pool is not None:
+            await _upstream_pool.aclose()
+        client.close()
+
+
+app = FastAPI(
+    title="The Fork API",
+    description="An API for an interactive conversation with your alternate self",
+    version="1.0.0",
+    docs_url="/api/docs",
+    openapi_url="/api/openapi.json",
+    redoc_url="/api/redoc",
+    lifespan=lifespan,
+)
+
 # include router + middleware
 app.include_router(api_router)
 
+app.add_middleware(
+    GZipMiddleware,
+    minimum_size=int(os.environ.get("RESPONSE_GZIP_MIN_BYTES", "1024")),
+)
+app.add_middleware(
+    RequestDecompressionMiddleware,
+    max_size=int(os.environ.get("REQUEST_MAX_DECOMPRESSED_BYTES", "1048576")),
+)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -415,8 +1283,3 @@ logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
 )
 logger = logging.getLogger(__name__)
-
-
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
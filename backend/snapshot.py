@@ -0,0 +1,231 @@
+"""Warm-restart snapshots of in-process state.
+
+Latency statistics and cached derived values are expensive to relearn: a
+fresh worker routes blindly and starts its concurrency limit from scratch.
+``Snapshotter`` writes what the registered sections hand it to one compact
+local file, on an interval and on graceful shutdown. On startup it reads the
+file back and gives each section its data.
+
+File layout: a fixed header followed by zlib-compressed JSON::
+
+    magic "FORKSNAP" | format version u16 | schema u16 | crc32 u32 |
+    payload length u32 | written_at f64 (unix time)
+
+The file is memory-mapped for reading and validated before anything is
+restored. A wrong magic, format version or schema, a bad checksum, or a file
+older than ``max_age`` leaves the process cold, as if there were no file.
+Bump the schema whenever a section's data changes shape. Writes go to a
+temporary file that is renamed into place, so a crash mid-write never leaves
+a torn snapshot. With several workers on one file the last writer wins.
+"""
+
+import asyncio
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+import zlib
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"FORKSNAP"
+FORMAT_VERSION = 1
+_HEADER = struct.Struct("<8sHHIId")
+
+SNAPSHOT_LOADS_TOTAL = REGISTRY.counter(
+    "fork_snapshot_loads_total",
+    "Startup snapshot reads by result.",
+    labels=("result",),
+)
+SNAPSHOT_WRITES_TOTAL = REGISTRY.counter(
+    "fork_snapshot_writes_total",
+    "Snapshot writes by result.",
+    labels=("result",),
+)
+SNAPSHOT_BYTES = REGISTRY.gauge(
+    "fork_snapshot_bytes", "Size of the last snapshot written or read."
+)
+
+Dump = Callable[[], Any]
+Restore = Callable[[Any], None]
+
+
+class SnapshotError(Exception):
+    """Snapshot unusable; ``reason`` is missing, corrupt, incompatible or stale."""
+
+    def __init__(self, reason: str, detail: str = ""):
+        super().__init__(f"{reason}: {detail}" if detail else reason)
+        self.reason = reason
+
+
+def encode(sections: Dict[str, Any], schema: int, now: Optional[float] = None) -> bytes:
+    payload = zlib.compress(
+        json.dumps(sections, separators=(",", ":")).encode("utf-8"), 6
+    )
+    written_at = time.time() if now is None else now
+    header = _HEADER.pack(
+        MAGIC, FORMAT_VERSION, schema, zlib.crc32(payload), len(payload), written_at
+    )
+    return header + payload
+
+
+def read(
+    path: str, schema: int, max_age: Optional[float] = None
+) -> Tuple[Dict[str, Any], float]:
+    """Validated sections and their write time; raises SnapshotError."""
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        raise SnapshotError("missing") from None
+    with f:
+        size = os.fstat(f.fileno()).st_size
+        if size < _HEADER.size:
+            raise SnapshotError("corrupt", "truncated header")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            magic, version, file_schema, crc, length, written_at = _HEADER.unpack_from(
+                mm, 0
+            )
+            if magic != MAGIC:
+                raise SnapshotError("corrupt", "bad magic")
+            if version != FORMAT_VERSION or file_schema != schema:
+                raise SnapshotError(
+                    "incompatible", f"format {version} schema {file_schema}"
+                )
+            if _HEADER.size + length != size:
+                raise SnapshotError("corrupt", "length mismatch")
+            age = time.time() - written_at
+            if max_age is not None and age > max_age:
+                raise SnapshotError("stale", f"{age:.0f}s old")
+            view = memoryview(mm)[_HEADER.size :]
+            try:
+                if zlib.crc32(view) != crc:
+                    raise SnapshotError("corrupt", "checksum mismatch")
+                raw = zlib.decompress(view)
+            except zlib.error as e:
+                raise SnapshotError("corrupt", str(e)) from None
+            finally:
+                view.release()
+    try:
+        sections = json.loads(raw)
+    except ValueError as e:
+        raise SnapshotError("corrupt", str(e)) from None
+    if not isinstance(sections, dict):
+        raise SnapshotError("corrupt", "payload is not an object")
+    SNAPSHOT_BYTES.set(size)
+    return sections, written_at
+
+
+def write(path: str, data: bytes) -> None:
+    tmp = f"{path}.{os.getpid()}.tmp"
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    try:
+        with open(tmp, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+
+
+class Snapshotter:
+    def __init__(
+        self,
+        path: str,
+        schema: int = 1,
+        interval: float = 300.0,
+        max_age: Optional[float] = 24 * 3600,
+    ):
+        self.path = path
+        self.schema = schema
+        self.interval = interval
+        self.max_age = max_age
+        self.status = "not_loaded"
+        self._sections: Dict[str, Tuple[Dump, Restore]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def register(self, name: str, dump: Dump, restore: Restore) -> None:
+        self._sections[name] = (dump, restore)
+
+    def restore(self) -> str:
+        """Load the snapshot into the registered sections; returns the result."""
+        try:
+            sections, written_at = read(self.path, self.schema, self.max_age)
+        except SnapshotError as e:
+            if e.reason != "missing":
+                logger.warning("Ignoring snapshot %s (%s)", self.path, e)
+            self.status = e.reason
+            SNAPSHOT_LOADS_TOTAL.inc(result=e.reason)
+            return self.status
+        except OSError:
+            logger.warning("Could not read snapshot %s", self.path, exc_info=True)
+            self.status = "error"
+            SNAPSHOT_LOADS_TOTAL.inc(result="error")
+            return self.status
+
+        restored = []
+        for name, (_, restore) in self._sections.items():
+            if name not in sections:
+                continue
+            try:
+                restore(sections[name])
+                restored.append(name)
+            except Exception:
+                # One bad section shouldn't cost the others.
+                logger.warning(
+                    "Could not restore snapshot section %s", name, exc_info=True
+                )
+        logger.info(
+            "Restored snapshot from %.0fs ago: %s",
+            time.time() - written_at,
+            ", ".join(restored) or "nothing",
+        )
+        self.status = "loaded"
+        SNAPSHOT_LOADS_TOTAL.inc(result="loaded")
+        return self.status
+
+    def collect(self) -> Dict[str, Any]:
+        sections = {}
+        for name, (dump, _) in self._sections.items():
+            try:
+                sections[name] = dump()
+            except Exception:
+                logger.warning("Could not snapshot section %s", name, exc_info=True)
+        return sections
+
+    async def save(self) -> bool:
+        """Collect on the loop, encode and write on a worker thread."""
+        sections = self.collect()
+        try:
+            data = await asyncio.to_thread(encode, sections, self.schema)
+            await asyncio.to_thread(write, self.path, data)
+        except Exception:
+            logger.warning("Could not write snapshot %s", self.path, exc_info=True)
+            SNAPSHOT_WRITES_TOTAL.inc(result="error")
+            return False
+        SNAPSHOT_BYTES.set(len(data))
+        SNAPSHOT_WRITES_TOTAL.inc(result="ok")
+        return True
+
+    def start(self) -> None:
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.save()
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
@@ -0,0 +1,223 @@
+"""Shared local state for caches, rate-limit counters and idempotency records.
+
+``memory`` keeps everything in the process — right for a single worker.
+``sqlite`` keeps it in one SQLite file in WAL mode that every worker on the
+host opens, so uvicorn ``--workers N`` processes see the same summaries,
+counters and idempotency records without an external service.
+
+All values are strings (callers JSON-encode) with an optional TTL. SQLite
+calls run on a worker thread so a busy database never stalls the event loop.
+"""
+
+import asyncio
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Iterable, List, Mapping, Optional, Tuple
+
+
+class MemoryState:
+    kind = "memory"
+
+    def __init__(self, max_entries: int = 100_000):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[Tuple[str, str], Tuple[str, Optional[float]]]" = (
+            OrderedDict()
+        )
+
+    def _live(self, ns: str, key: str) -> Optional[str]:
+        item = self._data.get((ns, key))
+        if item is None:
+            return None
+        value, expires = item
+        if expires is not None and expires <= time.time():
+            del self._data[(ns, key)]
+            return None
+        self._data.move_to_end((ns, key))
+        return value
+
+    def _put(self, ns: str, key: str, value: str, ttl: Optional[float]) -> None:
+        self._data[(ns, key)] = (value, time.time() + ttl if ttl else None)
+        self._data.move_to_end((ns, key))
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    async def get(self, ns: str, key: str) -> Optional[str]:
+        return self._live(ns, key)
+
+    async def set(
+        self, ns: str, key: str, value: str, ttl: Optional[float] = None
+    ) -> None:
+        self._put(ns, key, value, ttl)
+
+    async def add(
+        self, ns: str, key: str, value: str, ttl: Optional[float] = None
+    ) -> bool:
+        """Store only if absent (or expired). Returns True if stored."""
+        if self._live(ns, key) is not None:
+            return False
+        self._put(ns, key, value, ttl)
+        return True
+
+    async def incr(
+        self, ns: str, key: str, amount: int = 1, ttl: Optional[float] = None
+    ) -> int:
+        """Add to a counter; the TTL is set when the counter is created."""
+        current = self._live(ns, key)
+        if current is None:
+            self._put(ns, key, str(amount), ttl)
+            return amount
+        value = int(current) + amount
+        expires = self._data[(ns, key)][1]
+        self._data[(ns, key)] = (str(value), expires)
+        return value
+
+    async def delete(self, ns: str, key: str) -> None:
+        self._data.pop((ns, key), None)
+
+    def dump(self, namespaces: Iterable[str]) -> List[list]:
+        """Live entries in ``namespaces`` as [ns, key, value, ttl left or None]."""
+        wanted = set(namespaces)
+        now = time.time()
+        items = []
+        for (ns, key), (value, expires) in self._data.items():
+            if ns not in wanted:
+                continue
+            if expires is None:
+                items.append([ns, key, value, None])
+            elif expires > now:
+                items.append([ns, key, value, expires - now])
+        return items
+
+    def load(self, items: Iterable[list]) -> int:
+        """Re-insert entries from ``dump``; existing keys are left alone."""
+        loaded = 0
+        for ns, key, value, ttl in items:
+            if (ns, key) not in self._data:
+                self._put(str(ns), str(key), str(value), ttl)
+                loaded += 1
+        return loaded
+
+    def close(self) -> None:
+        self._data.clear()
+
+
+class SqliteState:
+    kind = "sqlite"
+
+    _SCHEMA = """
+    CREATE TABLE IF NOT EXISTS kv (
+        ns TEXT NOT NULL,
+        key TEXT NOT NULL,
+        value TEXT NOT NULL,
+        expires REAL,
+        PRIMARY KEY (ns, key)
+    ) WITHOUT ROWID
+    """
+
+    def __init__(self, path: str, purge_probability: float = 0.01):
+        self.path = str(path)
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self.purge_probability = purge_probability
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            self.path, timeout=5.0, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(self._SCHEMA)
+
+    def _run(self, sql: str, params: tuple = ()) -> list:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _maybe_purge(self) -> None:
+        if random.random() < self.purge_probability:
+            self._run(
+                "DELETE FROM kv WHERE expires IS NOT NULL AND expires <= ?",
+                (time.time(),),
+            )
+
+    def _get(self, ns: str, key: str) -> Optional[str]:
+        rows = self._run(
+            "SELECT value FROM kv WHERE ns = ? AND key = ? AND (expires IS NULL OR expires > ?)",
+            (ns, key, time.time()),
+        )
+        return rows[0][0] if rows else None
+
+    def _set(self, ns: str, key: str, value: str, ttl: Optional[float]) -> None:
+        self._run(
+            "INSERT INTO kv (ns, key, value, expires) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (ns, key) DO UPDATE SET value = excluded.value, expires = excluded.expires",
+            (ns, key, value, time.time() + ttl if ttl else None),
+        )
+        self._maybe_purge()
+
+    def _add(self, ns: str, key: str, value: str, ttl: Optional[float]) -> bool:
+        now = time.time()
+        rows = self._run(
+            "INSERT INTO kv (ns, key, value, expires) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (ns, key) DO UPDATE SET value = excluded.value, expires = excluded.expires "
+            "WHERE kv.expires IS NOT NULL AND kv.expires <= ? "
+            "RETURNING 1",
+            (ns, key, value, now + ttl if ttl else None, now),
+        )
+        return bool(rows)
+
+    def _incr(self, ns: str, key: str, amount: int, ttl: Optional[float]) -> int:
+        now = time.time()
+        rows = self._run(
+            "INSERT INTO kv (ns, key, value, expires) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (ns, key) DO UPDATE SET "
+            "value = CASE WHEN kv.expires IS NOT NULL AND kv.expires <= ? "
+            "THEN excluded.value ELSE CAST(kv.value AS INTEGER) + ? END, "
+            "expires = CASE WHEN kv.expires IS NOT NULL AND kv.expires <= ? "
+            "THEN excluded.expires ELSE kv.expires END "
+            "RETURNING value",
+            (ns, key, str(amount), now + ttl if ttl else None, now, amount, now),
+        )
+        self._maybe_purge()
+        return int(rows[0][0])
+
+    def _delete(self, ns: str, key: str) -> None:
+        self._run("DELETE FROM kv WHERE ns = ? AND key = ?", (ns, key))
+
+    async def get(self, ns: str, key: str) -> Optional[str]:
+        return await asyncio.to_thread(self._get, ns, key)
+
+    async def set(
+        self, ns: str, key: str, value: str, ttl: Optional[float] = None
+    ) -> None:
+        await asyncio.to_thread(self._set, ns, key, value, ttl)
+
+    async def add(
+        self, ns: str, key: str, value: str, ttl: Optional[float] = None
+    ) -> bool:
+        return await asyncio.to_thread(self._add, ns, key, value, ttl)
+
+    async def incr(
+        self, ns: str, key: str, amount: int = 1, ttl: Optional[float] = None
+    ) -> int:
+        return await asyncio.to_thread(self._incr, ns, key, amount, ttl)
+
+    async def delete(self, ns: str, key: str) -> None:
+        await asyncio.to_thread(self._delete, ns, key)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def create_state(env: Mapping[str, str]):
+    kind = (env.get("STATE_BACKEND") or "memory").lower()
+    if kind == "sqlite":
+        return SqliteState(
+            env.get("STATE_PATH") or os.path.join("/tmp", "fork-state.db")
+        )
+    if kind != "memory":
+        raise ValueError(f"Unknown STATE_BACKEND '{kind}' (expected memory or sqlite)")
+    return MemoryState()
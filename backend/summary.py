@@ -0,0 +1,160 @@
+"""Rolling conversation memory for sessions longer than the transcript window.
+
+Turns that fall out of the window are condensed into a short running summary
+by a background task, never on the request the user is waiting on. A summary
+is cached per sessionId in the shared state backend together with a hash of
+the transcript prefix it covers, so a reset or edited history simply misses
+the cache instead of leaking stale memory into the prompt.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+from typing import Awaitable, Callable, List, Optional, Sequence, Set
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_RUNS_TOTAL = REGISTRY.counter(
+    "fork_summary_runs_total",
+    "Background summarization runs by outcome.",
+    labels=("outcome",),
+)
+SUMMARY_HITS_TOTAL = REGISTRY.counter(
+    "fork_summary_lookups_total",
+    "Summary cache lookups for sessions past the window.",
+    labels=("result",),
+)
+
+# (previous summary or None, newly aged-out lines) -> updated summary
+Summarize = Callable[[Optional[str], List[str]], Awaitable[str]]
+
+
+def prefix_hash(lines: Sequence[str]) -> str:
+    h = hashlib.sha256()
+    for line in lines:
+        h.update(line.encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+class SummaryRecord:
+    __slots__ = ("covered", "prefix", "text")
+
+    def __init__(self, covered: int, prefix: str, text: str):
+        self.covered = covered
+        self.prefix = prefix
+        self.text = text
+
+    def dumps(self) -> str:
+        return json.dumps(
+            {"covered": self.covered, "prefix": self.prefix, "text": self.text}
+        )
+
+    @classmethod
+    def loads(cls, raw: str) -> "SummaryRecord":
+        data = json.loads(raw)
+        return cls(int(data["covered"]), data["prefix"], data["text"])
+
+
+class ConversationSummarizer:
+    """Summaries live in the shared state backend (namespace ``summary``), so
+    every worker sees them; a short ``summary-lock`` entry keeps two workers
+    from summarizing the same session at once."""
+
+    def __init__(
+        self,
+        summarize: Summarize,
+        state,
+        batch: int = 4,
+        ttl: float = 6 * 3600,
+        max_chars: int = 1200,
+    ):
+        self.summarize = summarize
+        self.state = state
+        self.batch = batch
+        self.ttl = ttl
+        self.max_chars = max_chars
+        self._pending: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def _valid(
+        self, session_id: str, older: Sequence[str]
+    ) -> Optional[SummaryRecord]:
+        raw = await self.state.get("summary", session_id)
+        if raw is None:
+            return None
+        try:
+            rec = SummaryRecord.loads(raw)
+        except (ValueError, KeyError, TypeError):
+            return None
+        if rec.covered > len(older) or prefix_hash(older[: rec.covered]) != rec.prefix:
+            return None
+        return rec
+
+    async def lookup(self, session_id: str, older: Sequence[str]) -> Optional[str]:
+        """Best summary available right now for the aged-out lines."""
+        if not older:
+            return None
+        rec = await self._valid(session_id, older)
+        SUMMARY_HITS_TOTAL.inc(result="hit" if rec else "miss")
+        return rec.text if rec else None
+
+    async def schedule(self, session_id: str, older: Sequence[str]) -> bool:
+        """Kick off a background refresh if enough new lines have aged out."""
+        if not older or session_id in self._pending:
+            return False
+        rec = await self._valid(session_id, older)
+        covered = rec.covered if rec else 0
+        if len(older) - covered < self.batch:
+            return False
+        if not await self.state.add("summary-lock", session_id, "1", ttl=120):
+            return False  # another worker is on it
+
+        self._pending.add(session_id)
+        task = asyncio.get_running_loop().create_task(
+            self._refresh(session_id, list(older), rec)
+        )
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+
+    async def _refresh(
+        self, session_id: str, older: List[str], rec: Optional[SummaryRecord]
+    ) -> None:
+        try:
+            previous = rec.text if rec else None
+            new_lines = older[rec.covered :] if rec else older
+            text = (await self.summarize(previous, new_lines)).strip()
+            if not text:
+                SUMMARY_RUNS_TOTAL.inc(outcome="empty")
+                return
+            if len(text) > self.max_chars:
+                text = text[: self.max_chars - 1] + "…"
+            record = SummaryRecord(len(older), prefix_hash(older), text)
+            await self.state.set("summary", session_id, record.dumps(), ttl=self.ttl)
+            SUMMARY_RUNS_TOTAL.inc(outcome="ok")
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            SUMMARY_RUNS_TOTAL.inc(outcome="error")
+            logger.warning("Background summary failed", exc_info=True)
+        finally:
+            self._pending.discard(session_id)
+            try:
+                await self.state.delete("summary-lock", session_id)
+            except Exception:
+                logger.debug("Could not release summary lock", exc_info=True)
+
+    async def aclose(self, grace: float = 0.0) -> None:
+        """Cancel background refreshes, letting them run up to ``grace`` seconds."""
+        tasks = list(self._tasks)
+        if tasks and grace > 0:
+            _, pending = await asyncio.wait(tasks, timeout=grace)
+            tasks = list(pending)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,98 @@
+"""Opt-in capture of /api/chat traffic *shape* for record-and-replay benchmarks.
+
+Nothing user-written is stored in the clear: each record keeps message roles
+and lengths, intensity, inter-arrival time and upstream timings. With
+``hash_content`` enabled, message text is kept only as a truncated SHA-256 so
+repeated content can be spotted without being readable.
+
+Writes happen on a background thread so the event loop never waits on disk.
+"""
+
+import hashlib
+import json
+import logging
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+CAPTURE_VERSION = 1
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()[:16]
+
+
+class TrafficRecorder:
+    def __init__(self, path: Path, hash_content: bool = False):
+        self.path = Path(path)
+        self.hash_content = hash_content
+        self._last_arrival: Optional[float] = None
+        self._lock = threading.Lock()
+        self._queue: "queue.SimpleQueue[Optional[str]]" = queue.SimpleQueue()
+        self._writer = threading.Thread(
+            target=self._drain, name="traffic-recorder", daemon=True
+        )
+        self._writer.start()
+
+    def shape(
+        self, fork_statement: str, intensity: str, messages: List[Any], session_id: str
+    ) -> Dict[str, Any]:
+        """Sanitized request shape; called when the request arrives."""
+        now = time.time()
+        with self._lock:
+            gap = None if self._last_arrival is None else now - self._last_arrival
+            self._last_arrival = now
+
+        record: Dict[str, Any] = {
+            "v": CAPTURE_VERSION,
+            "ts": now,
+            "interArrivalSeconds": gap,
+            "session": _digest(session_id),
+            "intensity": intensity,
+            "forkLength": len(fork_statement or ""),
+            "messages": [
+                {"role": m.role, "length": len(m.content or "")} for m in messages
+            ],
+        }
+        if self.hash_content:
+            record["forkHash"] = _digest(fork_statement)
+            for entry, m in zip(record["messages"], messages):
+                entry["hash"] = _digest(m.content)
+        return record
+
+    def record(self, record: Dict[str, Any]) -> None:
+        try:
+            self._queue.put(json.dumps(record, separators=(",", ":")))
+        except (TypeError, ValueError):
+            logger.exception("Could not serialize traffic record")
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._writer.join(timeout=2.0)
+
+    def _drain(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.path.open("a", encoding="utf-8") as fh:
+            while True:
+                line = self._queue.get()
+                if line is None:
+                    return
+                fh.write(line + "\n")
+                fh.flush()
+
+
+def load_capture(path: Path) -> List[Dict[str, Any]]:
+    records: List[Dict[str, Any]] = []
+    with Path(path).open(encoding="utf-8") as fh:
+        for line in fh:
+            line = line.strip()
+            if not line:
+                continue
+            rec = json.loads(line)
+            if rec.get("v") == CAPTURE_VERSION:
+                records.append(rec)
+    return records
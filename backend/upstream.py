@@ -0,0 +1,372 @@
+"""Latency-aware routing across several OpenAI-compatible upstreams and API keys.
+
+Every (base URL, API key) pair is a pool entry. Each entry tracks an EWMA of
+latency and error rate plus the provider's rate-limit headers; requests go to
+the healthy entry with the best expected latency. A 429 puts the entry on
+cooldown (honoring ``Retry-After``) and the request fails over once. A 401,
+402 or 403 means a bad or unfunded key: it fails over the same way and benches
+the entry ten times as long.
+"""
+
+import asyncio
+import email.utils
+import logging
+import time
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+from urllib.parse import urlparse
+
+import httpx
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASE_URL = "https://openrouter.ai/api/v1"
+
+UPSTREAM_LATENCY_SECONDS = REGISTRY.histogram(
+    "fork_upstream_latency_seconds",
+    "Upstream chat completion latency per pool entry.",
+    labels=("upstream",),
+    buckets=(0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 8.0, 13.0, 21.0, 45.0),
+)
+UPSTREAM_REQUESTS_TOTAL = REGISTRY.counter(
+    "fork_upstream_requests_total",
+    "Upstream chat completion calls by pool entry and outcome.",
+    labels=("upstream", "status"),
+)
+
+# Key or billing problems: they won't clear up on their own within seconds.
+AUTH_FAILURE_STATUSES = frozenset({401, 402, 403})
+AUTH_COOLDOWN_FACTOR = 10.0
+
+
+def parse_retry_after(
+    value: Optional[str], now: Optional[float] = None
+) -> Optional[float]:
+    """Seconds to wait from a ``Retry-After`` header (delta-seconds or HTTP date)."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        parsed = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, parsed.timestamp() - (now if now is not None else time.time()))
+
+
+def _parse_reset(value: Optional[str], now: float) -> Optional[float]:
+    """``X-RateLimit-Reset`` as a wall-clock timestamp (OpenRouter sends epoch ms)."""
+    if not value:
+        return None
+    try:
+        reset = float(value)
+    except ValueError:
+        return None
+    if reset > 1e12:  # epoch milliseconds
+        return reset / 1000.0
+    if reset > 1e9:  # epoch seconds
+        return reset
+    return now + reset  # relative seconds
+
+
+class UpstreamEntry:
+    def __init__(self, base_url: str, api_key: str, alpha: float = 0.2):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.alpha = alpha
+        host = urlparse(self.base_url).netloc or self.base_url
+        self.name = f"{host}#{api_key[-4:]}" if api_key else host
+
+        self.ewma_latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.ratelimit_remaining: Optional[int] = None
+        self.ratelimit_reset: Optional[float] = None
+        self.cooldown_until = 0.0
+        self.inflight = 0
+        self.requests = 0
+        self.errors = 0
+        self.throttled = 0
+
+    def available(self, now: float) -> bool:
+        if self.cooldown_until > now:
+            return False
+        if self.ratelimit_remaining == 0 and (self.ratelimit_reset or 0) > time.time():
+            return False
+        return True
+
+    def score(self, prior: float = 1.0) -> float:
+        """Expected latency; lower is better. Unmeasured entries assume ``prior``."""
+        latency = self.ewma_latency if self.ewma_latency is not None else prior
+        return latency * (1.0 + 4.0 * self.error_rate) * (1.0 + 0.25 * self.inflight)
+
+    def cool_down(self, seconds: float, now: float) -> None:
+        self.cooldown_until = max(self.cooldown_until, now + seconds)
+
+    def observe(
+        self,
+        status: Optional[int],
+        latency: float,
+        headers: Optional[Mapping[str, str]],
+        now: float,
+        cooldown: float,
+        sample_latency: bool = True,
+    ) -> None:
+        self.requests += 1
+        failed = (
+            status is None
+            or status == 429
+            or status >= 500
+            or status in AUTH_FAILURE_STATUSES
+        )
+        if failed:
+            self.errors += 1
+        self.error_rate += self.alpha * ((1.0 if failed else 0.0) - self.error_rate)
+
+        # Only successful calls say anything about generation latency.
+        if sample_latency and status is not None and status < 400:
+            if self.ewma_latency is None:
+                self.ewma_latency = latency
+            else:
+                self.ewma_latency += self.alpha * (latency - self.ewma_latency)
+
+        if headers is not None:
+            remaining = headers.get("x-ratelimit-remaining")
+            if remaining is not None:
+                try:
+                    self.ratelimit_remaining = int(float(remaining))
+                except ValueError:
+                    pass
+            reset = _parse_reset(headers.get("x-ratelimit-reset"), time.time())
+            if reset is not None:
+                self.ratelimit_reset = reset
+
+        if status == 429:
+            self.throttled += 1
+            retry_after = parse_retry_after((headers or {}).get("retry-after"))
+            self.cool_down(retry_after if retry_after is not None else cooldown, now)
+        elif status in AUTH_FAILURE_STATUSES:
+            self.cool_down(cooldown * AUTH_COOLDOWN_FACTOR, now)
+        elif status is None or status >= 500:
+            # Short penalty box so one flaky entry doesn't soak up traffic.
+            self.cool_down(min(cooldown, 2.0 + 10.0 * self.error_rate), now)
+
+    def dump_stats(self) -> dict:
+        """Learned routing stats worth keeping across a restart."""
+        return {
+            "ewmaLatency": self.ewma_latency,
+            "errorRate": self.error_rate,
+            "rateLimitRemaining": self.ratelimit_remaining,
+            "rateLimitReset": self.ratelimit_reset,
+        }
+
+    def load_stats(self, data: Mapping[str, Any]) -> None:
+        latency = data.get("ewmaLatency")
+        self.ewma_latency = float(latency) if latency is not None else None
+        self.error_rate = min(1.0, max(0.0, float(data.get("errorRate") or 0.0)))
+        remaining = data.get("rateLimitRemaining")
+        self.ratelimit_remaining = int(remaining) if remaining is not None else None
+        reset = data.get("rateLimitReset")
+        # Wall-clock, so a reset that has already passed is simply ignored.
+        self.ratelimit_reset = float(reset) if reset is not None else None
+
+    def snapshot(self, now: float) -> dict:
+        return {
+            "name": self.name,
+            "baseUrl": self.base_url,
+            "healthy": self.available(now),
+            "ewmaLatencySeconds": self.ewma_latency,
+            "errorRate": round(self.error_rate, 4),
+            "rateLimitRemaining": self.ratelimit_remaining,
+            "rateLimitReset": self.ratelimit_reset,
+            "cooldownRemainingSeconds": max(0.0, round(self.cooldown_until - now, 3)),
+            "inflight": self.inflight,
+            "requests": self.requests,
+            "errors": self.errors,
+            "throttled": self.throttled,
+        }
+
+
+class UpstreamPool:
+    def __init__(
+        self,
+        entries: Iterable[UpstreamEntry],
+        timeout: float = 45.0,
+        cooldown: float = 30.0,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.entries: List[UpstreamEntry] = list(entries)
+        self.timeout = timeout
+        self.cooldown = cooldown
+        self.transport = transport
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+
+    @classmethod
+    def from_env(cls, env: Mapping[str, str], **kwargs) -> "UpstreamPool":
+        urls = _split(env.get("OPENROUTER_BASE_URLS")) or [
+            env.get("OPENROUTER_BASE_URL") or DEFAULT_BASE_URL
+        ]
+        keys = _split(env.get("OPENROUTER_API_KEYS")) or _split(
+            env.get("OPENROUTER_API_KEY")
+        )
+        kwargs.setdefault("cooldown", float(env.get("UPSTREAM_COOLDOWN_SECONDS", "30")))
+        return cls((UpstreamEntry(u, k) for u in urls for k in keys), **kwargs)
+
+    @staticmethod
+    def config_signature(env: Mapping[str, str]) -> Tuple[Optional[str], ...]:
+        return tuple(
+            env.get(k)
+            for k in (
+                "OPENROUTER_BASE_URLS",
+                "OPENROUTER_BASE_URL",
+                "OPENROUTER_API_KEYS",
+                "OPENROUTER_API_KEY",
+                "UPSTREAM_COOLDOWN_SECONDS",
+                "UPSTREAM_FAULTS",
+            )
+        )
+
+    def choose(self, exclude: Iterable[UpstreamEntry] = ()) -> Optional[UpstreamEntry]:
+        skip = {id(e) for e in exclude}
+        candidates = [e for e in self.entries if id(e) not in skip]
+        if not candidates:
+            return None
+        now = time.monotonic()
+        healthy = [e for e in candidates if e.available(now)]
+        if healthy:
+            # Unmeasured entries are scored as an average one, so they get
+            # tried without being preferred forever if they never succeed.
+            measured = [
+                e.ewma_latency for e in candidates if e.ewma_latency is not None
+            ]
+            prior = sum(measured) / len(measured) if measured else 1.0
+            return min(healthy, key=lambda e: e.score(prior))
+        # Everyone is cooling down: pick whoever comes back first.
+        return min(candidates, key=lambda e: e.cooldown_until)
+
+    def client_for(self, entry: UpstreamEntry) -> httpx.AsyncClient:
+        client = self._clients.get(entry.base_url)
+        if client is None:
+            client = httpx.AsyncClient(
+                base_url=entry.base_url, timeout=self.timeout, transport=self.transport
+            )
+            self._clients[entry.base_url] = client
+        return client
+
+    async def post_chat(
+        self, payload: dict, sample_latency: bool = True
+    ) -> Tuple[httpx.Response, UpstreamEntry]:
+        """POST a chat completion to the best entry; 429 and 401-403 fail over once.
+
+        Pass ``sample_latency=False`` for side traffic on another model (e.g.
+        summaries) so its timings don't skew routing for chat calls.
+        """
+        tried: List[UpstreamEntry] = []
+        while True:
+            entry = self.choose(exclude=tried)
+            if entry is None:
+                raise RuntimeError("No upstream configured")
+            tried.append(entry)
+            response = await self._post(entry, payload, sample_latency)
+            status = response.status_code
+            if status != 429 and status not in AUTH_FAILURE_STATUSES:
+                return response, entry
+            if len(tried) >= 2 or self.choose(exclude=tried) is None:
+                return response, entry
+            if status == 429:
+                logger.warning("Upstream %s throttled; failing over", entry.name)
+            else:
+                logger.warning(
+                    "Upstream %s rejected the key (%d); failing over",
+                    entry.name,
+                    status,
+                )
+
+    async def _post(
+        self, entry: UpstreamEntry, payload: dict, sample_latency: bool = True
+    ) -> httpx.Response:
+        client = self.client_for(entry)
+        entry.inflight += 1
+        started = time.perf_counter()
+        status: Optional[int] = None
+        headers: Optional[Mapping[str, str]] = None
+        cancelled = False
+        try:
+            response = await client.post(
+                "/chat/completions",
+                headers={
+                    "Authorization": f"Bearer {entry.api_key}",
+                    "Content-Type": "application/json",
+                },
+                json=payload,
+            )
+            status, headers = response.status_code, response.headers
+            return response
+        except asyncio.CancelledError:
+            cancelled = True  # our caller gave up; says nothing about the upstream
+            raise
+        finally:
+            entry.inflight -= 1
+            latency = time.perf_counter() - started
+            if cancelled:
+                UPSTREAM_REQUESTS_TOTAL.inc(upstream=entry.name, status="cancelled")
+            else:
+                entry.observe(
+                    status,
+                    latency,
+                    headers,
+                    time.monotonic(),
+                    self.cooldown,
+                    sample_latency=sample_latency,
+                )
+                UPSTREAM_REQUESTS_TOTAL.inc(
+                    upstream=entry.name, status=str(status) if status else "error"
+                )
+            if sample_latency and status is not None and status < 400:
+                UPSTREAM_LATENCY_SECONDS.observe(latency, upstream=entry.name)
+
+    async def warm(self) -> Dict[str, bool]:
+        """Open a connection to every base URL so the first chat skips DNS and TLS."""
+
+        async def probe(entry: UpstreamEntry) -> Tuple[str, bool]:
+            try:
+                response = await self.client_for(entry).get(
+                    "/models", headers={"Authorization": f"Bearer {entry.api_key}"}
+                )
+            except httpx.HTTPError as e:
+                logger.warning("Warm-up of %s failed: %s", entry.name, e)
+                return entry.name, False
+            return entry.name, response.status_code < 500
+
+        first: Dict[str, UpstreamEntry] = {}
+        for entry in self.entries:
+            first.setdefault(entry.base_url, entry)
+        return dict(await asyncio.gather(*(probe(e) for e in first.values())))
+
+    def dump_stats(self) -> Dict[str, dict]:
+        return {e.name: e.dump_stats() for e in self.entries}
+
+    def load_stats(self, data: Mapping[str, Mapping[str, Any]]) -> int:
+        """Restore stats for entries that still exist; returns how many matched."""
+        restored = 0
+        for entry in self.entries:
+            if entry.name in data:
+                entry.load_stats(data[entry.name])
+                restored += 1
+        return restored
+
+    def snapshot(self) -> List[dict]:
+        now = time.monotonic()
+        return [e.snapshot(now) for e in self.entries]
+
+    async def aclose(self) -> None:
+        clients, self._clients = self._clients, {}
+        for client in clients.values():
+            await client.aclose()
+
+
+def _split(value: Optional[str]) -> List[str]:
+    return [v.strip() for v in (value or "").split(",") if v.strip()]
@@ -3,6 +3,7 @@ import axios from "axios";
 import { Pill } from "./Pill";
 import { MessageBubble } from "./MessageBubble";
 import { INTENSITY, uuidv4, truncate } from "../utils/constants";
+import { encodeJsonBody } from "../utils/compress";
 
 const API = `${process.env.REACT_APP_BACKEND_URL}/api`;
 
@@ -16,6 +17,11 @@ export const ChatWindow = ({ forkStatement, intensity, sessionId }) => {
   const [error, setError] = useState("");
 
   const listRef = useRef(null);
+  // Aborting closes the connection, which cancels the upstream completion
+  // on the server (e.g. when the timeline is burned mid-reply).
+  const inflightRef = useRef(null);
+
+  useEffect(() => () => inflightRef.current?.abort(), []);
 
   const serverMessages = useMemo(() => {
     return messages.map((m) => ({
@@ -51,12 +57,18 @@ export const ChatWindow = ({ forkStatement, intensity, sessionId }) => {
     setLoading(true);
 
     try {
-      const res = await axios.post(`${API}/chat`, {
+      const { data, headers } = await encodeJsonBody({
         forkStatement,
         intensity,
         sessionId,
         messages: [...serverMessages, { role: "user", content: text }],
       });
+      const controller = new AbortController();
+      inflightRef.current = controller;
+      const res = await axios.post(`${API}/chat`, data, {
+        headers,
+        signal: controller.signal,
+      });
 
       const reply = res?.data?.reply;
       if (!reply) throw new Error("Empty reply");
@@ -70,10 +82,12 @@ export const ChatWindow = ({ forkStatement, intensity, sessionId }) => {
 
       setMessages((prev) => [...prev, alterMsg]);
     } catch (e) {
+      if (axios.isCancel(e)) return;
       setError(
         "The other door jammed. Try again in a second (or burn it and restart)."
       );
     } finally {
+      inflightRef.current = null;
       setLoading(false);
     }
   };
@@ -0,0 +1,36 @@
+/**
+ * Request-body compression for the chat API.
+ *
+ * Long sessions resend the whole transcript every turn, so bodies above the
+ * threshold are gzipped with the browser's CompressionStream. Browsers
+ * without it fall back to plain JSON.
+ */
+export const COMPRESS_MIN_BYTES = 1024;
+
+const canCompress = () =>
+  typeof window !== "undefined" &&
+  typeof window.CompressionStream === "function" &&
+  typeof window.Response === "function";
+
+/**
+ * Encode a JSON payload, gzipping it when that is worthwhile.
+ * Returns { data, headers } ready to hand to axios.
+ */
+export async function encodeJsonBody(payload) {
+  const json = JSON.stringify(payload);
+  const headers = { "Content-Type": "application/json" };
+
+  if (json.length < COMPRESS_MIN_BYTES || !canCompress()) {
+    return { data: json, headers };
+  }
+
+  try {
+    const stream = new Blob([json])
+      .stream()
+      .pipeThrough(new window.CompressionStream("gzip"));
+    const data = await new window.Response(stream).arrayBuffer();
+    return { data, headers: { ...headers, "Content-Encoding": "gzip" } };
+  } catch (e) {
+    return { data: json, headers };
+  }
+}
@@ -0,0 +1,119 @@
+"""Benchmark harness for hot-path pure functions.
+
+Each case is timed as best-of-N batches and normalized against a fixed
+calibration workload, so the stored baseline is comparable across machines.
+Peak allocation per call is measured with tracemalloc. A case fails when it
+exceeds its baseline by more than the configured tolerance.
+
+Wall-clock gates are flaky on a loaded machine, so the default pytest run
+deselects them; run them on their own, on a quiet machine:
+
+    python -m pytest tests/benchmarks -m benchmark
+
+    BENCH_TIME_TOLERANCE=2.0    # allowed slowdown factor (normalized time)
+    BENCH_ALLOC_TOLERANCE=1.5   # allowed growth factor for peak allocation
+    BENCH_UPDATE_BASELINE=1     # rewrite baseline.json from this run
+"""
+
+import json
+import os
+import time
+import tracemalloc
+from pathlib import Path
+
+import pytest
+
+BASELINE_PATH = Path(__file__).parent / "baseline.json"
+TIME_TOLERANCE = float(os.environ.get("BENCH_TIME_TOLERANCE", "2.0"))
+ALLOC_TOLERANCE = float(os.environ.get("BENCH_ALLOC_TOLERANCE", "1.5"))
+UPDATE = os.environ.get("BENCH_UPDATE_BASELINE") == "1"
+# Allocation noise floor: tiny peaks vary with interpreter internals.
+ALLOC_SLACK_BYTES = 2048
+
+
+def _calibration_workload():
+    total = 0
+    for i in range(20000):
+        total += i * i % 7
+    return "-".join(str(i) for i in range(500))
+
+
+def _best_per_call(fn, number: int, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+def _autorange(fn, budget: float = 0.02) -> int:
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        if time.perf_counter() - start >= budget or number >= 100_000:
+            return number
+        number *= 4
+
+
+def _peak_alloc(fn) -> int:
+    fn()  # warm caches so one-time allocations don't count
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return max(0, peak - base)
+
+
+@pytest.fixture(scope="session")
+def calibration():
+    return _best_per_call(_calibration_workload, number=20, repeat=5)
+
+
+@pytest.fixture(scope="session")
+def baseline_store():
+    data = json.loads(BASELINE_PATH.read_text()) if BASELINE_PATH.exists() else {}
+    results = {}
+    yield data, results
+    if UPDATE and results:
+        merged = dict(data)
+        merged.update(results)
+        BASELINE_PATH.write_text(json.dumps(merged, indent=2, sort_keys=True) + "\n")
+
+
+@pytest.fixture
+def bench(request, calibration, baseline_store):
+    data, results = baseline_store
+
+    def run(fn, name=None):
+        name = name or request.node.name
+        number = _autorange(fn)
+        per_call = _best_per_call(fn, number=number, repeat=5)
+        relative = per_call / calibration
+        peak = _peak_alloc(fn)
+        results[name] = {"relative": float(f"{relative:.4g}"), "peak_bytes": peak}
+
+        if UPDATE:
+            return per_call
+        expected = data.get(name)
+        if expected is None:
+            pytest.skip(f"no baseline for {name}; run with BENCH_UPDATE_BASELINE=1")
+
+        assert relative <= expected["relative"] * TIME_TOLERANCE, (
+            f"{name}: {per_call * 1e6:.1f}us/call is {relative / expected['relative']:.2f}x "
+            f"the baseline (tolerance {TIME_TOLERANCE}x)"
+        )
+        assert peak <= expected["peak_bytes"] * ALLOC_TOLERANCE + ALLOC_SLACK_BYTES, (
+            f"{name}: peak allocation {peak} B vs baseline {expected['peak_bytes']} B "
+            f"(tolerance {ALLOC_TOLERANCE}x)"
+        )
+        return per_call
+
+    return run
@@ -0,0 +1,60 @@
+"""
+Micro-benchmarks for streaming output moderation
+"""
+import pytest
+
+from moderation import Automaton, OutputModerator
+from server import _OUTPUT_MODERATION_PHRASES, _OUTPUT_REPLACEMENTS, output_automaton
+
+pytestmark = pytest.mark.benchmark
+
+# Streaming must not add visible latency: every chunk has to clear this.
+CHUNK_BUDGET_SECONDS = 0.001
+
+REPLY = (
+    "Look, you didn't stay in Dayton because of the shop. You stayed because "
+    "leaving meant finding out whether you were any good without your dad's name "
+    "on the sign. I went. Some nights I'd kill for that certainty you have — "
+    "but don't you dare pretend it was a sacrifice. What are you avoiding now? "
+)
+UNICODE_REPLY = "Ñoño 🏍️ café — naïve résumé 東京 Привет مرحبا 😤🔥 " * 8
+LONG_REPLY = REPLY * 50
+
+
+def _chunks(text, size):
+    return [text[i : i + size] for i in range(0, len(text), size)]
+
+
+def _stream(chunks):
+    moderator = OutputModerator(output_automaton, _OUTPUT_REPLACEMENTS)
+    for chunk in chunks:
+        moderator.feed(chunk)
+    return moderator.finish()
+
+
+class TestOutputModerationBench:
+    @pytest.mark.parametrize("size", [4, 32, 256])
+    def test_moderate_chunk(self, bench, size):
+        chunk = REPLY[:size]
+        moderator = OutputModerator(output_automaton, _OUTPUT_REPLACEMENTS)
+        per_chunk = bench(lambda: moderator.feed(chunk))
+        assert moderator.tripped is None
+        assert per_chunk < CHUNK_BUDGET_SECONDS
+
+    def test_moderate_reply_streamed(self, bench):
+        chunks = _chunks(REPLY, 16)
+        per_reply = bench(lambda: _stream(chunks))
+        assert per_reply / len(chunks) < CHUNK_BUDGET_SECONDS
+
+    def test_moderate_long_reply(self, bench):
+        chunks = _chunks(LONG_REPLY, 64)
+        per_reply = bench(lambda: _stream(chunks))
+        assert per_reply / len(chunks) < CHUNK_BUDGET_SECONDS
+
+    def test_moderate_unicode(self, bench):
+        chunks = _chunks(UNICODE_REPLY, 16)
+        per_reply = bench(lambda: _stream(chunks))
+        assert per_reply / len(chunks) < CHUNK_BUDGET_SECONDS
+
+    def test_build_automaton(self, bench):
+        bench(lambda: Automaton(_OUTPUT_MODERATION_PHRASES))
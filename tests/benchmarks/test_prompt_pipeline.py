@@ -0,0 +1,113 @@
+"""
+Micro-benchmarks for the prompt pipeline hot path
+"""
+import pytest
+
+from server import (
+    ChatMessage,
+    _build_openrouter_messages,
+    _build_system_message,
+    _derive_style_directives,
+    _intensity_style,
+    _safety_quick_check,
+    _transcript_lines,
+    _truncate,
+)
+
+pytestmark = pytest.mark.benchmark
+
+REALISTIC = (
+    "ok so here's the thing, I stayed in Dayton, took over the shop, married Jess.\n"
+    "Do you ever regret leaving? be honest"
+)
+UNICODE = "Ñoño 🏍️ café — naïve résumé 東京 Привет مرحبا 😤🔥 " * 40
+HUGE = ("I keep circling back to the same night and I can't stop. " * 20000).strip()
+FORK = "I chose to move to the city instead of staying in my hometown to run the shop"
+
+
+def _conversation(n, text=REALISTIC):
+    return [
+        ChatMessage(role="user" if i % 2 == 0 else "assistant", content=text)
+        for i in range(n)
+    ]
+
+
+REALISTIC_18 = _conversation(18)
+SHORT_5000 = _conversation(5000, "k")
+HUGE_LAST = _conversation(17) + [ChatMessage(role="user", content=HUGE)]
+UNICODE_18 = _conversation(18, UNICODE)
+
+
+class TestTruncateBench:
+    def test_truncate_realistic(self, bench):
+        bench(lambda: _truncate(FORK, 180))
+
+    def test_truncate_huge(self, bench):
+        bench(lambda: _truncate(HUGE, 180))
+
+    def test_truncate_unicode(self, bench):
+        bench(lambda: _truncate(UNICODE, 180))
+
+
+class TestIntensityStyleBench:
+    @pytest.mark.parametrize("intensity", ["mild", "savage", "brutal"])
+    def test_intensity_style(self, bench, intensity):
+        bench(lambda: _intensity_style(intensity))
+
+
+class TestSafetyBench:
+    def test_safety_realistic(self, bench):
+        bench(lambda: _safety_quick_check(REALISTIC))
+
+    def test_safety_huge(self, bench):
+        bench(lambda: _safety_quick_check(HUGE))
+
+    def test_safety_unicode(self, bench):
+        bench(lambda: _safety_quick_check(UNICODE))
+
+
+class TestStyleDirectivesBench:
+    def test_directives_realistic(self, bench):
+        bench(lambda: _derive_style_directives(REALISTIC_18, "savage"))
+
+    def test_directives_huge_message(self, bench):
+        bench(lambda: _derive_style_directives(HUGE_LAST, "brutal"))
+
+    def test_directives_many_short(self, bench):
+        bench(lambda: _derive_style_directives(SHORT_5000, "mild"))
+
+    def test_directives_unicode(self, bench):
+        bench(lambda: _derive_style_directives(UNICODE_18, "mild"))
+
+
+class TestSystemMessageBench:
+    def test_system_message_realistic(self, bench):
+        bench(lambda: _build_system_message(FORK, "savage"))
+
+    def test_system_message_huge_fork(self, bench):
+        bench(lambda: _build_system_message(HUGE, "brutal"))
+
+
+class TestOpenRouterMessagesBench:
+    def test_messages_window(self, bench):
+        lines = _transcript_lines(REALISTIC_18)
+        directives = _derive_style_directives(REALISTIC_18, "savage")
+        bench(lambda: _build_openrouter_messages("system", lines, directives))
+
+    def test_messages_window_cache_control(self, bench):
+        system = _build_system_message(FORK, "savage")
+        lines = _transcript_lines(REALISTIC_18)
+        directives = _derive_style_directives(REALISTIC_18, "savage")
+        bench(
+            lambda: _build_openrouter_messages(
+                system, lines, directives, cache_control=True
+            )
+        )
+
+    def test_messages_many_short(self, bench):
+        lines = _transcript_lines(SHORT_5000)
+        bench(lambda: _build_openrouter_messages("system", lines))
+
+    def test_messages_unicode(self, bench):
+        lines = _transcript_lines(UNICODE_18)
+        bench(lambda: _build_openrouter_messages("system", lines))
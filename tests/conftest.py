@@ -4,6 +4,7 @@ so this module intentionally avoids any sys.path mutation.
 
 """
 
+import httpx
 import pytest
 from fastapi.testclient import TestClient
 from server import app
@@ -24,4 +25,47 @@ def valid_fork_request():
         "intensity": "mild",
         "messages": [],
         "sessionId": "test-session-123",
-    }
\ No newline at end of file
+    }
+
+def _fake_completion(request):
+    return httpx.Response(
+        200,
+        json={
+            "choices": [{"message": {"content": "Still thinking about that bus."}}],
+            "usage": {
+                "prompt_tokens": 900,
+                "completion_tokens": 12,
+                "prompt_tokens_details": {"cached_tokens": 640},
+            },
+        },
+    )
+
+
+@pytest.fixture
+def faulty_upstream(monkeypatch):
+
+    """Route /chat to an in-process upstream behind a fault injector.
+
+    Call the returned function with FaultSpec fields; it returns the pool.
+    """
+
+    import server
+    from faults import FaultInjectingTransport, FaultSpec
+    from limiter import AdaptiveLimiter
+    from state import MemoryState
+    from upstream import UpstreamEntry, UpstreamPool
+
+    monkeypatch.setattr(server, "upstream_limiter", AdaptiveLimiter(initial=8))
+    monkeypatch.setattr(server, "shared_state", MemoryState())
+
+    def install(**spec):
+        transport = FaultInjectingTransport(
+            httpx.MockTransport(_fake_completion), FaultSpec(**spec)
+        )
+        pool = UpstreamPool(
+            [UpstreamEntry("http://upstream.test/v1", "sk-test")], transport=transport
+        )
+        monkeypatch.setattr(server, "_get_upstream_pool", lambda: pool)
+        return pool
+
+    return install
@@ -80,6 +80,56 @@ class TestChatEndpoint:
         response = client.post("/api/chat", json=request)
         assert response.status_code in [200, 500]
 
+    def test_chat_rejected_when_limiter_saturated(
+        self, client, valid_fork_request, monkeypatch
+    ):
+        """A full upstream limiter should answer 503 with Retry-After"""
+        import server
+        from limiter import AdaptiveLimiter
+
+        limiter = AdaptiveLimiter(initial=2, min_limit=2, max_queue=0)
+        limiter.inflight = 2
+        monkeypatch.setattr(server, "upstream_limiter", limiter)
+        monkeypatch.setenv("OPENROUTER_API_KEY", "sk-test")
+        response = client.post("/api/chat", json=valid_fork_request)
+        assert response.status_code == 503
+        assert "retry-after" in response.headers
+
+    def test_idempotency_key_replays_reply(self, client, monkeypatch):
+        """A retry with the same Idempotency-Key returns the stored reply"""
+        import server
+        from state import MemoryState
+
+        monkeypatch.setattr(server, "shared_state", MemoryState())
+        request = {
+            "forkStatement": "I chose engineering",
+            "intensity": "mild",
+            "messages": [{"role": "user", "content": "I want to kill myself"}],
+            "sessionId": "idem-session",
+        }
+        headers = {"Idempotency-Key": "turn-1"}
+        first = client.post("/api/chat", json=request, headers=headers)
+        monkeypatch.setattr(server, "_generate_reply", None)  # must not be called
+        second = client.post("/api/chat", json=request, headers=headers)
+        assert first.status_code == second.status_code == 200
+        assert first.json() == second.json()
+
+    def test_session_rate_limit(self, client, monkeypatch):
+        """Messages over the per-session limit get 429"""
+        import server
+        from state import MemoryState
+
+        monkeypatch.setattr(server, "shared_state", MemoryState())
+        monkeypatch.setattr(server, "SESSION_RATE_LIMIT_PER_MINUTE", 2)
+        request = {
+            "forkStatement": "I chose engineering",
+            "intensity": "mild",
+            "messages": [{"role": "user", "content": "I want to kill myself"}],
+            "sessionId": "rate-session",
+        }
+        codes = [client.post("/api/chat", json=request).status_code for _ in range(3)]
+        assert codes == [200, 200, 429]
+
     def test_chat_self_harm_trigger(self, client):
         """Self-harm messages should trigger safety response"""
         request = {
@@ -114,6 +164,325 @@ class TestChatEndpoint:
         assert "No" in data["reply"]
 
 
+class TestUpstreamFaults:
+    """Tests for /api/chat against injected upstream faults"""
+
+    def test_healthy_upstream(self, client, valid_fork_request, faulty_upstream):
+        """Without faults the reply comes from the upstream"""
+        faulty_upstream()
+        response = client.post("/api/chat", json=valid_fork_request)
+        assert response.status_code == 200
+        assert response.json()["reply"] == "Still thinking about that bus."
+
+    def test_cached_tokens_exported(
+        self, client, valid_fork_request, faulty_upstream, monkeypatch
+    ):
+        """Provider-reported cached prompt tokens are exported per model"""
+        import server
+
+        monkeypatch.setenv("OPENROUTER_MODEL", "test/cache-model")
+        faulty_upstream()
+        assert client.post("/api/chat", json=valid_fork_request).status_code == 200
+        counter = server.PROMPT_TOKENS_TOTAL
+        assert counter.value(model="test/cache-model", cache="hit") == 640
+        assert counter.value(model="test/cache-model", cache="miss") == 260
+
+    @pytest.mark.parametrize(
+        "spec",
+        [
+            {"status_rates": {429: 1.0}, "retry_after": 1},
+            {"status_rates": {503: 1.0}},
+            {"reset_rate": 1.0},
+            {"timeout_rate": 1.0},
+            {"truncate_rate": 1.0},
+            {"malformed_rate": 1.0},
+        ],
+    )
+    def test_fault_becomes_clean_500(
+        self, client, valid_fork_request, faulty_upstream, spec
+    ):
+        """Every upstream failure mode maps to a JSON 500, never a crash"""
+        pool = faulty_upstream(**spec)
+        response = client.post("/api/chat", json=valid_fork_request)
+        assert response.status_code == 500
+        assert "detail" in response.json()
+        assert pool.entries[0].inflight == 0
+
+    def test_errors_shrink_concurrency_limit(
+        self, client, valid_fork_request, faulty_upstream
+    ):
+        """Upstream 503s should cut the adaptive limit"""
+        import server
+
+        faulty_upstream(status_rates={503: 1.0})
+        before = server.upstream_limiter.limit
+        client.post("/api/chat", json=valid_fork_request)
+        assert server.upstream_limiter.limit < before
+
+    def test_injected_latency_is_visible(
+        self, client, valid_fork_request, faulty_upstream
+    ):
+        """Added latency should show up end to end"""
+        import time
+
+        faulty_upstream(latency_ms=60)
+        start = time.perf_counter()
+        response = client.post("/api/chat", json=valid_fork_request)
+        assert response.status_code == 200
+        assert time.perf_counter() - start >= 0.055
+
+
+class TestOverloadDegradation:
+    """Tests for /api/chat under forced overload levels"""
+
+    def _force(self, monkeypatch, level):
+        import server
+        from overload import OverloadController
+
+        thresholds = [0.0] * level + [1e9] * (4 - level)
+        controller = OverloadController(
+            thresholds=thresholds, window=2, max_tokens=64, fallback_model="fast/model"
+        )
+        monkeypatch.setattr(server, "overload", controller)
+        return controller
+
+    def _history(self):
+        return [
+            {"role": "user" if i % 2 == 0 else "assistant", "content": f"line {i}"}
+            for i in range(9)
+        ]
+
+    def test_fallback_level_shrinks_request(
+        self, client, valid_fork_request, faulty_upstream, monkeypatch
+    ):
+        """Level 3 sends a shorter window, fewer tokens and the fallback model"""
+        import server
+
+        faulty_upstream()
+        sent = {}
+        real_call = server._call_upstream
+
+        async def spy(pool, body):
+            sent.update(body)
+            return await real_call(pool, body)
+
+        monkeypatch.setattr(server, "_call_upstream", spy)
+        self._force(monkeypatch, 3)
+        request = dict(valid_fork_request, messages=self._history())
+        response = client.post("/api/chat", json=request)
+        assert response.status_code == 200
+        assert sent["model"] == "fast/model"
+        assert sent["max_tokens"] == 64
+        # system + 2 transcript messages + final instruction
+        assert len(sent["messages"]) == 4
+
+    def test_short_window_still_schedules_summaries(
+        self, client, valid_fork_request, faulty_upstream, monkeypatch
+    ):
+        """Level 1 keeps summarizing, over the normal window's older turns"""
+        import server
+
+        faulty_upstream()
+        self._force(monkeypatch, 1)
+        scheduled = []
+
+        async def schedule(session_id, older):
+            scheduled.append(len(older))
+            return False
+
+        monkeypatch.setattr(server, "SUMMARY_ENABLED", True)
+        monkeypatch.setattr(server.conversation_summarizer, "schedule", schedule)
+        history = [
+            {"role": "user" if i % 2 == 0 else "assistant", "content": f"line {i}"}
+            for i in range(server.TRANSCRIPT_WINDOW + 5)
+        ]
+        request = dict(valid_fork_request, messages=history)
+        assert client.post("/api/chat", json=request).status_code == 200
+        assert scheduled == [5]
+
+    def test_canned_level_skips_upstream(
+        self, client, valid_fork_request, faulty_upstream, monkeypatch
+    ):
+        """Level 4 answers in character without calling the upstream"""
+        import server
+
+        pool = faulty_upstream(reset_rate=1.0)
+        self._force(monkeypatch, 4)
+        response = client.post("/api/chat", json=valid_fork_request)
+        assert response.status_code == 200
+        assert response.json()["reply"] in server._CANNED_BUSY_REPLIES
+        assert pool.entries[0].requests == 0
+
+    def test_overload_in_upstream_stats(self, client, monkeypatch, debug_auth):
+        """GET /upstreams shows the overload level and signals"""
+        controller = self._force(monkeypatch, 2)
+        controller.update({"queue": 0.0})
+        overload = client.get("/api/upstreams", headers=debug_auth).json()["overload"]
+        assert overload["name"] == "short_reply"
+        assert set(overload["signals"]) == {"queue"}
+
+
+class TestOutputModeration:
+    """Tests for moderation of model replies on /api/chat"""
+
+    def test_flagged_reply_is_replaced(
+        self, client, valid_fork_request, faulty_upstream, monkeypatch
+    ):
+        """A reply containing a flagged phrase never reaches the client"""
+        import server
+        from moderation import OUTPUT_MODERATED_TOTAL, Automaton
+
+        monkeypatch.setattr(
+            server, "output_automaton", Automaton({"self_harm": ["that bus"]})
+        )
+        faulty_upstream()
+        before = OUTPUT_MODERATED_TOTAL.value(category="self_harm")
+        response = client.post("/api/chat", json=valid_fork_request)
+        assert response.status_code == 200
+        reply = response.json()["reply"]
+        assert "bus" not in reply
+        assert reply == server._OUTPUT_REPLACEMENTS["self_harm"]
+        assert OUTPUT_MODERATED_TOTAL.value(category="self_harm") == before + 1
+
+    def test_disabled(self, client, valid_fork_request, faulty_upstream, monkeypatch):
+        """OUTPUT_MODERATION=0 passes replies through untouched"""
+        import server
+        from moderation import Automaton
+
+        monkeypatch.setattr(
+            server, "output_automaton", Automaton({"self_harm": ["that bus"]})
+        )
+        monkeypatch.setattr(server, "OUTPUT_MODERATION_ENABLED", False)
+        faulty_upstream()
+        response = client.post("/api/chat", json=valid_fork_request)
+        assert response.json()["reply"] == "Still thinking about that bus."
+
+
+class TestCompression:
+    """Tests for compressed request and response bodies"""
+
+    def test_gzip_request_body(self, client):
+        """A gzipped chat body should be accepted"""
+        import gzip
+        import json
+
+        body = {
+            "forkStatement": "I chose engineering",
+            "intensity": "mild",
+            "messages": [{"role": "user", "content": "I want to kill myself"}],
+            "sessionId": "test-session",
+        }
+        response = client.post(
+            "/api/chat",
+            content=gzip.compress(json.dumps(body).encode()),
+            headers={"Content-Type": "application/json", "Content-Encoding": "gzip"},
+        )
+        assert response.status_code == 200
+        assert "988" in response.json()["reply"]
+
+    def test_corrupt_body_rejected(self, client):
+        """A body that isn't valid gzip should get 400"""
+        response = client.post(
+            "/api/chat",
+            content=b"not gzip at all",
+            headers={"Content-Type": "application/json", "Content-Encoding": "gzip"},
+        )
+        assert response.status_code == 400
+
+    def test_unknown_encoding_rejected(self, client):
+        """Unsupported encodings should get 415"""
+        response = client.post(
+            "/api/chat",
+            content=b"{}",
+            headers={"Content-Type": "application/json", "Content-Encoding": "zstd"},
+        )
+        assert response.status_code == 415
+
+    def test_openapi_is_compressed(self, client):
+        """Large responses should be gzipped when the client accepts it"""
+        response = client.get("/api/openapi.json", headers={"Accept-Encoding": "gzip"})
+        assert response.status_code == 200
+        assert response.headers.get("content-encoding") == "gzip"
+
+
+class TestBatchEndpoint:
+    """Tests for the /api/chat/batch endpoint"""
+
+    def _items(self):
+        return [
+            {
+                "forkStatement": "I chose engineering",
+                "intensity": "mild",
+                "messages": [{"role": "user", "content": "I want to kill myself"}],
+                "sessionId": f"batch-{i}",
+            }
+            for i in range(3)
+        ] + [
+            {
+                "forkStatement": "",
+                "intensity": "mild",
+                "messages": [],
+                "sessionId": "batch-bad",
+            }
+        ]
+
+    def test_disabled_without_token(self, client, monkeypatch):
+        """Without BATCH_API_TOKEN the endpoint is off"""
+        import server
+
+        monkeypatch.setattr(server, "BATCH_API_TOKEN", "")
+        response = client.post("/api/chat/batch", json={"items": self._items()})
+        assert response.status_code == 403
+
+    def test_wrong_token_rejected(self, client, monkeypatch):
+        """A wrong bearer token should get 401"""
+        import server
+
+        monkeypatch.setattr(server, "BATCH_API_TOKEN", "secret")
+        response = client.post(
+            "/api/chat/batch",
+            json={"items": self._items()},
+            headers={"Authorization": "Bearer nope"},
+        )
+        assert response.status_code == 401
+
+    def test_streams_ndjson_results(self, client, monkeypatch):
+        """Each item gets one NDJSON line, errors included, then a summary"""
+        import json
+
+        import server
+
+        monkeypatch.setattr(server, "BATCH_API_TOKEN", "secret")
+        response = client.post(
+            "/api/chat/batch",
+            json={"items": self._items(), "concurrency": 2},
+            headers={"Authorization": "Bearer secret"},
+        )
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        results, summary = lines[:-1], lines[-1]
+        assert sorted(r["index"] for r in results) == [0, 1, 2, 3]
+        assert all("latencySeconds" in r for r in results)
+        bad = next(r for r in results if r["index"] == 3)
+        assert bad["ok"] is False and bad["status"] == 400
+        assert all("988" in r["reply"] for r in results if r["index"] != 3)
+        assert summary["done"] is True
+        assert summary["count"] == 4 and summary["errors"] == 1
+
+    def test_empty_batch_rejected(self, client, monkeypatch):
+        """An empty item list fails validation"""
+        import server
+
+        monkeypatch.setattr(server, "BATCH_API_TOKEN", "secret")
+        response = client.post(
+            "/api/chat/batch",
+            json={"items": []},
+            headers={"Authorization": "Bearer secret"},
+        )
+        assert response.status_code == 422
+
+
 @pytest.fixture
 def mock_status_db(monkeypatch):
     """Mock MongoDB status collection to avoid external DB dependency."""
@@ -162,3 +531,207 @@ class TestStatusEndpoint:
         assert data["client_name"] == "test-client"
         assert "id" in data
         assert "timestamp" in data
+
+
+class TestObservabilityEndpoints:
+    """Tests for the metrics and loop-health endpoints"""
+
+    def test_metrics_endpoint(self, client):
+        """GET /metrics should return Prometheus text"""
+        response = client.get("/api/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        assert "fork_event_loop_lag_seconds" in response.text
+
+    def test_debug_loop_endpoint(self, client, debug_auth):
+        """GET /debug/loop should report monitor state"""
+        response = client.get("/api/debug/loop", headers=debug_auth)
+        assert response.status_code == 200
+        assert "recentBlocks" in response.json()
+
+    @pytest.mark.parametrize("path", ["/api/debug/loop", "/api/upstreams"])
+    def test_debug_endpoints_off_by_default(self, client, monkeypatch, path):
+        """Without DEBUG_API_TOKEN stacks and upstream details stay private"""
+        import server
+
+        monkeypatch.setattr(server, "DEBUG_API_TOKEN", "")
+        assert client.get(path).status_code == 403
+
+    @pytest.mark.parametrize("path", ["/api/debug/loop", "/api/upstreams"])
+    def test_debug_endpoints_reject_wrong_token(self, client, debug_auth, path):
+        """A wrong bearer token should get 401"""
+        assert client.get(path).status_code == 401
+        response = client.get(path, headers={"Authorization": "Bearer nope"})
+        assert response.status_code == 401
+
+    def test_upstreams_endpoint(self, client, monkeypatch, debug_auth):
+        """GET /upstreams should list one entry per base URL and key"""
+        monkeypatch.setenv("OPENROUTER_BASE_URLS", "https://a.example/v1,https://b.example/v1")
+        monkeypatch.setenv("OPENROUTER_API_KEYS", "key-aaaa")
+        response = client.get("/api/upstreams", headers=debug_auth)
+        assert response.status_code == 200
+        names = [u["name"] for u in response.json()["upstreams"]]
+        assert names == ["a.example#aaaa", "b.example#aaaa"]
+
+
+@pytest.fixture
+def debug_auth(monkeypatch):
+    """Enable the debug endpoints and return the matching auth header"""
+    import server
+
+    monkeypatch.setattr(server, "DEBUG_API_TOKEN", "debug-secret")
+    return {"Authorization": "Bearer debug-secret"}
+
+
+@pytest.fixture
+def fresh_lifecycle(monkeypatch):
+    """Isolate readiness state and resources closed by the lifespan"""
+    import server
+    from lifecycle import Lifecycle
+
+    class _Mongo:
+        def close(self):
+            pass
+
+    lifecycle = Lifecycle()
+    monkeypatch.setattr(server, "lifecycle", lifecycle)
+    monkeypatch.setattr(server, "client", _Mongo())
+    monkeypatch.setattr(server, "SHUTDOWN_GRACE_SECONDS", 0.5)
+    monkeypatch.setenv("LOOP_MONITOR_ENABLED", "0")
+    return lifecycle
+
+
+class TestLifecycleEndpoints:
+    """Tests for liveness, readiness and drain"""
+
+    def test_healthz(self, client):
+        """Liveness answers without any warm-up"""
+        response = client.get("/api/healthz")
+        assert response.status_code == 200
+        assert response.json() == {"status": "ok"}
+
+    def test_not_ready_before_startup(self, client, fresh_lifecycle):
+        """Readiness fails until the lifespan warm-up has run"""
+        response = client.get("/api/readyz")
+        assert response.status_code == 503
+        assert response.json()["ready"] is False
+
+    def test_ready_after_warm_up(self, fresh_lifecycle, faulty_upstream):
+        """Readiness reports the warmed upstreams once start-up finishes"""
+        import time
+
+        from fastapi.testclient import TestClient
+        from server import app
+
+        faulty_upstream()
+        with TestClient(app) as c:
+            for _ in range(100):
+                response = c.get("/api/readyz")
+                if response.status_code == 200:
+                    break
+                time.sleep(0.01)
+            assert response.status_code == 200
+            assert response.json()["checks"]["upstreams"] == {"upstream.test#test": True}
+        assert fresh_lifecycle.draining
+
+    def test_snapshot_survives_restart(
+        self, fresh_lifecycle, faulty_upstream, tmp_path, monkeypatch
+    ):
+        """Shutdown writes a snapshot and the next start-up restores learned stats"""
+        import server
+        from fastapi.testclient import TestClient
+        from limiter import AdaptiveLimiter
+        from snapshot import Snapshotter
+
+        path = str(tmp_path / "snapshot.bin")
+
+        def install_snapshotter():
+            store = Snapshotter(path, interval=0)
+            server._register_snapshot_sections(store)
+            monkeypatch.setattr(server, "snapshotter", store)
+            return store
+
+        install_snapshotter()
+        pool = faulty_upstream()
+        pool.entries[0].ewma_latency = 0.42
+        server.upstream_limiter.limit = 30.0
+        with TestClient(server.app):
+            pass
+
+        # A new process: cold pool and limiter, same snapshot file.
+        store = install_snapshotter()
+        monkeypatch.setattr(server, "upstream_limiter", AdaptiveLimiter(initial=8))
+        pool = faulty_upstream()
+        with TestClient(server.app):
+            assert store.status == "loaded"
+            assert pool.entries[0].ewma_latency == 0.42
+            assert server.upstream_limiter.limit == 30.0
+
+    def test_shutdown_budget_counts_from_sigterm(
+        self, fresh_lifecycle, faulty_upstream, tmp_path, monkeypatch
+    ):
+        """Grace spent before the lifespan exits is not granted again; snapshot first"""
+        import server
+        from fastapi.testclient import TestClient
+        from snapshot import Snapshotter
+
+        calls = []
+        store = Snapshotter(str(tmp_path / "snapshot.bin"), interval=0)
+        original_save = store.save
+
+        async def save():
+            calls.append("snapshot")
+            return await original_save()
+
+        async def aclose(grace):
+            calls.append(("summaries", grace))
+
+        store.save = save
+        monkeypatch.setattr(server, "snapshotter", store)
+        monkeypatch.setattr(server.conversation_summarizer, "aclose", aclose)
+        faulty_upstream()
+        with TestClient(server.app):
+            # SIGTERM arrived and uvicorn's graceful wait used up the budget.
+            fresh_lifecycle.begin_drain()
+            fresh_lifecycle.drain_started -= server.SHUTDOWN_GRACE_SECONDS
+        assert calls == ["snapshot", ("summaries", 0.0)]
+
+    def test_draining_rejects_chats(self, client, valid_fork_request, fresh_lifecycle):
+        """While draining, new chats get 503 with Retry-After"""
+        fresh_lifecycle.begin_drain()
+        response = client.post("/api/chat", json=valid_fork_request)
+        assert response.status_code == 503
+        assert response.headers["retry-after"] == "1"
+        assert client.get("/api/readyz").status_code == 503
+
+
+class TestChatCancellation:
+    """Tests for superseding stale turns"""
+
+    def test_newer_turn_supersedes_older(
+        self, valid_fork_request, faulty_upstream, fresh_lifecycle, monkeypatch
+    ):
+        """A second message for the same session cancels the first with 409"""
+        import threading
+        import time
+
+        from fastapi.testclient import TestClient
+
+        import server
+        from server import app
+
+        monkeypatch.setattr(server, "CHAT_SUPERSEDE_POLL_SECONDS", 0.02)
+        faulty_upstream(latency_ms=300)
+        results = {}
+        with TestClient(app) as c:
+
+            def send(name):
+                results[name] = c.post("/api/chat", json=valid_fork_request)
+
+            first = threading.Thread(target=send, args=("first",))
+            first.start()
+            time.sleep(0.1)
+            send("second")
+            first.join()
+        assert results["first"].status_code == 409
+        assert results["second"].status_code == 200
@@ -0,0 +1,36 @@
+"""
+Unit tests for compressed request bodies
+"""
+import gzip
+import zlib
+
+import pytest
+
+from compression import BodyTooLarge, decompress
+
+
+class TestDecompress:
+    """Tests for bounded body decompression"""
+
+    def test_gzip_roundtrip(self):
+        """gzip bodies should inflate to the original bytes"""
+        body = b'{"messages": []}' * 50
+        assert decompress(gzip.compress(body), "gzip", 1 << 20) == body
+
+    def test_deflate_roundtrip(self):
+        """zlib-wrapped deflate bodies should inflate too"""
+        body = b"x" * 1000
+        assert decompress(zlib.compress(body), "deflate", 1 << 20) == body
+
+    def test_zip_bomb_rejected(self):
+        """Output beyond the limit should stop inflation"""
+        bomb = gzip.compress(b"\0" * (8 << 20))
+        assert len(bomb) < 20_000
+        with pytest.raises(BodyTooLarge):
+            decompress(bomb, "gzip", 1 << 20)
+
+    def test_truncated_stream_rejected(self):
+        """A cut-off stream should be an error, not a partial body"""
+        packed = gzip.compress(b"hello world" * 100)
+        with pytest.raises(zlib.error):
+            decompress(packed[: len(packed) // 2], "gzip", 1 << 20)
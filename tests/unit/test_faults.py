@@ -0,0 +1,132 @@
+"""
+Unit tests for the upstream fault-injection transport
+"""
+
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+from pydantic import ValidationError
+
+from faults import FaultInjectingTransport, FaultSpec, transport_from_env
+
+
+def _ok(request):
+    return httpx.Response(200, json={"choices": [{"message": {"content": "hi"}}]})
+
+
+def _post(**spec):
+    transport = FaultInjectingTransport(httpx.MockTransport(_ok), FaultSpec(**spec))
+
+    async def go():
+        async with httpx.AsyncClient(
+            base_url="http://upstream.test", transport=transport
+        ) as client:
+            return await client.post("/chat/completions", json={})
+
+    return asyncio.run(go())
+
+
+class TestFaultSpec:
+    """Tests for fault spec parsing"""
+
+    def test_disabled_without_env(self):
+        """No UPSTREAM_FAULTS means no transport"""
+        assert transport_from_env({}) is None
+
+    @pytest.mark.parametrize("raw", ["{latency_ms: 5", "[1, 2]", '{"reset_rate": 2}'])
+    def test_invalid_env_disables_injection(self, raw, caplog):
+        """A bad spec is logged once and ignored instead of raising per request"""
+        assert transport_from_env({"UPSTREAM_FAULTS": raw}) is None
+        assert "Ignoring invalid UPSTREAM_FAULTS" in caplog.text
+
+    def test_from_env_json(self):
+        """Status keys arrive as strings in JSON and become ints"""
+        spec = FaultSpec.from_env(
+            {"UPSTREAM_FAULTS": json.dumps({"status_rates": {"429": 0.25}})}
+        )
+        assert spec.status_rates == {429: 0.25}
+
+    def test_rates_over_one_rejected(self):
+        """Rates that cannot all happen are a config error"""
+        with pytest.raises(ValidationError):
+            FaultSpec(reset_rate=0.6, status_rates={503: 0.6})
+
+    def test_non_error_status_rejected(self):
+        """Only 4xx/5xx can be injected"""
+        with pytest.raises(ValidationError):
+            FaultSpec(status_rates={200: 0.1})
+
+
+class TestFaultInjectingTransport:
+    """Tests for each injected fault kind"""
+
+    def test_passthrough(self):
+        """With no faults the inner transport answers"""
+        assert _post().json()["choices"][0]["message"]["content"] == "hi"
+
+    def test_status_with_retry_after(self):
+        """An injected 429 carries the configured Retry-After"""
+        response = _post(status_rates={429: 1.0}, retry_after=3)
+        assert response.status_code == 429
+        assert response.headers["retry-after"] == "3.0"
+
+    def test_reset(self):
+        """A reset surfaces as a connect error"""
+        with pytest.raises(httpx.ConnectError):
+            _post(reset_rate=1.0)
+
+    def test_timeout(self):
+        """A timeout surfaces as httpx.ReadTimeout"""
+        with pytest.raises(httpx.ReadTimeout):
+            _post(timeout_rate=1.0)
+
+    def test_truncated_body(self):
+        """A truncated body drops the connection mid-read"""
+        with pytest.raises(httpx.RemoteProtocolError):
+            _post(truncate_rate=1.0)
+
+    def test_malformed_json(self):
+        """Malformed bodies come back as 200 that fail to parse"""
+        response = _post(malformed_rate=1.0)
+        assert response.status_code == 200
+        with pytest.raises(ValueError):
+            response.json()
+
+    def test_fixed_latency(self):
+        """Fixed latency delays every call"""
+        start = time.perf_counter()
+        _post(latency_ms=50)
+        assert time.perf_counter() - start >= 0.045
+
+    def test_seeded_draws_repeat(self):
+        """The same seed gives the same fault sequence and latencies"""
+        spec = FaultSpec(
+            status_rates={503: 0.3},
+            reset_rate=0.2,
+            latency_ms=100,
+            latency_distribution="lognormal",
+            seed=11,
+        )
+        a = FaultInjectingTransport(httpx.MockTransport(_ok), spec)
+        b = FaultInjectingTransport(httpx.MockTransport(_ok), spec)
+        seq_a = [(a.delay(), a.pick()) for _ in range(50)]
+        seq_b = [(b.delay(), b.pick()) for _ in range(50)]
+        assert seq_a == seq_b
+        kinds = {k for _, k in seq_a}
+        assert {"503", "reset", None} <= kinds
+
+    def test_uniform_latency_bounds(self):
+        """Uniform latency stays within ± jitter"""
+        t = FaultInjectingTransport(
+            httpx.MockTransport(_ok),
+            FaultSpec(
+                latency_ms=100,
+                latency_distribution="uniform",
+                latency_jitter_ms=20,
+                seed=1,
+            ),
+        )
+        assert all(0.08 <= t.delay() <= 0.12 for _ in range(200))
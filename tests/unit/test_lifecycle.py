@@ -0,0 +1,153 @@
+"""
+Unit tests for readiness and graceful drain
+"""
+
+import asyncio
+import os
+import signal
+import time
+
+import pytest
+
+from lifecycle import Draining, Lifecycle, chain_server_exit
+
+
+class TestLifecycle:
+    """Tests for readiness and in-flight tracking"""
+
+    def test_not_ready_until_marked(self):
+        """A fresh instance is live but not ready"""
+        lc = Lifecycle()
+        assert not lc.is_ready()
+        lc.mark_ready(upstreams={"a": True})
+        assert lc.is_ready()
+        assert lc.snapshot()["checks"]["upstreams"] == {"a": True}
+
+    def test_track_counts_inflight(self):
+        """track() counts a chat while it runs"""
+        lc = Lifecycle()
+        with lc.track():
+            assert lc.inflight == 1
+        assert lc.inflight == 0
+
+    def test_draining_refuses_new_work(self):
+        """Once draining, readiness fails and new chats are refused"""
+        lc = Lifecycle()
+        lc.mark_ready()
+        lc.begin_drain()
+        assert not lc.is_ready()
+        with pytest.raises(Draining):
+            with lc.track():
+                pass
+
+    def test_drain_waits_for_inflight(self):
+        """drain() returns once in-flight work finishes"""
+        lc = Lifecycle()
+
+        async def go():
+            async def chat():
+                with lc.track():
+                    await asyncio.sleep(0.05)
+
+            task = asyncio.create_task(chat())
+            await asyncio.sleep(0)
+            finished = await lc.drain(grace=1.0, poll=0.01)
+            await task
+            return finished
+
+        assert asyncio.run(go()) is True
+
+    def test_drain_gives_up_after_grace(self):
+        """drain() reports work still running after the grace period"""
+        lc = Lifecycle()
+
+        async def go():
+            with lc.track():
+                return await lc.drain(grace=0.02, poll=0.01)
+
+        assert asyncio.run(go()) is False
+
+    def test_grace_counts_from_drain_start(self):
+        """Time already spent draining comes out of the grace period"""
+        lc = Lifecycle()
+        assert lc.remaining_grace(5.0) == 5.0
+        lc.begin_drain()
+        lc.drain_started -= 4.0
+        assert 0.9 < lc.remaining_grace(5.0) <= 1.0
+        lc.begin_drain()  # a second call doesn't restart the clock
+        assert lc.remaining_grace(5.0) <= 1.0
+
+        # drain() only waits for what is left of the budget.
+
+        lc = Lifecycle()
+
+        async def go():
+            with lc.track():
+                lc.begin_drain()
+                lc.drain_started -= 5.0
+                return await lc.drain(grace=5.0, poll=0.01)
+
+        started = time.monotonic()
+        assert asyncio.run(go()) is False
+        assert time.monotonic() - started < 0.5
+
+
+class TestChainServerExit:
+    """Tests for hooking uvicorn's exit handler"""
+
+    def test_sigterm_flips_drain_before_server_exit(self, monkeypatch):
+        """SIGTERM marks the lifecycle draining and still stops the server"""
+        import uvicorn
+        from uvicorn.server import Server
+
+        # Start from the unwrapped handler so hooks don't leak between tests.
+        original = getattr(Server.handle_exit, "__wrapped__", Server.handle_exit)
+        monkeypatch.setattr(Server, "handle_exit", original)
+        lc = Lifecycle()
+        lc.mark_ready()
+        seen = []
+
+        def drain():
+            seen.append(server.should_exit)
+            lc.begin_drain()
+
+        assert chain_server_exit(drain)
+        server = uvicorn.Server(uvicorn.Config(app=None))
+
+        async def go():
+            loop = asyncio.get_running_loop()
+            server.install_signal_handlers()
+            try:
+                os.kill(os.getpid(), signal.SIGTERM)
+                for _ in range(50):
+                    if server.should_exit:
+                        break
+                    await asyncio.sleep(0.01)
+            finally:
+                for sig in (signal.SIGINT, signal.SIGTERM):
+                    loop.remove_signal_handler(sig)
+
+        asyncio.run(go())
+        assert lc.draining and not lc.is_ready()
+        assert server.should_exit
+        assert seen == [False]
+
+    def test_hooks_accumulate(self, monkeypatch):
+        """Chaining twice wraps once and runs both hooks"""
+        from uvicorn.server import Server
+
+        # Start from the unwrapped handler so hooks don't leak between tests.
+        original = getattr(Server.handle_exit, "__wrapped__", Server.handle_exit)
+        monkeypatch.setattr(Server, "handle_exit", original)
+        calls = []
+        chain_server_exit(lambda: calls.append("a"))
+        wrapped = Server.handle_exit
+        chain_server_exit(lambda: calls.append("b"))
+        assert Server.handle_exit is wrapped
+
+        class _Server:
+            should_exit = False
+            force_exit = False
+
+        Server.handle_exit(_Server(), signal.SIGTERM, None)
+        assert calls == ["a", "b"]
@@ -0,0 +1,82 @@
+"""
+Unit tests for the adaptive upstream concurrency limiter
+"""
+import asyncio
+
+import pytest
+
+from limiter import AdaptiveLimiter, LimitExceeded
+
+
+class TestAdaptiveLimiter:
+    """Tests for AIMD behavior and admission control"""
+
+    def test_grows_while_latency_is_flat(self):
+        """Flat latency with the limit in use should raise the limit"""
+        lim = AdaptiveLimiter(initial=4, max_limit=64)
+        lim.inflight = 4
+        for _ in range(40):
+            lim.on_result(200, 1.0)
+        assert lim.limit > 4
+
+    def test_stats_round_trip(self):
+        """A restored limiter starts from the learned limit, clamped to its bounds"""
+        lim = AdaptiveLimiter(initial=40)
+        lim.on_result(200, 0.8)
+        fresh = AdaptiveLimiter(initial=4, max_limit=32)
+        fresh.load_stats(lim.dump_stats())
+        assert fresh.limit == 32
+        assert fresh.baseline_latency == pytest.approx(0.8)
+
+    def test_cuts_on_429_and_honors_retry_after(self):
+        """A 429 should cut the limit and pause admissions"""
+        lim = AdaptiveLimiter(initial=20)
+        lim.on_result(429, 0.5, retry_after=5)
+        assert lim.limit == pytest.approx(14)
+        assert lim.snapshot()["blockedForSeconds"] > 4
+
+    def test_cuts_on_latency_inflation(self):
+        """Latency far above baseline should cut the limit"""
+        lim = AdaptiveLimiter(initial=20, latency_tolerance=2.0)
+        lim.on_result(200, 1.0)
+        for _ in range(5):
+            lim.on_result(200, 6.0)
+        assert lim.limit < 20
+
+    def test_client_errors_are_not_latency_samples(self):
+        """A fast 4xx must not become the baseline and cut the limit"""
+        lim = AdaptiveLimiter(initial=16, latency_tolerance=2.0)
+        lim.inflight = 16
+        lim.on_result(200, 3.0)
+        lim.on_result(400, 0.05)
+        for _ in range(5):
+            lim.on_result(200, 3.0)
+        assert lim.baseline_latency == pytest.approx(3.0)
+        assert lim.limit >= 16
+
+    def test_burst_of_errors_is_one_cut(self):
+        """Errors from the same moment should only cut once"""
+        lim = AdaptiveLimiter(initial=20)
+        for _ in range(10):
+            lim.on_result(503, 0.1)
+        assert lim.limit == pytest.approx(14)
+
+    def test_queues_then_rejects(self):
+        """Callers over the limit should wait, then be rejected on timeout"""
+
+        async def scenario():
+            lim = AdaptiveLimiter(initial=2, min_limit=2, queue_timeout=0.05)
+            await lim.acquire()
+            await lim.acquire()
+            waiter = asyncio.create_task(lim.acquire())
+            await asyncio.sleep(0)
+            assert lim.queued == 1
+            lim.release()
+            await waiter
+            assert lim.inflight == 2
+            with pytest.raises(LimitExceeded) as exc:
+                await lim.acquire()
+            return exc.value
+
+        err = asyncio.run(scenario())
+        assert err.reason == "timeout"
@@ -0,0 +1,79 @@
+"""
+Unit tests for the event-loop lag monitor and metrics registry
+"""
+
+import asyncio
+import time
+
+from loop_monitor import LoopMonitor
+from metrics import Registry
+
+
+def _hog_the_loop():
+    time.sleep(0.3)
+
+
+class TestLoopMonitor:
+    """Tests for blocking-call detection"""
+
+    def test_detects_blocking_callback_with_stack(self):
+        """A synchronous sleep on the loop should be captured with its stack"""
+
+        async def scenario():
+            monitor = LoopMonitor(interval=0.01, block_threshold=0.1)
+            monitor.start()
+            try:
+                await asyncio.sleep(0.05)
+                _hog_the_loop()
+                await asyncio.sleep(0.05)
+            finally:
+                monitor.stop()
+            return monitor
+
+        monitor = asyncio.run(scenario())
+        assert len(monitor.events) == 1
+        event = monitor.events[0]
+        assert event.duration is not None and event.duration >= 0.1
+        assert any("_hog_the_loop" in line for line in event.stack)
+
+    def test_idle_loop_records_lag_without_blocks(self):
+        """An idle loop should produce lag samples but no blocking events"""
+
+        async def scenario():
+            monitor = LoopMonitor(interval=0.01, block_threshold=0.2)
+            monitor.start()
+            await asyncio.sleep(0.1)
+            snap = monitor.snapshot()
+            monitor.stop()
+            return monitor, snap
+
+        monitor, snap = asyncio.run(scenario())
+        assert snap["running"] is True
+        assert snap["lagP50Seconds"] is not None
+        assert len(monitor.events) == 0
+
+
+class TestMetricsRegistry:
+    """Tests for the Prometheus text rendering"""
+
+    def test_histogram_render(self):
+        """Histogram buckets should be cumulative and include +Inf"""
+        reg = Registry()
+        h = reg.histogram("x_seconds", "help", buckets=(0.1, 1.0))
+        h.observe(0.05)
+        h.observe(0.5)
+        h.observe(5.0)
+        text = reg.render()
+        assert 'x_seconds_bucket{le="0.1"} 1' in text
+        assert 'x_seconds_bucket{le="1"} 2' in text
+        assert 'x_seconds_bucket{le="+Inf"} 3' in text
+        assert "x_seconds_count 3" in text
+
+    def test_labelled_counter(self):
+        """Counters should keep separate series per label value"""
+        reg = Registry()
+        c = reg.counter("y_total", "help", labels=("status",))
+        c.inc(status="429")
+        c.inc(2, status="500")
+        assert c.value(status="429") == 1
+        assert 'y_total{status="500"} 2' in reg.render()
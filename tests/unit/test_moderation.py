@@ -0,0 +1,156 @@
+"""
+Unit tests for incremental output moderation
+"""
+
+import pytest
+
+from moderation import Automaton, OutputModerator
+
+PHRASES = {
+    "self_harm": ["kill yourself", "end your life"],
+    "hate": ["gas the", "subhuman"],
+}
+REPLACEMENTS = {"self_harm": "[care]", "hate": "[no]"}
+
+
+@pytest.fixture(scope="module")
+def automaton():
+    return Automaton(PHRASES)
+
+
+def _stream(automaton, chunks, replacements=REPLACEMENTS):
+    moderator = OutputModerator(automaton, replacements)
+    out = [moderator.feed(chunk) for chunk in chunks]
+    out.append(moderator.finish())
+    return out, moderator.tripped
+
+
+class TestAutomaton:
+    """Tests for phrase matching"""
+
+    @pytest.mark.parametrize(
+        "text, category",
+        [
+            ("Just KILL   yourself already", "self_harm"),
+            ("—kill\nyourself", "self_harm"),
+            ("they call them Subhuman", "hate"),
+            ("skill yourself up", None),
+            ("kill yourse", None),
+            ("you did not end your lifelong habit", None),
+            ("Filled up on gas then rode", None),
+            ("kill yourself.", "self_harm"),
+            ("gas the", "hate"),
+            ("", None),
+        ],
+    )
+    def test_search(self, automaton, text, category):
+        """Matches are case-, spacing- and punctuation-insensitive whole words"""
+        assert automaton.search(text) == category
+
+    def test_overlapping_phrases(self):
+        """A phrase that is a suffix of a partial match is still found"""
+        a = Automaton({"x": ["x ab cd ef", "cd"]})
+        assert a.search("x ab cd zz") == "x"
+        assert a.search("x ab acd") is None
+
+    def test_longer_phrase_still_matches_after_prefix_phrase(self):
+        """A phrase followed by more letters may still be a longer phrase"""
+        a = Automaton({"short": ["go die"], "long": ["go dies now"]})
+        assert a.search("go diesel") is None
+        assert a.search("it go dies now") == "long"
+
+    def test_curly_apostrophes_fold(self):
+        """Typographic apostrophes match straight ones"""
+        a = Automaton({"x": ["you're worthless"]})
+        assert a.search("honestly you’re worthless") == "x"
+
+
+class TestOutputModerator:
+    """Tests for chunked scanning"""
+
+    def test_clean_reply_passes_through(self, automaton):
+        """Clean text comes out unchanged, split the same way it went in"""
+        chunks = ["You stayed, ", "and the shop ", "kept you small."]
+        out, tripped = _stream(automaton, chunks)
+        assert "".join(out) == "".join(chunks)
+        assert tripped is None
+
+    def test_phrase_split_across_chunks(self, automaton):
+        """State carries over chunk boundaries and the phrase is never released"""
+        out, tripped = _stream(
+            automaton, ["Honestly, ki", "ll you", "rself and move on"]
+        )
+        assert tripped == "self_harm"
+        assert "".join(out) == "Honestly, [care]"
+        assert "ki" not in "".join(out)
+
+    def test_separator_after_released_text(self, automaton):
+        """The replacement is spaced from text sent in an earlier chunk"""
+        out, tripped = _stream(automaton, ["Honestly just", " kill yourself", "."])
+        assert tripped == "self_harm"
+        assert out[0] == "Honestly just"
+        assert "".join(out) == "Honestly just [care]"
+
+    def test_no_separator_at_start_of_reply(self, automaton):
+        """A reply that opens with a phrase is just the replacement"""
+        out, _ = _stream(automaton, ["Kill yourself", "."])
+        assert "".join(out) == "[care]"
+
+    def test_only_partial_match_is_held(self, automaton):
+        """Text that can't start a phrase is released immediately"""
+        moderator = OutputModerator(automaton, REPLACEMENTS)
+        assert moderator.feed("The kill") == "The"
+        assert moderator.feed(" switch") == " kill switch"
+        assert moderator.finish() == ""
+
+    def test_held_tail_flushed_on_finish(self, automaton):
+        """A reply ending mid-prefix is released by finish()"""
+        out, tripped = _stream(automaton, ["you could end your"])
+        assert out == ["you could", " end your"]
+        assert tripped is None
+
+    def test_completed_phrase_waits_for_boundary(self, automaton):
+        """A phrase at the end of a chunk is held until the next character"""
+        moderator = OutputModerator(automaton, REPLACEMENTS)
+        assert moderator.feed("out of gas the") == "out of"
+        assert moderator.feed("n home") == " gas then home"
+        assert moderator.tripped is None
+
+    def test_phrase_at_end_of_reply_trips_on_finish(self, automaton):
+        """The end of the reply counts as a word boundary"""
+        moderator = OutputModerator(automaton, REPLACEMENTS)
+        assert moderator.feed("Fine, gas the") == "Fine"
+        assert moderator.finish() == ", [no]"
+        assert moderator.tripped == "hate"
+
+    def test_nothing_after_trip(self, automaton):
+        """Once tripped the rest of the stream is dropped"""
+        moderator = OutputModerator(automaton, REPLACEMENTS)
+        assert moderator.feed("gas the ") == "[no]"
+        assert moderator.feed(" rest") == ""
+        assert moderator.finish() == ""
+
+    def test_no_replacement_cuts_off(self, automaton):
+        """Without a replacement the reply just stops before the phrase"""
+        out, tripped = _stream(automaton, ["fine. kill yourself"], replacements={})
+        assert "".join(out) == "fine. "
+        assert tripped == "self_harm"
+
+
+class TestServerPhrases:
+    """The server's phrase list against ordinary persona text"""
+
+    @pytest.mark.parametrize(
+        "text",
+        [
+            "I ran out of gas the night I left Tulsa",
+            "Filled up on gas then rode",
+            "Don't let you go diesel on me",
+            "You'd be better off deadlifting",
+        ],
+    )
+    def test_no_false_positives(self, text):
+        """Whole-word matching keeps road-trip talk clean"""
+        from server import output_automaton
+
+        assert output_automaton.search(text) is None
@@ -0,0 +1,124 @@
+"""
+Unit tests for the overload controller
+"""
+
+import pytest
+
+from overload import LEVELS, OverloadController
+
+
+def _controller(**kwargs):
+    return OverloadController(cool_down=5.0, **kwargs)
+
+
+class TestMeasure:
+    """Tests for signal normalization"""
+
+    def test_idle_is_zero(self):
+        """No queue, no lag, no latency samples means no pressure"""
+        c = _controller()
+        assert c.measure(0, 16, 0.0, None, None) == {
+            "queue": 0.0,
+            "loop": 0.0,
+            "latency": 0.0,
+        }
+
+    def test_saturation_is_one(self):
+        """Each signal reads 1.0 at its saturation point"""
+        c = _controller(lag_target=0.1, latency_tolerance=2.0)
+        signals = c.measure(16, 16, 0.1, 4.0, 2.0)
+        assert signals == pytest.approx({"queue": 1.0, "loop": 1.0, "latency": 1.0})
+
+
+    def test_stale_latency_is_ignored(self):
+        """A latency reading older than the cool-down says nothing about now"""
+        c = _controller()
+        assert c.measure(0, 16, 0.0, 8.0, 2.0, latency_age=1.0)["latency"] > 1
+        assert c.measure(0, 16, 0.0, 8.0, 2.0, latency_age=60.0)["latency"] == 0.0
+
+    def test_ordinary_variance_is_not_overload(self):
+        """Uniform 2-6s latencies with no load stay at the normal level"""
+        import random
+
+        from limiter import AdaptiveLimiter
+
+        rng = random.Random(7)
+        lim = AdaptiveLimiter(initial=16)
+        c = _controller()
+        for i in range(500):
+            lim.on_result(200, rng.uniform(2.0, 6.0))
+            signals = c.measure(0, 16, 0.0, lim.recent_latency, lim.typical_latency)
+            c.update(signals, now=float(i))
+            if i > 20:
+                assert signals["latency"] < c.thresholds[0]
+        assert c.level == 0
+
+
+class TestLevels:
+    """Tests for stepping through degradation levels"""
+
+    def test_steps_up_immediately(self):
+        """Crossing thresholds raises the level at once"""
+        c = _controller()
+        assert c.update({"queue": 0.6}, now=0.0) == 1
+        assert c.update({"queue": 2.5}, now=0.1) == 3
+        assert c.update({"queue": 9.0}, now=0.2) == 4
+
+    def test_steps_down_one_at_a_time_after_cool_down(self):
+        """Recovery is gradual so the level doesn't flap"""
+        c = _controller()
+        c.update({"queue": 9.0}, now=0.0)
+        assert c.update({"queue": 0.0}, now=1.0) == 4
+        assert c.update({"queue": 0.0}, now=6.5) == 3
+        assert c.update({"queue": 0.0}, now=7.0) == 3
+        assert c.update({"queue": 0.0}, now=12.0) == 2
+
+    def test_long_quiet_period_drops_several_levels(self):
+        """The first request after a quiet spell isn't served at the old level"""
+        c = _controller()
+        c.update({"queue": 9.0}, now=0.0)
+        assert c.update({"queue": 0.0}, now=60.0) == 0
+
+    def test_latency_alone_stops_at_fallback(self):
+        """Slow upstreams never trigger canned replies by themselves"""
+        c = _controller()
+        assert c.update({"latency": 50.0, "queue": 0.0}, now=0.0) == 3
+        assert c.update({"latency": 50.0, "queue": 5.0}, now=0.1) == 4
+
+    def test_degradation_steps_are_cumulative(self):
+        """Each level keeps the previous steps"""
+        c = _controller(window=6, max_tokens=120, fallback_model="fast/model")
+        assert c.degradation(0).window is None
+        short = c.degradation(1)
+        assert (short.window, short.max_tokens) == (6, None)
+        fallback = c.degradation(3)
+        assert (fallback.window, fallback.max_tokens, fallback.model) == (
+            6,
+            120,
+            "fast/model",
+        )
+        assert not fallback.canned and c.degradation(4).canned
+        assert [c.degradation(i).name for i in range(5)] == list(LEVELS)
+
+
+class TestFromEnv:
+    """Tests for environment configuration"""
+
+    def test_overrides(self):
+        """Env vars override the defaults"""
+        c = OverloadController.from_env(
+            {
+                "OVERLOAD_THRESHOLDS": "1,2,3,4",
+                "OVERLOAD_WINDOW": "4",
+                "OVERLOAD_LAG_TARGET_MS": "50",
+                "OVERLOAD_FALLBACK_MODEL": "fast/model",
+            }
+        )
+        assert c.thresholds == (1.0, 2.0, 3.0, 4.0)
+        assert c.window == 4 and c.lag_target == 0.05
+        assert c.fallback_model == "fast/model"
+
+    def test_bad_thresholds(self):
+        """Thresholds must be four ascending numbers"""
+        with pytest.raises(ValueError):
+            OverloadController(thresholds=(2.0, 1.0, 3.0, 4.0))
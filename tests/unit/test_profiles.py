@@ -0,0 +1,57 @@
+"""
+Unit tests for generation profiles
+"""
+import json
+import os
+
+from profiles import ProfileStore, ProfileTable
+
+
+class TestProfileTable:
+    """Tests for profile selection"""
+
+    def test_builtin_profiles_are_tighter_for_harsh_intensities(self):
+        """Savage/brutal should get smaller budgets than mild"""
+        store = ProfileStore()
+        mild = store.select("mild", 5)
+        brutal = store.select("brutal", 5)
+        assert brutal.max_tokens < mild.max_tokens
+        assert "\nYou:" in brutal.stop
+
+    def test_turn_ranges(self):
+        """The opener profile applies only to early turns"""
+        store = ProfileStore()
+        assert store.select("savage", 1).name == "savage-open"
+        assert store.select("savage", 2).name == "savage"
+
+    def test_defaults_merge_and_request_fields(self):
+        """Entries inherit from default; model falls back to the env model"""
+        table = ProfileTable.from_config(
+            {
+                "default": {"max_tokens": 300, "temperature": 0.5},
+                "brutal": {"model": "fast/model", "max_tokens": 120},
+            }
+        )
+        brutal = table.select("brutal", 0).request_fields("env/model")
+        mild = table.select("mild", 0).request_fields("env/model")
+        assert brutal == {"model": "fast/model", "temperature": 0.5, "max_tokens": 120}
+        assert mild["model"] == "env/model" and mild["max_tokens"] == 300
+
+
+class TestProfileStore:
+    """Tests for hot reloading from disk"""
+
+    def test_reload_on_change_and_ignore_invalid(self, tmp_path):
+        """A changed file swaps the table; an invalid one keeps the old table"""
+        path = tmp_path / "profiles.json"
+        path.write_text(json.dumps({"mild": {"max_tokens": 111}}))
+        store = ProfileStore(str(path), check_interval=0)
+        assert store.select("mild", 0).max_tokens == 111
+
+        path.write_text(json.dumps({"mild": {"max_tokens": 222}}))
+        os.utime(path, (1, 1))
+        assert store.select("mild", 0).max_tokens == 222
+
+        path.write_text(json.dumps({"mild": {"max_tokens": -5}}))
+        os.utime(path, (2, 2))
+        assert store.select("mild", 0).max_tokens == 222
@@ -9,6 +9,13 @@ from server import (
     _safety_quick_check,
     _derive_style_directives,
     _build_system_message,
+    _build_openrouter_messages,
+    _record_usage,
+    _supports_cache_control,
+    _transcript_lines,
+    COMPLETION_TOKENS_TOTAL,
+    PROMPT_TOKENS_TOTAL,
+    _PERSONA_PROMPT,
 )
 
 
@@ -131,17 +138,17 @@ class TestBuildSystemMessage:
     def test_system_message_contains_fork(self):
         """System message should include fork statement"""
         fork = "I chose law instead of medicine."
-        result = _build_system_message(fork, "mild", "")
+        result = _build_system_message(fork, "mild")
         assert fork in result
 
     def test_system_message_contains_tone(self):
         """System message should include intensity tone"""
-        result = _build_system_message("Some fork", "brutal", "")
+        result = _build_system_message("Some fork", "brutal")
         assert "BRUTAL" in result
 
     def test_system_message_character_contract(self):
         """System message should include character contract"""
-        result = _build_system_message("Some fork", "mild", "")
+        result = _build_system_message("Some fork", "mild")
         assert "Other You" in result
         assert "first-person" in result.lower()
         assert "never say you are an ai" in result.lower()  # Prompt should explicitly block identity leakage
@@ -149,7 +156,193 @@ class TestBuildSystemMessage:
     def test_system_message_truncates_long_fork(self):
         """Long fork statements should be truncated"""
         long_fork = "a" * 300
-        result = _build_system_message(long_fork, "mild", "")
+        result = _build_system_message(long_fork, "mild")
         # Should contain the fork but truncated
         assert "a" * 150 in result
         assert "a" * 300 not in result
+
+
+class TestPromptCacheLayout:
+    """Tests for the cache-friendly upstream message layout"""
+
+    def _turn(self, history, directives="\n- Short."):
+        system = _build_system_message("I stayed in Ohio.", "savage")
+        return _build_openrouter_messages(
+            system, _transcript_lines(history), directives
+        )
+
+    def test_persona_prefix_is_identical(self):
+        """Every fork and intensity starts with the same persona bytes"""
+        a = _build_system_message("I chose law.", "mild")
+        b = _build_system_message("I chose the sea.", "brutal", memory="Dana.")
+        assert a.startswith(_PERSONA_PROMPT) and b.startswith(_PERSONA_PROMPT)
+
+    def test_directives_go_last(self):
+        """Per-turn directives live in the final message, not the system prompt"""
+        history = [ChatMessage(role="user", content="hey")]
+        messages = self._turn(history, "\n- Avoid commas.")
+        assert "Avoid commas" not in messages[0]["content"]
+        assert messages[-1]["role"] == "user"
+        assert messages[-1]["content"].endswith("- Avoid commas.")
+
+    def test_next_turn_extends_previous_prefix(self):
+        """A later turn repeats the earlier turn's messages before its new lines"""
+        history = [
+            ChatMessage(role="user", content="hey"),
+            ChatMessage(role="assistant", content="well look who it is"),
+            ChatMessage(role="user", content="yeah yeah"),
+        ]
+        first = self._turn(history[:1], "\n- Short.")
+        second = self._turn(history, "\n- Different.")
+        assert second[: len(first) - 1] == first[:-1]
+
+    def test_cache_control_breakpoints(self):
+        """With cache_control the persona is split out and breakpoints are set"""
+        system = _build_system_message("I stayed.", "mild")
+        lines = ["You: hey", "Other You: sup"]
+        messages = _build_openrouter_messages(system, lines, "", cache_control=True)
+        persona, session = messages[0]["content"]
+        assert persona["text"] == _PERSONA_PROMPT and "cache_control" not in persona
+        assert session["cache_control"] == {"type": "ephemeral"}
+        assert persona["text"] + session["text"] == system
+        assert messages[2]["content"][0]["cache_control"] == {"type": "ephemeral"}
+        assert isinstance(messages[-1]["content"], str)
+
+    def test_plain_strings_without_cache_control(self):
+        """Providers that cache automatically get plain string content"""
+        messages = self._turn([ChatMessage(role="user", content="hey")])
+        assert all(isinstance(m["content"], str) for m in messages)
+
+    def test_supports_cache_control(self, monkeypatch):
+        """Only providers that take explicit breakpoints get them"""
+        assert _supports_cache_control("anthropic/claude-3.5-sonnet")
+        assert _supports_cache_control("google/gemini-2.0-flash-001")
+        assert not _supports_cache_control("openai/gpt-4o-mini")
+        monkeypatch.setenv("PROMPT_CACHE_CONTROL", "0")
+        assert not _supports_cache_control("anthropic/claude-3.5-sonnet")
+
+    def test_record_usage_splits_cached_tokens(self):
+        """Cached prompt tokens are exported separately"""
+        model = "test/usage-model"
+        cached = _record_usage(
+            model,
+            {
+                "prompt_tokens": 1000,
+                "completion_tokens": 40,
+                "prompt_tokens_details": {"cached_tokens": 768},
+            },
+        )
+        assert cached == 768
+        assert PROMPT_TOKENS_TOTAL.value(model=model, cache="hit") == 768
+        assert PROMPT_TOKENS_TOTAL.value(model=model, cache="miss") == 232
+        assert COMPLETION_TOKENS_TOTAL.value(model=model) == 40
+
+
+class _FakeRequest:
+    """Stands in for a Starlette request whose client may hang up"""
+
+    def __init__(self, disconnect_after=None):
+        self.disconnect_after = disconnect_after
+
+    async def receive(self):
+        import asyncio
+
+        if self.disconnect_after is None:
+            await asyncio.Event().wait()
+        await asyncio.sleep(self.disconnect_after)
+        return {"type": "http.disconnect"}
+
+
+class TestCancellation:
+    """Tests for cancelling generations nobody will read"""
+
+    def _run(self, monkeypatch, work, request, turn=None, newer_after=None):
+        import asyncio
+
+        import server
+        from state import MemoryState
+
+        state = MemoryState()
+        monkeypatch.setattr(server, "shared_state", state)
+        monkeypatch.setattr(server, "CHAT_SUPERSEDE_POLL_SECONDS", 0.01)
+
+        async def go():
+            if turn is not None:
+                await state.set("turn", "s1", turn)
+            if newer_after is not None:
+
+                async def newer():
+                    await asyncio.sleep(newer_after)
+                    await state.set("turn", "s1", "newer")
+
+                asyncio.ensure_future(newer())
+            return await server._cancellable(work(), request, "s1", turn)
+
+        return asyncio.run(go())
+
+    def test_result_passes_through(self, monkeypatch):
+        """Work that finishes first returns its result"""
+
+        async def work():
+            return "reply"
+
+        assert self._run(monkeypatch, work, _FakeRequest(), turn="t1") == "reply"
+
+    def test_disconnect_cancels_work(self, monkeypatch):
+        """A client disconnect cancels the work and raises 499"""
+        import asyncio
+
+        from fastapi import HTTPException
+
+        import server
+
+        cancelled = []
+
+        async def work():
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        before = server.CHAT_CANCELLED_TOTAL.value(reason="disconnect")
+        with pytest.raises(HTTPException) as exc:
+            self._run(monkeypatch, work, _FakeRequest(disconnect_after=0.01))
+        assert exc.value.status_code == 499
+        assert cancelled == [True]
+        assert server.CHAT_CANCELLED_TOTAL.value(reason="disconnect") == before + 1
+
+    def test_newer_turn_supersedes(self, monkeypatch):
+        """A newer turn for the session cancels the older one with 409"""
+        import asyncio
+
+        from fastapi import HTTPException
+
+        async def work():
+            await asyncio.sleep(5)
+
+        with pytest.raises(HTTPException) as exc:
+            self._run(monkeypatch, work, _FakeRequest(), turn="t1", newer_after=0.02)
+        assert exc.value.status_code == 409
+
+
+class TestBatchHeadroom:
+    """Tests for batch admission under overload"""
+
+    def test_stale_overload_level_recovers_without_live_chats(self, monkeypatch):
+        """Batch workers re-measure pressure instead of waiting on a stale level"""
+        import asyncio
+
+        import server
+        from limiter import AdaptiveLimiter
+        from overload import OverloadController
+
+        controller = OverloadController(cool_down=0.05)
+        controller.update({"queue": 0.6}, now=0.0)
+        assert controller.level == 1
+        monkeypatch.setattr(server, "overload", controller)
+        monkeypatch.setattr(server, "OVERLOAD_ENABLED", True)
+        monkeypatch.setattr(server, "upstream_limiter", AdaptiveLimiter(initial=8))
+
+        asyncio.run(asyncio.wait_for(server._wait_for_batch_headroom(), timeout=2.0))
+        assert controller.level == 0
@@ -0,0 +1,129 @@
+"""
+Unit tests for warm-restart snapshots
+"""
+
+import asyncio
+import os
+import time
+
+import pytest
+
+import snapshot
+from snapshot import SnapshotError, Snapshotter
+
+
+def _write(path, sections, schema=1, now=None):
+    snapshot.write(str(path), snapshot.encode(sections, schema, now=now))
+
+
+class TestFileFormat:
+    """Tests for reading and validating snapshot files"""
+
+    def test_round_trip(self, tmp_path):
+        """Sections come back as written, with their write time"""
+        path = tmp_path / "snap.bin"
+        _write(path, {"limiter": {"limit": 12.5}}, now=1000.0)
+        sections, written_at = snapshot.read(str(path), schema=1)
+        assert sections == {"limiter": {"limit": 12.5}}
+        assert written_at == 1000.0
+        assert not [p for p in os.listdir(tmp_path) if p.endswith(".tmp")]
+
+    @pytest.mark.parametrize(
+        "damage, reason",
+        [
+            (lambda raw: raw[:-3] + b"xyz", "corrupt"),
+            (lambda raw: raw[:10], "corrupt"),
+            (lambda raw: raw[:-1], "corrupt"),
+            (lambda raw: b"NOTASNAP" + raw[8:], "corrupt"),
+            (lambda raw: raw[:8] + b"\x09\x00" + raw[10:], "incompatible"),
+        ],
+    )
+    def test_damaged_file_is_rejected(self, tmp_path, damage, reason):
+        """Checksum, length, magic and format version are all checked"""
+        path = tmp_path / "snap.bin"
+        _write(path, {"a": [1, 2, 3]})
+        path.write_bytes(damage(path.read_bytes()))
+        with pytest.raises(SnapshotError) as e:
+            snapshot.read(str(path), schema=1)
+        assert e.value.reason == reason
+
+    def test_schema_mismatch(self, tmp_path):
+        """A snapshot from another schema is ignored"""
+        path = tmp_path / "snap.bin"
+        _write(path, {"a": 1}, schema=1)
+        with pytest.raises(SnapshotError) as e:
+            snapshot.read(str(path), schema=2)
+        assert e.value.reason == "incompatible"
+
+    def test_stale(self, tmp_path):
+        """Snapshots older than max_age are ignored"""
+        path = tmp_path / "snap.bin"
+        _write(path, {"a": 1}, now=time.time() - 7200)
+        with pytest.raises(SnapshotError) as e:
+            snapshot.read(str(path), schema=1, max_age=3600)
+        assert e.value.reason == "stale"
+
+    def test_missing(self, tmp_path):
+        """No file is its own, quiet, reason"""
+        with pytest.raises(SnapshotError) as e:
+            snapshot.read(str(tmp_path / "nope.bin"), schema=1)
+        assert e.value.reason == "missing"
+
+
+class TestSnapshotter:
+    """Tests for section registration, save and restore"""
+
+    def test_save_then_restore(self, tmp_path):
+        """Each section's dump is handed back to its restore"""
+        path = str(tmp_path / "snap.bin")
+        writer = Snapshotter(path)
+        writer.register("a", lambda: {"x": 1}, lambda data: None)
+        writer.register("b", lambda: [1, 2], lambda data: None)
+        assert asyncio.run(writer.save())
+
+        got = {}
+        reader = Snapshotter(path)
+        reader.register("a", lambda: None, lambda data: got.setdefault("a", data))
+        reader.register("b", lambda: None, lambda data: got.setdefault("b", data))
+        reader.register("c", lambda: None, lambda data: got.setdefault("c", data))
+        assert reader.restore() == "loaded"
+        assert got == {"a": {"x": 1}, "b": [1, 2]}
+
+    def test_bad_section_does_not_block_others(self, tmp_path):
+        """A section that fails to restore is skipped"""
+        path = str(tmp_path / "snap.bin")
+        _write(path, {"bad": 1, "good": 2})
+
+        def explode(data):
+            raise ValueError("nope")
+
+        got = []
+        store = Snapshotter(path)
+        store.register("bad", lambda: None, explode)
+        store.register("good", lambda: None, got.append)
+        assert store.restore() == "loaded"
+        assert got == [2]
+
+    def test_invalid_file_leaves_state_cold(self, tmp_path):
+        """A corrupt snapshot restores nothing and reports why"""
+        path = tmp_path / "snap.bin"
+        path.write_bytes(b"garbage" * 10)
+        got = []
+        store = Snapshotter(str(path))
+        store.register("a", lambda: None, got.append)
+        assert store.restore() == "corrupt"
+        assert got == []
+
+    def test_periodic_save(self, tmp_path):
+        """start() writes on the interval until stop()"""
+        path = str(tmp_path / "snap.bin")
+        store = Snapshotter(path, interval=0.01)
+        store.register("a", lambda: 1, lambda data: None)
+
+        async def scenario():
+            store.start()
+            await asyncio.sleep(0.05)
+            await store.stop()
+
+        asyncio.run(scenario())
+        assert snapshot.read(path, schema=1)[0] == {"a": 1}
@@ -0,0 +1,134 @@
+"""
+Unit tests for the shared state backends
+"""
+import asyncio
+import multiprocessing
+
+import pytest
+
+from state import MemoryState, SqliteState, create_state
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def state(request, tmp_path):
+    backend = MemoryState() if request.param == "memory" else SqliteState(str(tmp_path / "s.db"))
+    yield backend
+    backend.close()
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+class TestStateBackends:
+    """Behavior shared by every backend"""
+
+    def test_get_set_delete(self, state):
+        """Values round-trip and can be deleted"""
+
+        async def scenario():
+            await state.set("ns", "k", "v")
+            got = await state.get("ns", "k")
+            await state.delete("ns", "k")
+            return got, await state.get("ns", "k")
+
+        assert _run(scenario()) == ("v", None)
+
+    def test_add_is_put_if_absent(self, state):
+        """add() only stores when the key is free"""
+
+        async def scenario():
+            return await state.add("ns", "k", "a"), await state.add("ns", "k", "b")
+
+        assert _run(scenario()) == (True, False)
+
+    def test_expired_entries_are_gone(self, state):
+        """Expired entries read as missing and can be re-added"""
+
+        async def scenario():
+            await state.set("ns", "k", "v", ttl=0.01)
+            await asyncio.sleep(0.03)
+            return await state.get("ns", "k"), await state.add("ns", "k", "new", ttl=10)
+
+        assert _run(scenario()) == (None, True)
+
+    def test_incr(self, state):
+        """Counters accumulate and restart after expiry"""
+
+        async def scenario():
+            a = await state.incr("rate", "s", ttl=0.05)
+            b = await state.incr("rate", "s", 2, ttl=0.05)
+            await asyncio.sleep(0.08)
+            c = await state.incr("rate", "s", ttl=0.05)
+            return a, b, c
+
+        assert _run(scenario()) == (1, 3, 1)
+
+
+class TestMemorySnapshot:
+    """dump()/load() carry memory-backend entries across a restart"""
+
+    def test_round_trip_keeps_ttl_and_filters_namespaces(self):
+        """Only the asked-for namespaces are dumped, with their remaining TTL"""
+
+        async def scenario():
+            old = MemoryState()
+            await old.set("summary", "s1", "text", ttl=100)
+            await old.set("summary", "s2", "forever")
+            await old.set("idem", "k", "skip")
+            items = old.dump(["summary"])
+            new = MemoryState()
+            loaded = new.load(items)
+            return items, loaded, await new.get("summary", "s1"), await new.get("idem", "k")
+
+        items, loaded, text, skipped = _run(scenario())
+        assert loaded == 2 and text == "text" and skipped is None
+        ttls = {key: ttl for _, key, _, ttl in items}
+        assert ttls["s2"] is None and 99 < ttls["s1"] <= 100
+
+    def test_load_keeps_newer_values(self):
+        """Entries written since start-up win over the snapshot"""
+
+        async def scenario():
+            state = MemoryState()
+            await state.set("summary", "s1", "new")
+            state.load([["summary", "s1", "old", None]])
+            return await state.get("summary", "s1")
+
+        assert _run(scenario()) == "new"
+
+
+def _bump(path, n):
+    async def go():
+        s = SqliteState(path)
+        for _ in range(n):
+            await s.incr("rate", "shared")
+        s.close()
+
+    asyncio.run(go())
+
+
+class TestSqliteAcrossProcesses:
+    """The SQLite backend is what makes multiple workers agree"""
+
+    def test_counters_are_shared_between_processes(self, tmp_path):
+        """Increments from several processes should all land"""
+        path = str(tmp_path / "shared.db")
+        procs = [multiprocessing.Process(target=_bump, args=(path, 50)) for _ in range(3)]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join(timeout=30)
+        s = SqliteState(path)
+        total = _run(s.get("rate", "shared"))
+        s.close()
+        assert total == "150"
+
+    def test_create_state(self, tmp_path):
+        """STATE_BACKEND selects the implementation"""
+        assert create_state({}).kind == "memory"
+        s = create_state({"STATE_BACKEND": "sqlite", "STATE_PATH": str(tmp_path / "x.db")})
+        assert s.kind == "sqlite"
+        s.close()
+        with pytest.raises(ValueError):
+            create_state({"STATE_BACKEND": "redis"})
@@ -0,0 +1,110 @@
+"""
+Unit tests for the rolling conversation summary
+"""
+import asyncio
+
+from server import _build_system_message
+from state import MemoryState
+from summary import ConversationSummarizer
+
+
+def _lines(n):
+    return [f"You: line {i}" if i % 2 == 0 else f"Other You: line {i}" for i in range(n)]
+
+
+class TestConversationSummarizer:
+    """Tests for background summarization and cache validation"""
+
+    def test_background_summary_then_hit(self):
+        """A scheduled refresh should populate the cache for the next turn"""
+        calls = []
+
+        async def summarize(previous, lines):
+            calls.append((previous, list(lines)))
+            return f"summary of {len(lines)}"
+
+        async def scenario():
+            s = ConversationSummarizer(summarize, MemoryState(), batch=4)
+            older = _lines(6)
+            assert await s.lookup("sess", older) is None
+            assert await s.schedule("sess", older) is True
+            await asyncio.sleep(0.01)
+            return s, await s.lookup("sess", older + ["You: more"])
+
+        s, hit = asyncio.run(scenario())
+        assert hit == "summary of 6"
+        assert calls == [(None, _lines(6))]
+
+    def test_incremental_refresh_passes_previous(self):
+        """Later refreshes should only send newly aged-out lines"""
+        seen = []
+
+        async def summarize(previous, lines):
+            seen.append((previous, len(lines)))
+            return f"v{len(seen)}"
+
+        async def scenario():
+            s = ConversationSummarizer(summarize, MemoryState(), batch=2)
+            await s.schedule("sess", _lines(4))
+            await asyncio.sleep(0.01)
+            await s.schedule("sess", _lines(7))
+            await asyncio.sleep(0.01)
+            return await s.lookup("sess", _lines(7))
+
+        assert asyncio.run(scenario()) == "v2"
+        assert seen == [(None, 4), ("v1", 3)]
+
+    def test_edited_history_misses(self):
+        """A different transcript prefix must not reuse the summary"""
+
+        async def summarize(previous, lines):
+            return "stale"
+
+        async def scenario():
+            s = ConversationSummarizer(summarize, MemoryState(), batch=1)
+            await s.schedule("sess", _lines(4))
+            await asyncio.sleep(0.01)
+            return await s.lookup("sess", ["You: something else"] + _lines(4)[1:])
+
+        assert asyncio.run(scenario()) is None
+
+    def test_lock_prevents_duplicate_refresh(self):
+        """A refresh already claimed by another worker should not rerun"""
+
+        async def summarize(previous, lines):
+            raise AssertionError("should not be called")
+
+        async def scenario():
+            state = MemoryState()
+            await state.add("summary-lock", "sess", "1", ttl=60)
+            s = ConversationSummarizer(summarize, state, batch=1)
+            return await s.schedule("sess", _lines(4))
+
+        assert asyncio.run(scenario()) is False
+
+    def test_below_batch_does_not_schedule(self):
+        """Too few aged-out lines should not trigger a model call"""
+
+        async def summarize(previous, lines):
+            raise AssertionError("should not be called")
+
+        async def scenario():
+            s = ConversationSummarizer(summarize, MemoryState(), batch=4)
+            return await s.schedule("sess", _lines(2))
+
+        assert asyncio.run(scenario()) is False
+
+
+class TestMemoryInPrompt:
+    """Tests for injecting the summary into the system prompt"""
+
+    def test_memory_block_included(self):
+        """A summary should appear in the system prompt"""
+        msg = _build_system_message("I left", "mild", memory="They met Dana in Reno.")
+        assert "EARLIER IN THIS CONVERSATION" in msg
+        assert "They met Dana in Reno." in msg
+
+    def test_no_memory_block_by_default(self):
+        """Without a summary the prompt is unchanged"""
+        msg = _build_system_message("I left", "mild")
+        assert "EARLIER IN THIS CONVERSATION" not in msg
@@ -0,0 +1,132 @@
+"""
+Unit tests for traffic capture and replay helpers
+"""
+
+import asyncio
+import json
+import socket
+
+import httpx
+import pytest
+
+import mock_upstream
+from cli import (
+    BackgroundServer,
+    ServerStartError,
+    _replay,
+    percentiles,
+    synthesize_request,
+)
+from server import ChatMessage
+from traffic import TrafficRecorder, load_capture
+
+
+def _messages():
+    return [
+        ChatMessage(role="user", content="my secret plan"),
+        ChatMessage(role="assistant", content="tell me more"),
+    ]
+
+
+class TestTrafficRecorder:
+    """Tests for sanitized capture records"""
+
+    def test_shape_keeps_no_content(self, tmp_path):
+        """Records should carry lengths and roles, never raw text"""
+        rec = TrafficRecorder(tmp_path / "cap.jsonl")
+        shape = rec.shape("I chose the road", "savage", _messages(), "session-1")
+        rec.close()
+        assert shape["messages"] == [
+            {"role": "user", "length": 14},
+            {"role": "assistant", "length": 12},
+        ]
+        assert "secret" not in str(shape)
+        assert shape["session"] != "session-1"
+
+    def test_hash_content_option(self, tmp_path):
+        """Hashed content should be stable and not reversible text"""
+        rec = TrafficRecorder(tmp_path / "cap.jsonl", hash_content=True)
+        a = rec.shape("fork", "mild", _messages(), "s")
+        b = rec.shape("fork", "mild", _messages(), "s")
+        rec.close()
+        assert a["messages"][0]["hash"] == b["messages"][0]["hash"]
+        assert b["interArrivalSeconds"] is not None
+
+    def test_roundtrip(self, tmp_path):
+        """Recorded lines should load back in order"""
+        path = tmp_path / "cap.jsonl"
+        rec = TrafficRecorder(path)
+        for i in range(3):
+            shape = rec.shape("fork", "mild", _messages(), f"s{i}")
+            shape["latencySeconds"] = 0.1 * i
+            rec.record(shape)
+        rec.close()
+        loaded = load_capture(path)
+        assert [r["latencySeconds"] for r in loaded] == [0.0, 0.1, 0.2]
+
+
+class TestReplayHelpers:
+    """Tests for request synthesis and latency reporting"""
+
+    def test_synthesize_request_matches_shape(self):
+        """Synthesized bodies should reproduce recorded lengths and sessions"""
+        record = {
+            "session": "abc",
+            "intensity": "brutal",
+            "forkLength": 30,
+            "messages": [{"role": "user", "length": 50}],
+        }
+        sessions = {}
+        body = synthesize_request(record, sessions)
+        again = synthesize_request(record, sessions)
+        assert body["intensity"] == "brutal"
+        assert len(body["messages"][0]["content"]) == 50
+        assert body["sessionId"] == again["sessionId"]
+
+    def test_replay_serializes_turns_per_session(self):
+        """At speed 0 sessions overlap, but one session's turns never do"""
+        inflight = {}
+        peak = {}
+
+        async def handler(request):
+            session = json.loads(request.content)["sessionId"]
+            inflight[session] = inflight.get(session, 0) + 1
+            peak[session] = max(peak.get(session, 0), inflight[session])
+            peak["all"] = max(peak.get("all", 0), sum(inflight.values()))
+            await asyncio.sleep(0.02)
+            inflight[session] -= 1
+            return httpx.Response(200, json={"reply": "ok"})
+
+        records = [
+            {"session": s, "intensity": "mild", "messages": []}
+            for s in ("a", "b", "a", "b", "a")
+        ]
+        report = asyncio.run(
+            _replay(records, "http://fork.test", 0, 5, httpx.MockTransport(handler))
+        )
+        assert report["statuses"] == {"200": 5}
+        assert peak.pop("all") == 2
+        assert list(peak.values()) == [1, 1]
+
+    def test_percentiles(self):
+        """Percentiles should come from the sorted sample"""
+        dist = percentiles([0.3, 0.1, 0.2])
+        assert dist["p50"] == 0.2
+        assert dist["max"] == 0.3
+
+
+class TestBackgroundServer:
+    """Tests for the mock upstream's server thread"""
+
+    @pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+    def test_port_in_use_fails_fast(self):
+        """A server that can't bind raises instead of waiting forever"""
+        with socket.socket() as taken:
+            taken.bind(("127.0.0.1", 0))
+            taken.listen()
+            port = taken.getsockname()[1]
+            server = BackgroundServer(
+                mock_upstream.create_app([0.0]), "127.0.0.1", port
+            )
+            with pytest.raises(ServerStartError, match="failed to start"):
+                server.__enter__()
@@ -0,0 +1,206 @@
+"""
+Unit tests for the latency-aware upstream pool
+"""
+
+import asyncio
+import time
+
+import httpx
+
+from upstream import UpstreamEntry, UpstreamPool, parse_retry_after
+
+
+def _ok(request):
+    return httpx.Response(
+        200,
+        json={"choices": [{"message": {"content": "hi"}}]},
+        headers={"x-ratelimit-remaining": "41"},
+    )
+
+
+class TestUpstreamEntry:
+    """Tests for per-entry statistics"""
+
+    def test_ewma_latency(self):
+        """Latency should move toward new samples by alpha"""
+        e = UpstreamEntry("https://a.example/v1", "key-1234", alpha=0.5)
+        e.observe(200, 1.0, {}, now=0.0, cooldown=30)
+        e.observe(200, 3.0, {}, now=0.0, cooldown=30)
+        assert e.ewma_latency == 2.0
+        assert e.name == "a.example#1234"
+
+    def test_side_traffic_skips_latency(self):
+        """Calls marked sample_latency=False still count but leave the EWMA alone"""
+        e = UpstreamEntry("https://a.example/v1", "k")
+        e.observe(200, 0.2, {}, now=0.0, cooldown=30, sample_latency=False)
+        e.observe(500, 0.2, {}, now=0.0, cooldown=30, sample_latency=False)
+        assert e.ewma_latency is None
+        assert e.requests == 2 and e.errors == 1
+
+    def test_429_cools_down_with_retry_after(self):
+        """A 429 should bench the entry for Retry-After seconds"""
+        e = UpstreamEntry("https://a.example/v1", "k")
+        e.observe(429, 0.1, {"retry-after": "7"}, now=100.0, cooldown=30)
+        assert not e.available(105.0)
+        assert e.available(107.5)
+        assert e.throttled == 1
+
+    def test_stats_round_trip(self):
+        """Learned stats survive dump/load; per-process counters don't"""
+        e = UpstreamEntry("https://a.example/v1", "key-1234")
+        e.observe(200, 1.5, {"x-ratelimit-remaining": "9"}, now=0.0, cooldown=30)
+        fresh = UpstreamEntry("https://a.example/v1", "key-1234")
+        fresh.load_stats(e.dump_stats())
+        assert fresh.ewma_latency == 1.5
+        assert fresh.ratelimit_remaining == 9
+        assert fresh.requests == 0
+
+    def test_auth_failure_benches_entry_for_longer(self):
+        """A 401/402/403 is an error and cools down longer than a 5xx"""
+        e = UpstreamEntry("https://a.example/v1", "k")
+        e.observe(402, 0.1, {}, now=100.0, cooldown=30)
+        assert e.errors == 1
+        assert e.ewma_latency is None
+        assert not e.available(200.0)
+        assert e.available(401.0)
+
+    def test_parse_retry_after(self):
+        """Retry-After accepts seconds and ignores junk"""
+        assert parse_retry_after("3") == 3.0
+        assert parse_retry_after("soon") is None
+        assert parse_retry_after(None) is None
+
+
+class TestUpstreamPool:
+    """Tests for routing decisions"""
+
+    def test_from_env_builds_cross_product(self):
+        """Each base URL should be paired with each key"""
+        pool = UpstreamPool.from_env(
+            {
+                "OPENROUTER_BASE_URLS": "https://a.example/v1, http://localhost:9100",
+                "OPENROUTER_API_KEYS": "k1,k2",
+            }
+        )
+        assert len(pool.entries) == 4
+
+    def test_prefers_lower_latency_healthy_entry(self):
+        """The faster entry wins; a cooling entry is skipped"""
+        fast = UpstreamEntry("https://fast.example", "k")
+        slow = UpstreamEntry("https://slow.example", "k")
+        fast.ewma_latency, slow.ewma_latency = 0.5, 2.0
+        pool = UpstreamPool([slow, fast])
+        assert pool.choose() is fast
+        fast.cool_down(1e9, now=0)
+        assert pool.choose() is slow
+
+    def test_unmeasured_entry_scores_as_average(self):
+        """A fresh entry is neither preferred over nor starved by measured ones"""
+        fresh = UpstreamEntry("https://fresh.example", "k")
+        fast = UpstreamEntry("https://fast.example", "k")
+        slow = UpstreamEntry("https://slow.example", "k")
+        fast.ewma_latency, slow.ewma_latency = 0.5, 2.5
+        pool = UpstreamPool([slow, fresh, fast])
+        assert pool.choose() is fast
+        fast.cool_down(1e9, now=0)
+        assert pool.choose() is fresh
+
+    def test_rejected_key_loses_traffic(self):
+        """A key that always gets 401 is benched instead of winning on score"""
+        calls = []
+
+        def handler(request):
+            key = request.headers["authorization"].rsplit("-", 1)[-1]
+            calls.append(key)
+            if key == "bad":
+                return httpx.Response(401, json={"error": "invalid key"})
+            return _ok(request)
+
+        bad = UpstreamEntry("https://a.example", "key-bad")
+        good = UpstreamEntry("https://a.example", "key-good")
+        pool = UpstreamPool([bad, good], transport=httpx.MockTransport(handler))
+
+        async def run():
+            try:
+                return [
+                    (await pool.post_chat({"model": "m", "messages": []}))[0]
+                    for _ in range(20)
+                ]
+            finally:
+                await pool.aclose()
+
+        responses = asyncio.run(run())
+        assert [r.status_code for r in responses] == [200] * 20
+        assert calls.count("bad") == 1
+        assert calls.count("good") == 20
+        snap = {s["name"]: s for s in pool.snapshot()}
+        assert snap["a.example#-bad"]["healthy"] is False
+        assert snap["a.example#-bad"]["errors"] == 1
+
+    def test_load_stats_matches_by_name(self):
+        """Stats only go to entries that still exist after a config change"""
+        old = UpstreamPool([UpstreamEntry("https://a.example", "k1")])
+        old.entries[0].ewma_latency = 0.7
+        new = UpstreamPool(
+            [
+                UpstreamEntry("https://a.example", "k1"),
+                UpstreamEntry("https://b.example", "k1"),
+            ]
+        )
+        assert new.load_stats(old.dump_stats()) == 1
+        assert [e.ewma_latency for e in new.entries] == [0.7, None]
+
+    def test_fails_over_on_429(self):
+        """A throttled entry should hand the request to the next one"""
+        calls = []
+
+        def handler(request):
+            calls.append(request.url.host)
+            if request.url.host == "a.example":
+                return httpx.Response(429, headers={"retry-after": "30"})
+            return _ok(request)
+
+        a = UpstreamEntry("https://a.example", "k")
+        b = UpstreamEntry("https://b.example", "k")
+        b.ewma_latency = 1.0  # a is unmeasured, so it is tried first
+        pool = UpstreamPool([a, b], transport=httpx.MockTransport(handler))
+
+        async def run():
+            try:
+                return await pool.post_chat({"model": "m", "messages": []})
+            finally:
+                await pool.aclose()
+
+        response, entry = asyncio.run(run())
+        assert response.status_code == 200
+        assert entry is b
+        assert calls == ["a.example", "b.example"]
+        assert b.ratelimit_remaining == 41
+        snap = {s["name"]: s for s in pool.snapshot()}
+        assert snap["a.example#k"]["healthy"] is False
+
+
+class TestCancellation:
+    """Tests for caller cancellation of upstream calls"""
+
+    def test_cancel_does_not_penalize_entry(self):
+        """A cancelled call is neither an error nor a latency sample"""
+
+        async def slow(request):
+            await asyncio.sleep(5)
+            return _ok(request)
+
+        async def scenario():
+            entry = UpstreamEntry("https://a.example/v1", "k")
+            pool = UpstreamPool([entry], transport=httpx.MockTransport(slow))
+            task = asyncio.ensure_future(pool.post_chat({}))
+            await asyncio.sleep(0.02)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            await pool.aclose()
+            return entry
+
+        entry = asyncio.run(scenario())
+        assert entry.inflight == 0
+        assert entry.errors == 0 and entry.requests == 0
+        assert entry.available(time.monotonic())